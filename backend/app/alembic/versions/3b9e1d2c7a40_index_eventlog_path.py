@@ -0,0 +1,29 @@
+"""Index event log path
+
+Revision ID: 3b9e1d2c7a40
+Revises: 7858ffd65072
+Create Date: 2026-10-18 11:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e1d2c7a40'
+down_revision: Union[str, None] = '7858ffd65072'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Uploads are content addressed, event logs with the same content share a path
+    op.create_index(op.f('ix_eventlogs_path'), 'eventlogs', ['path'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_eventlogs_path'), table_name='eventlogs')
@@ -0,0 +1,656 @@
+import json
+import os
+import shutil
+import sys
+import uuid
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+# Code of labels that do not occur in the log. It never equals the code of an event, missing values have code -1.
+UNKNOWN = -2
+
+# Bump whenever the layout of stored compact logs changes
+STORE_VERSION = 1
+STORE_MANIFEST_FILE = "manifest.json"
+# Arrays of a stored compact log, the numeric ones are memory mapped when the log is loaded
+_STORED_ARRAYS = ("rows", "case_codes", "activity_codes", "timestamps", "offsets")
+_STORED_LABELS = ("cases", "activities")
+
+
+def _sort_labels(codes: np.ndarray, labels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Reorders the label table, so comparing codes is the same as comparing labels. Tables with values that cannot be
+    # compared with each other (e.g. mixed types) keep their order.
+    try:
+        order = np.argsort(labels, kind="stable")
+    except TypeError:
+        return codes.astype(np.int32, copy=False), labels
+
+    # The trailing -1 maps missing values (code -1) onto themselves
+    remap = np.empty(len(order) + 1, dtype=np.int32)
+    remap[order] = np.arange(len(order), dtype=np.int32)
+    remap[-1] = -1
+    return remap[codes], labels[order]
+
+
+def _encode(values) -> tuple[np.ndarray, np.ndarray]:
+    codes, labels = pd.factorize(np.asarray(values), use_na_sentinel=True)
+    return _sort_labels(codes, np.asarray(labels, dtype=object))
+
+
+def _merge_labels(labels: np.ndarray, other: np.ndarray, other_codes: np.ndarray) -> tuple[np.ndarray, np.ndarray,
+                                                                                          np.ndarray]:
+    """
+    Label table that contains the labels of both tables. Like any label table it is sorted if possible, labels that
+    cannot be compared keep the existing codes and get the other labels appended.
+    @param labels:
+    @param other:
+    @param other_codes: codes of the other labels in labels, UNKNOWN for labels that do not occur
+    @return: the merged table and the codes of labels and of other in it. Both code arrays end with -1, so indexing
+    them with code -1 (missing values) yields -1 again.
+    """
+    added = other_codes == UNKNOWN
+    merged = np.concatenate([labels, other[added]])
+    positions = other_codes.copy()
+    positions[added] = len(labels) + np.arange(added.sum(), dtype=np.int32)
+
+    codes, merged = _sort_labels(np.arange(len(merged), dtype=np.int32), merged)
+    return merged, np.append(codes[:len(labels)], np.int32(-1)), np.append(codes[positions], np.int32(-1))
+
+
+def _placement(length: int, insert: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Positions in a merged array of length + len(insert) elements, if every new element i is inserted in front of
+    the existing element insert[i]. insert must be non-decreasing.
+    @param length: number of existing elements
+    @param insert:
+    @return: positions of the existing elements and positions of the new elements
+    """
+    new_positions = insert + np.arange(len(insert))
+    is_existing = np.ones(length + len(insert), dtype=bool)
+    is_existing[new_positions] = False
+    return np.flatnonzero(is_existing), new_positions
+
+
+def _interleave(existing: np.ndarray, new: np.ndarray, positions: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    res = np.empty(len(existing) + len(new), dtype=np.result_type(existing, new))
+    res[positions[0]] = existing
+    res[positions[1]] = new
+    return res
+
+
+def to_nanoseconds(values) -> np.ndarray:
+    """
+    Converts timestamps to int64 nanoseconds since the epoch. Timezone aware timestamps are converted to UTC and naive
+    ones are interpreted as UTC, like pandas.Timestamp.timestamp() does.
+    @param values:
+    @return:
+    """
+    dtype = getattr(values, "dtype", None)
+    if not isinstance(dtype, pd.DatetimeTZDtype) and not (isinstance(dtype, np.dtype) and dtype.kind == "M"):
+        values = pd.to_datetime(values, utc=True)
+    return np.asarray(pd.DatetimeIndex(values).asi8)
+
+
+def to_seconds(nanoseconds: np.ndarray) -> np.ndarray:
+    """
+    Vectorized equivalent of pandas.Timestamp.timestamp(), i.e. seconds since the epoch rounded to microseconds.
+    @param nanoseconds:
+    @return:
+    """
+    return np.round(nanoseconds / 1e9, 6)
+
+
+def _take_labels(labels: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    res = labels.take(codes, mode="clip") if len(labels) else np.full(len(codes), np.nan, dtype=object)
+    res[codes < 0] = np.nan
+    return res
+
+
+def ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Concatenation of the ranges [starts[i], ends[i]) without a Python loop.
+    @param starts:
+    @param ends:
+    @return:
+    """
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    # every position is the start of its range plus its offset within the range
+    range_offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - range_offsets, lengths) + np.arange(total)
+
+
+class VariantIndex:
+    """
+    Variants of a compact log: every case is mapped to the id of its variant, i.e. of the sequence of activity codes
+    of its trace. Variant ids are assigned in order of the first case (by code) of the variant.
+    """
+
+    def __init__(self, case_variants: np.ndarray, sequences: list[tuple[int, ...]]):
+        # variant id of every case code, -1 for cases without events
+        self.case_variants = case_variants
+        self.sequences = sequences
+        # number of cases of every variant
+        self.counts = np.bincount(case_variants[case_variants >= 0], minlength=len(sequences))
+
+    @property
+    def nbytes(self) -> int:
+        return self.case_variants.nbytes + self.counts.nbytes + sys.getsizeof(self.sequences) + \
+            sum(sys.getsizeof(sequence) for sequence in self.sequences)
+
+    @classmethod
+    def build(cls, log: "CompactLog") -> "VariantIndex":
+        case_variants = np.full(len(log.cases), -1, dtype=np.int32)
+        ids = {}
+        cls.__assign(log, range(len(log.cases)), case_variants, ids)
+        return cls(case_variants, list(ids))
+
+    @staticmethod
+    def __assign(log: "CompactLog", cases, case_variants: np.ndarray, ids: dict) -> None:
+        # assigns the variant of every given case, unknown sequences get the next free id
+        activity_codes = log.activity_codes.tolist()
+        offsets = log.offsets.tolist()
+        for case in cases:
+            if offsets[case] == offsets[case + 1]:
+                case_variants[case] = -1
+                continue
+            sequence = tuple(activity_codes[offsets[case]:offsets[case + 1]])
+            case_variants[case] = ids.setdefault(sequence, len(ids))
+
+    def update(self, log: "CompactLog", case_remap: np.ndarray, activity_remap: np.ndarray,
+               affected: np.ndarray) -> "VariantIndex":
+        """
+        Index of a log that was extended by CompactLog.append. Only the traces of the affected cases are read, the
+        variants of all other cases are taken over. The ids are renumbered afterwards, so the index equals the one
+        built from scratch.
+        @param log: the extended log
+        @param case_remap: codes of the cases of this index in the extended log
+        @param activity_remap: codes of the activities of this index in the extended log
+        @param affected: codes of the cases with appended events in the extended log
+        @return:
+        """
+        case_variants = np.full(len(log.cases), -1, dtype=np.int32)
+        case_variants[case_remap[:-1]] = self.case_variants
+        ids = {tuple(activity_remap[list(sequence)].tolist()): variant for variant, sequence in enumerate(self.sequences)}
+        self.__assign(log, affected.tolist(), case_variants, ids)
+
+        # ids in order of the first case of every variant, variants without cases are dropped
+        sequences = list(ids)
+        variants, first = np.unique(case_variants[case_variants >= 0], return_index=True)
+        order = variants[np.argsort(first, kind="stable")]
+        remap = np.full(len(sequences) + 1, -1, dtype=np.int32)
+        remap[order] = np.arange(len(order), dtype=np.int32)
+        return VariantIndex(remap[case_variants], [sequences[variant] for variant in order.tolist()])
+
+    def restrict(self, case_codes: np.ndarray) -> "VariantIndex":
+        """
+        Index of the given cases only, the variant ids stay the same.
+        @param case_codes:
+        @return:
+        """
+        case_variants = np.full(len(self.case_variants), -1, dtype=np.int32)
+        case_codes = case_codes[case_codes >= 0]
+        case_variants[case_codes] = self.case_variants[case_codes]
+        return VariantIndex(case_variants, self.sequences)
+
+    def cases_starting_with(self, activity_codes: np.ndarray) -> np.ndarray:
+        """
+        Codes of the cases whose trace starts with the given activities, in ascending order. Prefixes are matched on
+        purpose instead of whole traces: a variant filter has always selected the longer traces that continue the
+        variant as well.
+        @param activity_codes:
+        @return:
+        """
+        prefix = tuple(activity_codes.tolist())
+        variants = [i for i, sequence in enumerate(self.sequences) if sequence[:len(prefix)] == prefix]
+        return np.flatnonzero(np.isin(self.case_variants, variants))
+
+    def most_common(self, case_codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Variants of the given cases, ordered by the number of cases like Counter.most_common: variants with the same
+        count keep the order of their first case.
+        @param case_codes: codes of distinct cases in ascending order
+        @return: ids and counts of the variants
+        """
+        case_variants = self.case_variants[case_codes]
+        case_variants = case_variants[case_variants >= 0]
+        if len(case_variants) == len(self.case_variants):
+            # every case of the log, so the counts are known already and the ids follow the order of the first cases
+            variants = first = np.arange(len(self.sequences))
+            counts = self.counts
+        else:
+            variants, first, counts = np.unique(case_variants, return_index=True, return_counts=True)
+        order = np.lexsort((first, -counts))
+        return variants[order], counts[order]
+
+
+class DirectlyFollowsIndex:
+    """
+    Occurrences of every directly-follows pair of a compact log, i.e. of every two consecutive events of a case. The
+    occurrences are grouped by (start activity, end activity), so a segment only has to look at its own occurrences.
+    Pairs are keyed by start code * number of activities + end code, missing activities count as one more activity.
+    """
+
+    def __init__(self, keys: np.ndarray, bounds: np.ndarray, starts: np.ndarray, activity_count: int):
+        # distinct pair keys in ascending order, the occurrences of keys[i] are starts[bounds[i]:bounds[i + 1]]
+        self.keys = keys
+        self.bounds = bounds
+        # position of the start event of every occurrence, the end event is the next position
+        self.starts = starts
+        self.activity_count = activity_count
+
+    @property
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.bounds.nbytes + self.starts.nbytes
+
+    @staticmethod
+    def __pair_keys(log: "CompactLog", starts: np.ndarray, activity_count: int) -> np.ndarray:
+        # codes are shifted by one, so missing activities (-1) get the code 0
+        return (log.activity_codes[starts].astype(np.int64) + 1) * activity_count + log.activity_codes[starts + 1] + 1
+
+    @classmethod
+    def __grouped(cls, pair_keys: np.ndarray, starts: np.ndarray, activity_count: int) -> "DirectlyFollowsIndex":
+        # pair_keys must be sorted, every run of equal keys is a group
+        is_first = np.ones(len(pair_keys), dtype=bool)
+        is_first[1:] = pair_keys[1:] != pair_keys[:-1]
+        bounds = np.append(np.flatnonzero(is_first), len(pair_keys)).astype(np.int64)
+        return cls(pair_keys[is_first], bounds, starts, activity_count)
+
+    @classmethod
+    def build(cls, log: "CompactLog") -> "DirectlyFollowsIndex":
+        activity_count = len(log.activities) + 1
+        starts = np.flatnonzero(log.case_codes[:-1] == log.case_codes[1:])
+        pair_keys = cls.__pair_keys(log, starts, activity_count)
+
+        # stable, so the occurrences of every pair stay in log order
+        order = np.argsort(pair_keys, kind="stable")
+        return cls.__grouped(pair_keys[order], starts[order], activity_count)
+
+    def update(self, log: "CompactLog", positions: np.ndarray, affected: np.ndarray) -> "DirectlyFollowsIndex":
+        """
+        Index of a log that was extended by CompactLog.append. Only the pairs of the affected cases are read, the
+        pairs of all other cases are moved to their new positions. Remapping the codes keeps the order of the pair
+        keys, so the existing and the new pairs are merged instead of sorting all pairs again.
+        @param log: the extended log
+        @param positions: positions of the events of this index in the extended log
+        @param affected: codes of the cases with appended events in the extended log
+        @return:
+        """
+        activity_count = len(log.activities) + 1
+        starts = positions[self.starts]
+        starts = starts[~np.isin(log.case_codes[starts], affected)]
+        keys = self.__pair_keys(log, starts, activity_count)
+
+        added = log.positions_of_cases(affected)
+        added = added[added + 1 < len(log)]
+        added = added[log.case_codes[added] == log.case_codes[added + 1]]
+        added_keys = self.__pair_keys(log, added, activity_count)
+        order = np.lexsort((added, added_keys))
+        added, added_keys = added[order], added_keys[order]
+
+        if activity_count ** 2 * (len(log) + 1) >= np.iinfo(np.int64).max:
+            # the composite key below would overflow, so all pairs are sorted again
+            keys, starts = np.concatenate([keys, added_keys]), np.concatenate([starts, added])
+            order = np.lexsort((starts, keys))
+            return self.__grouped(keys[order], starts[order], activity_count)
+
+        # pairs are ordered by key and position, with a composite key the merge is a single binary search
+        insert = np.searchsorted(keys * len(log) + starts, added_keys * len(log) + added)
+        placement = _placement(len(starts), insert)
+        return self.__grouped(_interleave(keys, added_keys, placement), _interleave(starts, added, placement),
+                              activity_count)
+
+    def occurrences(self, start_code: int, end_code: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Positions of the start and of the end events of all occurrences of the pair, in log order.
+        @param start_code:
+        @param end_code:
+        @return:
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if start_code == UNKNOWN or end_code == UNKNOWN:
+            return empty, empty
+
+        key = (start_code + 1) * self.activity_count + end_code + 1
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return empty, empty
+        starts = self.starts[self.bounds[i]:self.bounds[i + 1]]
+        return starts, starts + 1
+
+
+class CompactLog:
+    """
+    Dictionary encoded representation of the three columns the miners work on. Cases and activities are stored as
+    int32 codes into label tables and timestamps as int64 nanoseconds since the epoch, so a cached log only costs
+    a few bytes per event instead of a row of Python objects. Case codes follow the sorted order of the case labels,
+    which makes sorting by code equivalent to sorting by label.
+    The events are sorted by case and timestamp once when the log is built (events with equal timestamps keep the
+    order of the log), "positions" of events always refer to that order. The events of the case with code c are the
+    positions offsets[c] to offsets[c + 1], so traces are slices and never have to be grouped or sorted again.
+    Events without a case are dropped, as they never belong to a trace.
+    """
+
+    def __init__(self, rows: np.ndarray, case_codes: np.ndarray, cases: np.ndarray, activity_codes: np.ndarray,
+                 activities: np.ndarray, timestamps: np.ndarray, offsets: np.ndarray):
+        # row of every event in the original log
+        self.rows = rows
+        self.case_codes = case_codes
+        self.activity_codes = activity_codes
+        self.timestamps = timestamps
+        self.cases = cases
+        self.activities = activities
+        self.offsets = offsets
+
+        self.__case_lookup = None
+        self.__activity_lookup = None
+        self.__variants = None
+        self.__directly_follows = None
+        self.__index_built = None
+
+    @staticmethod
+    def index_dtype(length: int):
+        return np.int32 if length < np.iinfo(np.int32).max else np.int64
+
+    @classmethod
+    def build(cls, case_codes: np.ndarray, cases: np.ndarray, activity_codes: np.ndarray, activities: np.ndarray,
+              timestamps: np.ndarray) -> "CompactLog":
+        """
+        Sorts encoded columns in log order by case and timestamp and builds the case offsets.
+        @param case_codes:
+        @param cases:
+        @param activity_codes:
+        @param activities:
+        @param timestamps:
+        @return:
+        """
+        rows = np.flatnonzero(case_codes >= 0).astype(cls.index_dtype(len(case_codes)))
+        case_codes, activity_codes, timestamps = case_codes[rows], activity_codes[rows], timestamps[rows]
+
+        # lexsort is stable, so events with equal timestamps keep the order of the log
+        order = np.lexsort((timestamps, case_codes))
+        offsets = np.zeros(len(cases) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(case_codes, minlength=len(cases)), out=offsets[1:])
+        return cls(rows[order], case_codes[order], cases, activity_codes[order], activities, timestamps[order],
+                   offsets)
+
+    @classmethod
+    def from_columns(cls, case_ids, activities, timestamps) -> "CompactLog":
+        """
+        Builds the compact log from the raw case, activity and timestamp columns of a parsed log.
+        @param case_ids:
+        @param activities:
+        @param timestamps:
+        @return:
+        """
+        case_codes, cases = _encode(case_ids)
+        activity_codes, activity_labels = _encode(activities)
+        return cls.build(case_codes, cases, activity_codes, activity_labels, to_nanoseconds(timestamps))
+
+    @classmethod
+    def from_encoded(cls, case_codes: np.ndarray, cases: np.ndarray, activity_codes: np.ndarray,
+                     activities: np.ndarray, timestamps: np.ndarray) -> "CompactLog":
+        """
+        Builds the compact log from columns that are dictionary encoded already, e.g. the ones of a snapshot. Only
+        the label tables are sorted, the labels themselves are never decoded.
+        @param case_codes:
+        @param cases:
+        @param activity_codes:
+        @param activities:
+        @param timestamps: int64 nanoseconds since the epoch
+        @return:
+        """
+        case_codes, cases = _sort_labels(np.asarray(case_codes), np.asarray(cases, dtype=object))
+        activity_codes, activities = _sort_labels(np.asarray(activity_codes), np.asarray(activities, dtype=object))
+        return cls.build(case_codes, cases, activity_codes, activities, np.asarray(timestamps, dtype=np.int64))
+
+    def append(self, first_row: int, case_ids, activities, timestamps) -> tuple["CompactLog", np.ndarray, np.ndarray]:
+        """
+        Extends the log by additional events, e.g. the events of a later export of the same process. The existing
+        events stay sorted, so the appended events are only merged into their cases instead of sorting the log again.
+        Indexes that were built for this log already are updated for the affected cases only.
+        @param first_row: row of the first appended event in the original log, i.e. the number of existing rows
+        @param case_ids:
+        @param activities:
+        @param timestamps:
+        @return: the extended log, the positions of the events of this log in the extended log and the codes of the
+        cases with appended events
+        """
+        case_codes, cases = _encode(case_ids)
+        activity_codes, activity_labels = _encode(activities)
+        cases, case_remap, new_case_remap = _merge_labels(self.cases, cases, self.encode_cases(cases))
+        activity_labels, activity_remap, new_activity_remap = _merge_labels(
+            self.activities, activity_labels, self.encode_activities(activity_labels))
+
+        # appended events sorted by case and timestamp, like the events of a log that is built
+        rows = np.flatnonzero(case_codes >= 0)
+        case_codes, activity_codes = new_case_remap[case_codes[rows]], new_activity_remap[activity_codes[rows]]
+        new_timestamps = to_nanoseconds(timestamps)[rows]
+        order = np.lexsort((new_timestamps, case_codes))
+        rows, case_codes, activity_codes, new_timestamps = \
+            first_row + rows[order], case_codes[order], activity_codes[order], new_timestamps[order]
+
+        # remapping keeps the order of the codes, so the existing events are still sorted by case
+        counts = np.zeros(len(cases), dtype=np.int64)
+        counts[case_remap[:-1]] = np.diff(self.offsets)
+        existing_offsets = np.zeros(len(cases) + 1, dtype=np.int64)
+        np.cumsum(counts, out=existing_offsets[1:])
+
+        # appended events follow the existing events of their case with the same timestamp, like in a stable sort
+        insert = np.empty(len(rows), dtype=np.int64)
+        affected, first = np.unique(case_codes, return_index=True)
+        for case, start, end in zip(affected.tolist(), first.tolist(), np.append(first[1:], len(rows)).tolist()):
+            lower, upper = existing_offsets[case], existing_offsets[case + 1]
+            insert[start:end] = lower + np.searchsorted(self.timestamps[lower:upper], new_timestamps[start:end],
+                                                        side="right")
+
+        placement = _placement(len(self), insert)
+        offsets = np.zeros(len(cases) + 1, dtype=np.int64)
+        np.cumsum(counts + np.bincount(case_codes, minlength=len(cases)), out=offsets[1:])
+        log = CompactLog(
+            _interleave(self.rows, rows.astype(self.index_dtype(first_row + len(case_ids))), placement),
+            _interleave(case_remap[self.case_codes], case_codes, placement), cases,
+            _interleave(activity_remap[self.activity_codes], activity_codes, placement), activity_labels,
+            _interleave(self.timestamps, new_timestamps, placement), offsets
+        )
+
+        if self.__variants is not None:
+            log.__variants = self.__variants.update(log, case_remap, activity_remap, affected)
+        if self.__directly_follows is not None:
+            log.__directly_follows = self.__directly_follows.update(log, placement[0], affected)
+        return log, placement[0], affected
+
+    def save(self, directory: str, fingerprint: str) -> None:
+        """
+        Stores the log as .npy files, so other processes can map it instead of building their own copy. The files are
+        written to a temporary directory first and then moved into place.
+        @param directory:
+        @param fingerprint: fingerprint of the source the log was built from, checked when the log is loaded
+        """
+        tmp_directory = f"{directory}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp_directory)
+        try:
+            for name in _STORED_ARRAYS + _STORED_LABELS:
+                np.save(os.path.join(tmp_directory, f"{name}.npy"), getattr(self, name), allow_pickle=True)
+            with open(os.path.join(tmp_directory, STORE_MANIFEST_FILE), "w") as f:
+                json.dump({"version": STORE_VERSION, "fingerprint": fingerprint}, f)
+
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(tmp_directory, directory)
+        finally:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str, fingerprint: str) -> "CompactLog | None":
+        """
+        Maps a stored log read-only into memory. Every process that loads the same log shares the pages of the
+        numeric arrays, only the label tables are private copies.
+        @param directory:
+        @param fingerprint: fingerprint of the source the log must have been built from
+        @return: the log, or None if it is not stored or stale
+        """
+        try:
+            with open(os.path.join(directory, STORE_MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+            if manifest.get("version") != STORE_VERSION or manifest.get("fingerprint") != fingerprint:
+                return None
+
+            arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in _STORED_ARRAYS}
+            labels = {name: np.load(os.path.join(directory, f"{name}.npy"), allow_pickle=True)
+                      for name in _STORED_LABELS}
+        except (OSError, ValueError):
+            return None
+        return cls(**arrays, **labels)
+
+    def __len__(self):
+        return len(self.case_codes)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory owned by this process, including the indexes built so far. Memory mapped arrays are left out, their
+        pages are shared by all processes that map the same stored log.
+        """
+        arrays = (self.rows, self.case_codes, self.activity_codes, self.timestamps, self.offsets, self.cases,
+                  self.activities)
+        labels = sum(sys.getsizeof(label) for label in self.cases) + \
+            sum(sys.getsizeof(label) for label in self.activities)
+        indexes = sum(index.nbytes for index in (self.__variants, self.__directly_follows) if index is not None)
+        return sum(array.nbytes for array in arrays if not isinstance(array, np.memmap)) + labels + indexes
+
+    def on_index_built(self, callback: Callable[[], None] | None) -> None:
+        """
+        Registers a callback that is called whenever an index of the log was built on first use, e.g. to account for
+        its memory.
+        @param callback:
+        """
+        self.__index_built = callback
+
+    @property
+    def variants(self) -> VariantIndex:
+        """
+        Variant index of the log, built on first use.
+        """
+        if self.__variants is None:
+            self.__variants = VariantIndex.build(self)
+            if self.__index_built is not None:
+                self.__index_built()
+        return self.__variants
+
+    @property
+    def directly_follows(self) -> DirectlyFollowsIndex:
+        """
+        Directly-follows occurrence index of the log, built on first use.
+        """
+        if self.__directly_follows is None:
+            self.__directly_follows = DirectlyFollowsIndex.build(self)
+            if self.__index_built is not None:
+                self.__index_built()
+        return self.__directly_follows
+
+    @staticmethod
+    def __lookup(labels: np.ndarray) -> dict:
+        return {label: code for code, label in enumerate(labels)}
+
+    def encode_cases(self, labels) -> np.ndarray:
+        """
+        Looks up the codes of the given case labels, labels that do not occur in the log get the code UNKNOWN.
+        @param labels:
+        @return:
+        """
+        if self.__case_lookup is None:
+            self.__case_lookup = self.__lookup(self.cases)
+        return np.fromiter((self.__case_lookup.get(label, UNKNOWN) for label in labels), dtype=np.int32)
+
+    def encode_activities(self, labels) -> np.ndarray:
+        """
+        Looks up the codes of the given activity labels, labels that do not occur in the log get the code UNKNOWN.
+        @param labels:
+        @return:
+        """
+        if self.__activity_lookup is None:
+            self.__activity_lookup = self.__lookup(self.activities)
+        return np.fromiter((self.__activity_lookup.get(label, UNKNOWN) for label in labels), dtype=np.int32)
+
+    def case_labels(self, codes: np.ndarray) -> np.ndarray:
+        return _take_labels(self.cases, codes)
+
+    def activity_labels(self, codes: np.ndarray) -> np.ndarray:
+        return _take_labels(self.activities, codes)
+
+    def trace(self, case_code: int) -> np.ndarray:
+        """
+        Activity codes of the trace of a case.
+        @param case_code:
+        @return:
+        """
+        return self.activity_codes[self.offsets[case_code]:self.offsets[case_code + 1]]
+
+    def trace_bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Positions of the first and of the last event of every case that has events.
+        @return:
+        """
+        starts, ends = self.offsets[:-1], self.offsets[1:]
+        has_events = ends > starts
+        return starts[has_events], ends[has_events] - 1
+
+    def positions_of_cases(self, case_codes: np.ndarray) -> np.ndarray:
+        """
+        Positions of the events of the given cases, sorted by case and timestamp.
+        @param case_codes:
+        @return:
+        """
+        case_codes = np.unique(case_codes[case_codes >= 0])
+        return ranges(self.offsets[case_codes], self.offsets[case_codes + 1])
+
+    def events_of_cases(self, case_codes: np.ndarray) -> np.ndarray:
+        """
+        Positions of the events of the given cases in log order.
+        @param case_codes:
+        @return:
+        """
+        positions = self.positions_of_cases(case_codes)
+        return positions[np.argsort(self.rows[positions], kind="stable")]
+
+    def restrict(self, case_codes: np.ndarray) -> "CompactLog":
+        """
+        Compact log that only contains the events of the given cases. Codes and label tables are shared with this log,
+        so codes of both logs can be compared.
+        @param case_codes:
+        @return:
+        """
+        positions = self.positions_of_cases(case_codes)
+        restricted_case_codes = self.case_codes[positions]
+        offsets = np.zeros(len(self.cases) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(restricted_case_codes, minlength=len(self.cases)), out=offsets[1:])
+        restricted = CompactLog(self.rows[positions], restricted_case_codes, self.cases,
+                                self.activity_codes[positions], self.activities, self.timestamps[positions], offsets)
+        # cases are kept entirely, so their variants do not change
+        if self.__variants is not None:
+            restricted.__variants = self.__variants.restrict(case_codes)
+        return restricted
+
+    def positions_in(self, log: "CompactLog", positions: np.ndarray) -> np.ndarray:
+        """
+        Positions of events of this log in the log it was restricted from. Restricted logs keep entire cases in the
+        same order, so an event keeps its offset within its case.
+        @param log: log this log was restricted from
+        @param positions: positions of events in this log
+        @return:
+        """
+        case_codes = self.case_codes[positions]
+        return positions - self.offsets[case_codes] + log.offsets[case_codes]
+
+    def take_indexes(self, log: "CompactLog") -> None:
+        """
+        Takes over the indexes that were built for another log with the same events, e.g. the log this log was stored
+        from.
+        @param log:
+        """
+        self.__variants = log.__variants
+        self.__directly_follows = log.__directly_follows
@@ -1,2 +1,4 @@
 NOT_CONFIGURED_ERROR = "invalid_metadata"
-INVALID_EVENT_LOG_ERROR = "invalid_event_log"
\ No newline at end of file
+INVALID_EVENT_LOG_ERROR = "invalid_event_log"
+LOG_LOADING_TIMEOUT_ERROR = "log_loading_timeout"
+INGESTING_ERROR = "event_log_ingesting"
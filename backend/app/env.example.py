@@ -1,2 +1,16 @@
 UPLOAD_DIR = './uploads'
 FRONTEND_URL = "http://localhost:5173"
+# Memory budget of the event log cache in bytes
+LOG_CACHE_MAX_BYTES = 4 * 1024 ** 3
+# Memory budget in bytes of the cache of intermediate results of spectrum requests, e.g. records and batches
+SPECTRUM_CACHE_MAX_BYTES = 512 * 1024 ** 2
+# Memory budget in bytes of the cache of the segments found for the global filters of spectrum requests
+SEGMENT_CACHE_MAX_BYTES = 512 * 1024 ** 2
+# Maximum number of seconds a request waits for a log that is loaded by another request
+LOG_LOAD_TIMEOUT = 600
+# Number of worker threads that ingest uploaded event logs in the background
+INGESTION_WORKERS = 2
+# Run mining, statistics and export requests in a pool of worker processes instead of the request threads
+MINING_PROCESS_POOL = False
+# Number of mining worker processes, None uses all available cores. Every worker caches logs within its own budget.
+MINING_WORKERS = None
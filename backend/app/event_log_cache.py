@@ -1,52 +1,410 @@
 
+import logging
+import os
+import sys
 import threading
 import time
+from typing import Callable
 
 import cachetools
+import numpy as np
+import pandas as pd
 import pm4py
 from fastapi import HTTPException
 
 import constants
+import env
+import log_snapshot
+import xes_parser
+from compact_log import CompactLog, to_nanoseconds
 
-cache = cachetools.LRUCache(maxsize=100)
+logger = logging.getLogger(__name__)
+
+
+class LogCache(cachetools.Cache):
+    """
+    Cache of loaded event logs that is limited by the memory the logs occupy instead of the number of logs.
+    Entries are evicted using the GreedyDual-Size policy: every entry gets the priority L + cost / size, where cost is
+    the time it took to load the log and L is an "inflation" value that is raised to the priority of every evicted
+    entry. Rarely used entries therefore age out over time, while logs that are expensive to reload relative to the
+    memory they occupy stay cached longer.
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(maxsize=max_bytes, getsizeof=lambda entry: entry.get("size", 0))
+        self.__priority = {}
+        self.__inflation = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __setitem__(self, key, value, cache_setitem=cachetools.Cache.__setitem__):
+        if self.getsizeof(value) > self.maxsize:
+            # The log can never fit into the budget, so it is served without being cached
+            self.pop(key, None)
+            return
+        cache_setitem(self, key, value)
+        self.__touch(key, value)
+
+    def __delitem__(self, key, cache_delitem=cachetools.Cache.__delitem__):
+        cache_delitem(self, key)
+        del self.__priority[key]
+
+    def __touch(self, key, value):
+        self.__priority[key] = self.__inflation + value.get("cost", 0) / max(self.getsizeof(value), 1)
+
+    def get(self, key, default=None):
+        """
+        Looks up a log and refreshes its priority. Lookups are counted as hits or misses.
+        @param key:
+        @param default:
+        @return:
+        """
+        if key not in self:
+            self.misses += 1
+            return default
+
+        value = self[key]
+        self.hits += 1
+        self.__touch(key, value)
+        return value
+
+    def popitem(self):
+        if not self.__priority:
+            raise KeyError("cache is empty")
+
+        key = min(self.__priority, key=self.__priority.get)
+        self.__inflation = self.__priority[key]
+        self.evictions += 1
+        return key, self.pop(key)
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "resident_bytes": self.currsize,
+            "max_bytes": self.maxsize,
+        }
+
+
+cache = LogCache(env.LOG_CACHE_MAX_BYTES)
+
+
+def log_size(log_data) -> int:
+    """
+    Estimates the memory occupied by the log. Object columns of parsed logs reference a small set of shared values
+    (see xes_parser), so they are counted as one pointer per row plus the size of every distinct value, which is much
+    closer to the real footprint than DataFrame.memory_usage(deep=True).
+    @param log_data:
+    @return:
+    """
+    size = int(log_data.memory_usage(index=True, deep=False).sum())
+    for column in log_data.columns:
+        if log_data[column].dtype == object:
+            size += sum(sys.getsizeof(value) for value in pd.unique(log_data[column]))
+    return size
+
+
+def parse_log(file: str, progress: Callable[[float], None] = None):
+    """
+    Parses the raw upload into a dataframe. The streaming parser builds the columns directly and is used whenever
+    possible, pm4py is only used for XES features the streaming parser does not support.
+    @param file: filename of the upload relative to the upload directory
+    @param progress: optional callback that receives the parsed fraction of the file
+    @return:
+    """
+    path = os.path.join(env.UPLOAD_DIR, file)
+    try:
+        return xes_parser.parse_xes(path, progress=progress)
+    except xes_parser.UnsupportedXesError:
+        return pm4py.convert_to_dataframe(pm4py.read_xes(path))
+
+
+def load_log(file: str, progress: Callable[[float], None] = None):
+    """
+    Loads the log from its columnar snapshot. If there is no valid snapshot yet, the raw upload is parsed and the
+    snapshot is written, so every later cold load only has to read the columns from disk. Only one process parses a
+    log at a time, the others wait for its snapshot.
+    @param file: filename of the upload relative to the upload directory
+    @param progress: optional callback that receives the parsed fraction of the file
+    @return:
+    """
+    source_path = os.path.join(env.UPLOAD_DIR, file)
+    log_data = log_snapshot.read_snapshot(source_path, log_snapshot.snapshot_dir(file))
+    if log_data is not None:
+        return log_data
+
+    with log_snapshot.lock(file):
+        return _load_log_locked(file, progress)
+
+
+def _load_log_locked(file: str, progress: Callable[[float], None] = None):
+    source_path = os.path.join(env.UPLOAD_DIR, file)
+    directory = log_snapshot.snapshot_dir(file)
+
+    # Another process may have written the snapshot while waiting for the lock
+    log_data = log_snapshot.read_snapshot(source_path, directory)
+    if log_data is not None:
+        return log_data
+
+    log_data = parse_log(file, progress=progress)
+    try:
+        log_snapshot.write_snapshot(log_data, source_path, directory)
+    except OSError:
+        # A missing snapshot only costs a re-parse on the next cold load, so the request itself must not fail
+        logger.exception("Could not write snapshot for %s", file)
+    return log_data
 
 
 # cache the log so it does not have to constantly be reloaded.
-def cache_log(log_id: int, file: str) -> None:
+def cache_log(log_id: int, file: str, progress: Callable[[float], None] = None):
     # load event log into cache
+    return _cache_entry(file, log_id, lambda: load_log(file, progress=progress), log_size)
+
+
+def load_compact_log(event_log, progress: Callable[[float], None] = None) -> CompactLog:
+    """
+    Loads the compact log of the configured case, activity and timestamp columns. Compact logs are published once per
+    upload and column configuration as memory mapped files, so all server processes share a single copy. The process
+    that publishes a log holds the lock of the upload, every other process waits for it and maps the files.
+    @param event_log:
+    @param progress: optional callback that receives the parsed fraction of the file, if the file has to be parsed
+    @return:
+    """
+    columns = [event_log.case_id, event_log.activity, event_log.timestamp]
+    source_path = os.path.join(env.UPLOAD_DIR, event_log.path)
+    directory = log_snapshot.compact_dir(event_log.path, columns)
+    fingerprint = log_snapshot.source_fingerprint(source_path)
+
+    log = CompactLog.load(directory, fingerprint)
+    if log is not None:
+        return log
+
+    with log_snapshot.lock(event_log.path):
+        log = CompactLog.load(directory, fingerprint)
+        if log is not None:
+            return log
+
+        log = build_compact_log(event_log.path, columns, progress)
+        try:
+            log.save(directory, fingerprint)
+        except OSError:
+            # The log is still usable, it is only private to this process
+            logger.exception("Could not store compact log for %s", event_log.path)
+            return log
+
+    return CompactLog.load(directory, fingerprint) or log
+
+
+def build_compact_log(file: str, columns: list[str], progress: Callable[[float], None] = None) -> CompactLog:
+    """
+    Builds the compact log of the given case, activity and timestamp columns. The columns are read from the
+    snapshot in their dictionary encoded form, the full log is only parsed if there is no snapshot yet. Has to be
+    called while holding the lock of the upload.
+    @param file: filename of the upload relative to the upload directory
+    @param columns: case, activity and timestamp column
+    @param progress: optional callback that receives the parsed fraction of the file, if the file has to be parsed
+    @return:
+    """
+    source_path = os.path.join(env.UPLOAD_DIR, file)
+    encoded = log_snapshot.read_encoded_columns(source_path, log_snapshot.snapshot_dir(file), columns)
+    if encoded is None:
+        log_data = _load_log_locked(file, progress=progress)
+        return CompactLog.from_columns(*(log_data[column] for column in columns))
+
+    (case_codes, cases), (activity_codes, activities), (timestamps, timestamp_uniques) = \
+        (encoded[column] for column in columns)
+    if cases is None:
+        case_codes, cases = pd.factorize(case_codes, use_na_sentinel=True)
+    if activities is None:
+        activity_codes, activities = pd.factorize(activity_codes, use_na_sentinel=True)
+    if timestamp_uniques is not None or timestamps.dtype != np.int64:
+        # not stored as datetime column, so the values have to be parsed
+        values = timestamp_uniques.take(timestamps) if timestamp_uniques is not None else timestamps
+        timestamps = to_nanoseconds(values)
+    return CompactLog.from_encoded(case_codes, cases, activity_codes, activities, timestamps)
+
+
+def store_log_data(event_log, log_data) -> None:
+    """
+    Writes the snapshot of a log that was built in this process instead of parsing its upload, e.g. a log with
+    appended events, and caches it.
+    @param event_log:
+    @param log_data:
+    """
+    source_path = os.path.join(env.UPLOAD_DIR, event_log.path)
+    with log_snapshot.lock(event_log.path):
+        try:
+            log_snapshot.write_snapshot(log_data, source_path, log_snapshot.snapshot_dir(event_log.path))
+        except OSError:
+            logger.exception("Could not write snapshot for %s", event_log.path)
+    _cache_entry(event_log.path, event_log.id, lambda: log_data, log_size)
+
+
+def store_compact_log(event_log, log: CompactLog) -> CompactLog:
+    """
+    Publishes a compact log that was built in this process, e.g. by appending events, like load_compact_log does and
+    caches it. Indexes that were built for the log are kept.
+    @param event_log:
+    @param log:
+    @return: the published log
+    """
+    columns = [event_log.case_id, event_log.activity, event_log.timestamp]
+    directory = log_snapshot.compact_dir(event_log.path, columns)
+    fingerprint = log_snapshot.source_fingerprint(os.path.join(env.UPLOAD_DIR, event_log.path))
+    with log_snapshot.lock(event_log.path):
+        try:
+            log.save(directory, fingerprint)
+        except OSError:
+            logger.exception("Could not store compact log for %s", event_log.path)
+
+    mapped = CompactLog.load(directory, fingerprint)
+    if mapped is not None:
+        mapped.take_indexes(log)
+        log = mapped
+    return _cache_compact_log(compact_log_key(event_log), event_log.id, lambda: log)
+
+
+def compact_log_key(event_log) -> tuple:
+    return event_log.path, event_log.case_id, event_log.activity, event_log.timestamp
+
+
+def _cache_compact_log(key, log_id: int, load: Callable[[], CompactLog]) -> CompactLog:
+    def watched():
+        log = load()
+        # the indexes are built on first use, their memory counts against the budget once they exist
+        log.on_index_built(lambda: _resize_entry(key, log))
+        return log
+
+    return _cache_entry(key, log_id, watched, lambda log: log.nbytes)
+
+
+def _resize_entry(key, log: CompactLog) -> None:
+    """
+    Updates the size of a cached compact log, and with it its priority, after the memory of the log has grown.
+    @param key:
+    @param log:
+    """
+    with lock:
+        if key in cache and cache[key]["log"] is log:
+            cache[key] = {**cache[key], "size": log.nbytes}
+
+
+def _cache_entry(key, log_id: int, load: Callable[[], object], size: Callable[[object], int]):
+    started_at = time.time()
     try:
-        log_data = pm4py.convert_to_dataframe(pm4py.read_xes("./uploads/" + file))
+        value = load()
     except Exception:
         raise HTTPException(status_code=400, detail={'err': constants.INVALID_EVENT_LOG_ERROR, 'id': log_id})
-    cache[log_id] = {
-        "loading": False,
-        "log": log_data,
-        "cached_at": time.time(),
-    }
+    with lock:
+        cache[key] = {
+            "log": value,
+            "cached_at": time.time(),
+            "cost": time.time() - started_at,
+            "size": size(value),
+        }
+    return value
+
+
+class _Load:
+    """
+    A load of a single log that is currently in flight. The first request for a log performs the load, every
+    concurrent request for the same log waits for it and receives the same log or the same error.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.log = None
+        self.error = None
+
+    def wait(self, log_id: int, timeout: float):
+        if not self.done.wait(timeout):
+            raise HTTPException(status_code=503, detail={'err': constants.LOG_LOADING_TIMEOUT_ERROR, 'id': log_id})
+        if self.error is not None:
+            raise self.error
+        return self.log
+
+
+# Guards the cache and the in-flight loads, cachetools caches are not thread safe by themselves
+lock = threading.RLock()
+loads: dict[object, _Load] = {}
+
+
+def _get_or_load(key, log_id: int, load: Callable[[], object], timeout: float = None):
+    with lock:
+        # Check if the entry is already in the cache
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["log"]
+
+        # Either join the load of another request or become the request that loads the entry
+        pending = loads.get(key)
+        is_loader = pending is None
+        if is_loader:
+            pending = loads[key] = _Load()
+
+    if not is_loader:
+        return pending.wait(log_id, env.LOG_LOAD_TIMEOUT if timeout is None else timeout)
+
+    try:
+        # The value is returned directly, as it is not necessarily cached if it exceeds the memory budget
+        pending.log = load()
+        return pending.log
+    except BaseException as e:
+        pending.error = e
+        raise
+    finally:
+        # Failed loads are removed as well, so the next request retries the load
+        with lock:
+            del loads[key]
+        pending.done.set()
 
 
 # retrieve log from cache, if not existent, lazy load
-def get_log_data(event_log):
-    # Check if the log is already in the cache
-    if event_log.id not in cache:
-        # set the current state of the cache to loading, such that no other thread can will load it redundantly
-        # Create an empty event for other threads to wait on
-        event = threading.Event()
-        cache[event_log.id] = {
-            "loading": True,
-            'event': event
-        }
-        cache_log(event_log.id, event_log.path)
-        event.set()
+def get_log_data(event_log, timeout: float = None, progress: Callable[[float], None] = None):
+    """
+    Returns the parsed log, loading it if it is not cached. Concurrent requests for a log that is not cached share a
+    single load. Logs are cached by their content addressed file, so event logs of the same upload share the entry.
+    @param event_log:
+    @param timeout: maximum number of seconds to wait for a load started by another request
+    @param progress: optional callback that receives the parsed fraction of the file, if this call loads the log
+    @return:
+    """
+    return _get_or_load(
+        event_log.path,
+        event_log.id,
+        lambda: cache_log(event_log.id, event_log.path, progress=progress),
+        timeout
+    )
 
-    # If the event log is currently being loaded, wait for it to finish
-    if cache[event_log.id]["loading"]:
-        # Wait for the loading to finish
-        cache[event_log.id]["event"].wait()
 
-    return cache.get(event_log.id)["log"]
+def get_compact_log(event_log, timeout: float = None, progress: Callable[[float], None] = None) -> CompactLog:
+    """
+    Returns the compact log of the configured columns, which is what the miners work on. It is cached separately
+    from the parsed log, so mining does not require the full log to stay in memory.
+    @param event_log:
+    @param timeout: maximum number of seconds to wait for a load started by another request
+    @param progress: optional callback that receives the parsed fraction of the file, if this call parses the log
+    @return:
+    """
+    key = compact_log_key(event_log)
+    return _get_or_load(
+        key,
+        event_log.id,
+        lambda: _cache_compact_log(key, event_log.id, lambda: load_compact_log(event_log, progress)),
+        timeout
+    )
 
 
-def remove_from_cache(event_log):
-    if event_log.id in cache:
-        del cache[event_log.id]
\ No newline at end of file
+def remove_from_cache(file: str):
+    with lock:
+        # the parsed log is cached by its file, compact logs by file and column configuration
+        for key in list(cache):
+            if key == file or isinstance(key, tuple) and key[0] == file:
+                del cache[key]
@@ -1,77 +1,131 @@
 import hashlib
 import os
-import shutil
-import time
-from bisect import bisect_right
+import threading
+import uuid
 
-import numpy as np
-import pandas as pd
 from fastapi import UploadFile
 
 import env
+import log_snapshot
+import xes_parser
 
 
-def upload_file(file: UploadFile):
-    # Save the uploaded file
+# Serializes storing and removing uploads, so a stored file is never removed while a new event log starts to use it
+upload_lock = threading.RLock()
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def receive_upload(file: UploadFile) -> tuple[str, str]:
+    """
+    Streams the upload into a temporary file and hashes its content on the way.
+    @param file:
+    @return: path of the temporary file and the content addressed filename of the upload
+    """
     _, extension = os.path.splitext(file.filename)
+    os.makedirs(env.UPLOAD_DIR, exist_ok=True)
+
+    content_hash = hashlib.sha256()
+    tmp_location = os.path.join(env.UPLOAD_DIR, f".upload-{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_location, "wb") as buffer:
+            while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+                content_hash.update(chunk)
+                buffer.write(chunk)
+    except BaseException:
+        os.remove(tmp_location)
+        raise
 
-    # Get current timestamp as a string
-    timestamp = str(time.time())
-    # hash current timestamp to create a unique filename
-    filename = hashlib.sha256(timestamp.encode()).hexdigest()
+    return tmp_location, content_hash.hexdigest() + extension
 
-    file_location = os.path.join(env.UPLOAD_DIR, filename + extension)
-    os.makedirs(os.path.dirname(file_location), exist_ok=True)
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
 
-    return filename + extension
+def store_upload(tmp_location: str, filename: str) -> None:
+    """
+    Moves a received upload to its content addressed location. If the same content was uploaded before, the stored
+    file is kept, so its snapshot and cached log are reused. Has to be called while holding upload_lock.
+    @param tmp_location:
+    @param filename:
+    """
+    file_location = os.path.join(env.UPLOAD_DIR, filename)
+    if os.path.isfile(file_location):
+        os.remove(tmp_location)
+    else:
+        os.replace(tmp_location, file_location)
+
+
+def _find_last(location: str, pattern: bytes) -> int:
+    # offset of the last occurrence of the pattern in the file, which is read backwards in chunks
+    with open(location, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - UPLOAD_CHUNK_SIZE, 0)
+            f.seek(start)
+            # the chunks overlap, so a pattern spanning two chunks is found as well
+            offset = f.read(end - start + len(pattern) - 1).rfind(pattern)
+            if offset != -1:
+                return start + offset
+            end = start
+    return -1
+
+
+def _copy_range(source, end: int, buffer, content_hash) -> None:
+    # copies the source from its current position up to the given offset in chunks and hashes them on the way
+    remaining = end - source.tell()
+    while remaining > 0 and (chunk := source.read(min(UPLOAD_CHUNK_SIZE, remaining))):
+        remaining -= len(chunk)
+        content_hash.update(chunk)
+        buffer.write(chunk)
+
+
+def append_upload(filename: str, part_location: str) -> tuple[str, str]:
+    """
+    Writes a new upload consisting of a stored upload followed by the traces of another XES file, without parsing
+    either of them. The header of the other file (extensions, global attributes and classifiers) is dropped, its
+    events use the declarations of the stored upload. Events of an existing case end up in a second trace of the case,
+    which yields the same rows as appending them to the existing trace.
+    @param filename: content addressed filename of the stored upload
+    @param part_location: path of the XES file with the traces to append
+    @return: path of the temporary file and the content addressed filename of the new upload
+    """
+    traces_start, traces_end = xes_parser.trace_range(part_location)
+    base_location = os.path.join(env.UPLOAD_DIR, filename)
+    base_end = _find_last(base_location, b"</log>")
+    if traces_start == -1 or base_end == -1:
+        raise ValueError("not an XES log")
+
+    content_hash = hashlib.sha256()
+    tmp_location = os.path.join(env.UPLOAD_DIR, f".upload-{uuid.uuid4().hex}.tmp")
+    try:
+        with open(base_location, "rb") as base, open(part_location, "rb") as part, \
+                open(tmp_location, "wb") as buffer:
+            _copy_range(base, base_end, buffer, content_hash)
+            part.seek(traces_start)
+            _copy_range(part, traces_end, buffer, content_hash)
+            content_hash.update(b"</log>\n")
+            buffer.write(b"</log>\n")
+    except BaseException:
+        os.remove(tmp_location)
+        raise
+
+    _, extension = os.path.splitext(filename)
+    return tmp_location, content_hash.hexdigest() + extension
+
+
+def remove_upload(filename: str) -> None:
+    """
+    Removes a stored upload together with its snapshot (including the stored compact logs) and its lock file. Has to
+    be called while holding upload_lock.
+    @param filename:
+    """
+    for location in (os.path.join(env.UPLOAD_DIR, filename), log_snapshot.lock_file(filename)):
+        try:
+            os.remove(location)
+        except FileNotFoundError:
+            pass
+    log_snapshot.remove_snapshot(log_snapshot.snapshot_dir(filename))
 
 
 def clean_event_log(df):
     df_cleaned = df.replace([float('inf'), float('-inf')], 0)  # Replace infinite values with None
     df_cleaned = df_cleaned.fillna(0)  # Replace NaN with None
     return df_cleaned
-
-
-def lnds_on_column(df: pd.DataFrame, col: str):
-    """
-    Longest Non-Decreasing Subsequence (LNDS) on df[col].
-    Returns (lis_index_labels, lis_values).
-    NaNs are ignored but original index labels are preserved.
-    """
-    s = df[col].dropna()
-    if s.empty:
-        return [], []
-
-    a = s.to_numpy()
-    idx = s.index.to_numpy()
-
-    # positions[k] = position in `a` of subseq tail of length k+1
-    positions = []
-    # links to reconstruct sequence
-    prev = np.full(len(a), -1)
-    # actual tail values for binary search
-    tails_vals = []
-
-    for i, x in enumerate(a):
-        # allows equals neighbors
-        j = bisect_right(tails_vals, x)
-        if j == len(tails_vals):
-            tails_vals.append(x)
-            positions.append(i)
-        else:
-            tails_vals[j] = x
-            positions[j] = i
-        if j > 0:
-            prev[i] = positions[j-1]
-
-    # Reconstruct LNDS
-    lnds_pos = []
-    k = positions[-1]
-    while k != -1:
-        lnds_pos.append(k)
-        k = prev[k]
-    lnds_pos.reverse()
-
-    return idx[lnds_pos].tolist()
\ No newline at end of file
@@ -0,0 +1,107 @@
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Callable
+
+import env
+
+# No ingestion job is known for the log, it is loaded when it is first accessed
+IDLE = "idle"
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class IngestionJob:
+    event_log_id: int
+    state: str = QUEUED
+    stage: str = None
+    progress: float = 0.0
+    error: str = None
+    queued_at: float = None
+    started_at: float = None
+    finished_at: float = None
+
+    def report(self, stage: str, progress: float) -> None:
+        """
+        Reports the progress of the job, used as callback by the ingestion function.
+        @param stage: name of the current stage, e.g. "parsing"
+        @param progress: progress of the entire job between 0 and 1
+        """
+        self.stage = stage
+        self.progress = round(progress, 4)
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (DONE, FAILED)
+
+    def to_response(self) -> dict:
+        return asdict(self)
+
+
+class IngestionInProgress(Exception):
+    """
+    Raised when a job is submitted for an event log whose previous job has not finished yet.
+    """
+
+    def __init__(self, job: IngestionJob):
+        super().__init__(job.event_log_id)
+        self.job = job
+
+
+executor = ThreadPoolExecutor(max_workers=env.INGESTION_WORKERS, thread_name_prefix="ingestion")
+lock = threading.Lock()
+jobs: dict[int, IngestionJob] = {}
+
+
+def _run(job: IngestionJob, ingest: Callable[[IngestionJob], None]) -> None:
+    job.state = RUNNING
+    job.started_at = time.time()
+    try:
+        ingest(job)
+        job.report(job.stage, 1.0)
+        job.state = DONE
+    except Exception as e:
+        job.state = FAILED
+        # HTTPExceptions carry the error code used by the frontend in their detail
+        job.error = getattr(e, "detail", None) or "".join(traceback.format_exception_only(e)).strip()
+    finally:
+        job.finished_at = time.time()
+
+
+def submit(event_log_id: int, ingest: Callable[[IngestionJob], None]) -> IngestionJob:
+    """
+    Queues the ingestion of an event log in the worker pool. Only one job per event log runs at a time, the check and
+    the registration of the job happen under the same lock.
+    @param event_log_id:
+    @param ingest: function that performs the ingestion and reports its progress on the given job
+    @return: the queued job
+    @raise IngestionInProgress: if a job of the event log is still queued or running
+    """
+    job = IngestionJob(event_log_id=event_log_id, queued_at=time.time())
+    with lock:
+        running = jobs.get(event_log_id)
+        if running is not None and not running.finished:
+            raise IngestionInProgress(running)
+        jobs[event_log_id] = job
+    executor.submit(_run, job, ingest)
+    return job
+
+
+def get_job(event_log_id: int) -> IngestionJob | None:
+    with lock:
+        return jobs.get(event_log_id)
+
+
+def is_ingesting(event_log_id: int) -> bool:
+    job = get_job(event_log_id)
+    return job is not None and not job.finished
+
+
+def forget(event_log_id: int) -> None:
+    with lock:
+        jobs.pop(event_log_id, None)
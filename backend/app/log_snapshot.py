@@ -0,0 +1,227 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where only the threads of a single process coordinate
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+import env
+
+# Bump whenever the on-disk layout changes, so snapshots written by older versions are never read.
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+
+
+def snapshot_dir(file: str) -> str:
+    """
+    Directory of the columnar snapshot belonging to the uploaded file, stored next to the upload.
+    @param file: filename of the upload relative to the upload directory
+    @return:
+    """
+    return os.path.join(env.UPLOAD_DIR, file + ".snapshot")
+
+
+def compact_dir(file: str, columns: list[str]) -> str:
+    """
+    Directory of the memory mapped compact log of the upload for the given case, activity and timestamp columns.
+    It lives inside the snapshot directory, so it is removed together with the snapshot.
+    @param file: filename of the upload relative to the upload directory
+    @param columns:
+    @return:
+    """
+    key = hashlib.sha256(json.dumps(columns).encode()).hexdigest()[:16]
+    return os.path.join(snapshot_dir(file), f"compact-{key}")
+
+
+def lock_file(file: str) -> str:
+    return os.path.join(env.UPLOAD_DIR, file + ".lock")
+
+
+@contextlib.contextmanager
+def lock(file: str):
+    """
+    Exclusive lock on the derived data of an upload that is shared by all server processes. Whoever holds the lock
+    builds the missing snapshot or compact log, everybody else waits and then reads the published files.
+    @param file: filename of the upload relative to the upload directory
+    """
+    os.makedirs(env.UPLOAD_DIR, exist_ok=True)
+    with open(lock_file(file), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def source_fingerprint(source_path: str) -> str:
+    """
+    Fingerprint of the raw upload a snapshot was built from. Any change of the file (size or modification time) or of
+    the snapshot format yields a different fingerprint, which marks existing snapshots as stale.
+    @param source_path:
+    @return:
+    """
+    stat = os.stat(source_path)
+    key = f"{SNAPSHOT_VERSION}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _column_file(index: int, suffix: str = "") -> str:
+    # Column names are arbitrary XES keys, so files are addressed by position and the names live in the manifest
+    return f"col_{index}{suffix}.npy"
+
+
+def _write_column(directory: str, index: int, series: pd.Series) -> dict:
+    dtype = series.dtype
+    if isinstance(dtype, pd.DatetimeTZDtype) or dtype.kind == "M":
+        values = series.dt.tz_convert(None) if isinstance(dtype, pd.DatetimeTZDtype) else series
+        np.save(os.path.join(directory, _column_file(index)), values.to_numpy(dtype="datetime64[ns]").view("int64"))
+        return {"kind": "datetime", "tz": str(dtype.tz) if isinstance(dtype, pd.DatetimeTZDtype) else None}
+
+    if isinstance(dtype, np.dtype) and dtype.kind in "biuf":
+        np.save(os.path.join(directory, _column_file(index)), series.to_numpy())
+        return {"kind": "numpy"}
+
+    # Strings and mixed objects are dictionary encoded: int32 codes plus the (small) table of distinct values
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    np.save(os.path.join(directory, _column_file(index)), codes.astype(np.int32))
+    np.save(os.path.join(directory, _column_file(index, ".uniques")), np.asarray(uniques, dtype=object),
+            allow_pickle=True)
+    return {"kind": "factorized"}
+
+
+def _read_column(directory: str, index: int, spec: dict, mmap: bool):
+    values = np.load(os.path.join(directory, _column_file(index)), mmap_mode="r" if mmap else None)
+    if spec["kind"] == "numpy":
+        return values
+
+    if spec["kind"] == "datetime":
+        res = pd.DatetimeIndex(np.asarray(values).view("datetime64[ns]"))
+        return res.tz_localize("UTC").tz_convert(spec["tz"]) if spec["tz"] is not None else res
+
+    uniques = np.load(os.path.join(directory, _column_file(index, ".uniques")), allow_pickle=True)
+    codes = np.asarray(values)
+    res = np.empty(len(codes), dtype=object)
+    res[:] = uniques.take(codes, mode="clip") if len(uniques) else np.nan
+    res[codes == -1] = np.nan
+    return res
+
+
+def write_snapshot(log_data: DataFrame, source_path: str, directory: str) -> None:
+    """
+    Writes the parsed log as one .npy file per column. The snapshot is written to a temporary directory first and
+    then moved into place, so readers never observe a partially written snapshot.
+    @param log_data: parsed event log
+    @param source_path: path of the raw upload the frame was parsed from
+    @param directory: target snapshot directory
+    """
+    tmp_directory = f"{directory}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_directory)
+    try:
+        columns = []
+        for index, name in enumerate(log_data.columns):
+            spec = _write_column(tmp_directory, index, log_data[name])
+            columns.append({"name": name, **spec})
+
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "fingerprint": source_fingerprint(source_path),
+            "rows": len(log_data),
+            "columns": columns,
+        }
+        with open(os.path.join(tmp_directory, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+
+        remove_snapshot(directory)
+        os.replace(tmp_directory, directory)
+    finally:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+
+def read_manifest(source_path: str, directory: str) -> dict | None:
+    """
+    Reads the manifest of a snapshot and validates it against the raw upload.
+    @param source_path:
+    @param directory:
+    @return: the manifest, or None if there is no snapshot or it is stale
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        fingerprint = source_fingerprint(source_path)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("version") != SNAPSHOT_VERSION or manifest.get("fingerprint") != fingerprint:
+        return None
+    return manifest
+
+
+def read_snapshot(source_path: str, directory: str, columns: list[str] = None, mmap: bool = True) -> DataFrame | None:
+    """
+    Loads a snapshot back into a dataframe.
+    @param source_path: path of the raw upload, used to detect stale snapshots
+    @param directory: snapshot directory
+    @param columns: optional subset of columns to load, all columns if None
+    @param mmap: memory map the column files instead of reading them eagerly
+    @return: the dataframe, or None if there is no valid snapshot
+    """
+    manifest = read_manifest(source_path, directory)
+    if manifest is None:
+        return None
+
+    data = {}
+    try:
+        for index, spec in enumerate(manifest["columns"]):
+            if columns is None or spec["name"] in columns:
+                data[spec["name"]] = _read_column(directory, index, spec, mmap)
+    except (OSError, ValueError):
+        return None
+
+    return DataFrame(data, index=pd.RangeIndex(manifest["rows"]))
+
+
+def read_encoded_columns(source_path: str, directory: str, columns: list[str]) -> dict | None:
+    """
+    Loads columns of a snapshot in their stored encoding instead of decoding them into a dataframe: dictionary encoded
+    columns as (codes, uniques), datetime columns as int64 nanoseconds since the epoch and numeric columns as they are.
+    @param source_path: path of the raw upload, used to detect stale snapshots
+    @param directory: snapshot directory
+    @param columns: names of the columns to load
+    @return: dict of column name to (values, uniques), uniques is None for columns that are not dictionary encoded.
+    None if there is no valid snapshot or a column does not exist.
+    """
+    manifest = read_manifest(source_path, directory)
+    if manifest is None:
+        return None
+
+    specs = {spec["name"]: (index, spec) for index, spec in enumerate(manifest["columns"])}
+    if not all(column in specs for column in columns):
+        return None
+
+    data = {}
+    try:
+        for column in columns:
+            index, spec = specs[column]
+            values = np.load(os.path.join(directory, _column_file(index)))
+            uniques = None
+            if spec["kind"] == "factorized":
+                uniques = np.load(os.path.join(directory, _column_file(index, ".uniques")), allow_pickle=True)
+            data[column] = (values, uniques)
+    except (OSError, ValueError):
+        return None
+    return data
+
+
+def remove_snapshot(directory: str) -> None:
+    shutil.rmtree(directory, ignore_errors=True)
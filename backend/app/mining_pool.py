@@ -0,0 +1,69 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+import env
+from models import Eventlog
+
+# Columns of an event log that are sent to the workers, the worker rebuilds a detached Eventlog from them
+EVENT_LOG_FIELDS = ("id", "name", "path", "case_id", "timestamp", "activity", "column_count", "entry_count")
+
+lock = threading.Lock()
+executor: ProcessPoolExecutor | None = None
+
+
+def available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global executor
+    with lock:
+        if executor is None:
+            # Workers are spawned instead of forked, forking a process with running threads can copy held locks
+            executor = ProcessPoolExecutor(
+                max_workers=env.MINING_WORKERS or available_cores(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return executor
+
+
+def shutdown() -> None:
+    global executor
+    with lock:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+            executor = None
+
+
+def _run_detached(function: Callable, event_log_values: dict, *args):
+    # Executed in a worker. The worker loads the log from its snapshot into its own cache, so only the (small)
+    # column values of the event log travel to the worker instead of the log itself.
+    return function(Eventlog(**event_log_values), *args)
+
+
+def run(function: Callable, event_log: Eventlog, *args):
+    """
+    Runs a CPU-bound job on an event log. With the process pool enabled the job is executed by a worker process, so
+    it neither holds the GIL of the server process nor blocks other requests, otherwise it is executed directly.
+    @param function: module level function that receives the event log and the given args, its result and the
+    arguments must be picklable
+    @param event_log:
+    @param args:
+    @return: the result of the function
+    """
+    if not env.MINING_PROCESS_POOL:
+        return function(event_log, *args)
+
+    event_log_values = {field: getattr(event_log, field) for field in EVENT_LOG_FIELDS}
+    try:
+        return get_executor().submit(_run_detached, function, event_log_values, *args).result()
+    except BrokenProcessPool:
+        # A crashed worker breaks the entire pool, the next job starts a new one
+        shutdown()
+        raise
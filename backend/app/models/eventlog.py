@@ -1,7 +1,7 @@
 
 from sqlalchemy import Column, Integer, String
 from database import Base
-from event_log_cache import get_log_data
+from event_log_cache import get_log_data, get_compact_log
 
 
 class Eventlog(Base):
@@ -9,7 +9,8 @@ class Eventlog(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    path = Column(String)
+    # content addressed file, shared by all event logs with the same content
+    path = Column(String, index=True)
 
     case_id = Column(String, nullable=True)
     timestamp = Column(String, nullable=True)
@@ -20,3 +21,6 @@ class Eventlog(Base):
 
     def log_data(self):
         return get_log_data(self)
+
+    def compact_log(self):
+        return get_compact_log(self)
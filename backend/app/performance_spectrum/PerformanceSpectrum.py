@@ -1,5 +1,8 @@
+import dataclasses
 import os
-from typing import Self
+import sys
+import threading
+from typing import Callable, Self
 
 import cachetools
 import numpy as np
@@ -7,15 +10,58 @@ import pandas as pd
 from pandas import DataFrame
 import time
 
+import env
+from compact_log import CompactLog
 from models import Eventlog
 import performance_spectrum.miner as psminer
+from performance_spectrum.common import EpsilonSweepPoint, FifoAnalysis, PatternWindow
+from performance_spectrum.miner.SpectrumMiner import Segment
+from performance_spectrum.QueryPlan import QueryPlan, PlanStep, RESTRICT, EXTRACT, RECORDS, CLUSTER, SELECT, \
+    INTERSECT, METADATA, TIME, QUARTILE
 from pm4py.objects.conversion.log import converter as log_converter
 from pydantic_models.spectrum_filter_schema import ActivityFilter, BatchFilter, TimeFilter
 from pm4py.objects.log.exporter.xes import exporter as xes_exporter
 
 
+def stage_size(value) -> int:
+    """
+    Approximate memory of the result of a stage of the pipeline, estimated from the sizes of arrays and containers
+    instead of serializing the result.
+    @param value:
+    @return:
+    """
+    if isinstance(value, DataFrame):
+        return int(value.memory_usage(index=False).sum())
+    if isinstance(value, (np.ndarray, pd.Series)):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(stage_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(stage_size(k) + stage_size(v) for k, v in value.items())
+    if dataclasses.is_dataclass(value):
+        return sys.getsizeof(value) + sum(stage_size(getattr(value, f.name)) for f in dataclasses.fields(value))
+    return sys.getsizeof(value)
+
+
+class StageCache(cachetools.LRUCache):
+    """
+    LRU cache of intermediate results limited by their memory, see stage_size.
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(maxsize=max_bytes, getsizeof=stage_size)
+
+    def __setitem__(self, key, value, cache_setitem=cachetools.LRUCache.__setitem__):
+        if self.getsizeof(value) > self.maxsize:
+            # The result can never fit into the budget, so it is used without being cached
+            self.pop(key, None)
+            return
+        cache_setitem(self, key, value)
+
+
 class PerformanceSpectrumBuilder:
-    cache = cachetools.LRUCache(maxsize=100)
+    # Segments of the filters of the global filters, limited by the memory of their occurrences
+    cache = StageCache(env.SEGMENT_CACHE_MAX_BYTES)
 
     def __init__(self, eventlog: Eventlog):
         self.eventlog = eventlog
@@ -46,53 +92,88 @@ class PerformanceSpectrumBuilder:
         self.variantFilter = trace
         return self
 
-    def get_base_df(self, log_data):
+    def get_base_segments(self, log: CompactLog) -> list[Segment]:
         """
         Fetches either the variant or segment filter from depending on the set filters. This is necessary,
         because segments can include the same cases twice (for loops) while this does not occur for variants, thus
         filtering gets a bit more performant.
-        The filtered df is also stored in an internal cache to avoid recalculating the same filter over and over again.
-        @param log_data:
+        The filtered segments are also stored in an internal cache to avoid recalculating the same filter over and over
+        again.
+        @param log: log restricted to the filtered cases
         @return:
         """
-        hash = self.get_hash()
-        if hash in self.cache:
-            return self.cache[hash]
-
-        if self.variantFilter is not None:
-            res = self.miner.filter_entire_variant(
-                log_data,
-                self.variantFilter
-            )
-            self.cache[hash] = res
-            return res
-
-        if self.segmentFilter is not None:
-            res = [self.miner.filter_variant(
-                log_data,
-                [self.segmentFilter.start_activity,
-                 self.segmentFilter.end_activity],
-                activity_index=2,
-                force_real_variant=False
-            )]
-            self.cache[hash] = res
-            return res
-
-        res = [self.miner.prepare_log_spectrum(log_data)]
-        self.cache[hash] = res
+        key = self.get_key()
+        if key in self.cache:
+            return self.cache[key]
 
+        res = self.find_segments(log, self.variantFilter, key[3])
+        self.cache[key] = res
         return res
 
-    def get_hash(self):
+    def find_segments(self, log: CompactLog, variant: list[str] | None, segment: tuple) -> list[Segment]:
+        """
+        Finds the segments of the variant, of the segment given as (start activity, end activity) or of the entire
+        log if neither is given.
+        @param log:
+        @param variant:
+        @param segment:
+        @return:
+        """
+        if variant is not None:
+            return self.miner.filter_entire_variant(log, variant)
+
+        if segment:
+            return [self.miner.filter_segment(log, *segment)]
+
+        return [self.miner.prepare_log_spectrum(log)]
+
+    def get_log_key(self) -> tuple:
+        # The segments refer to positions in the compact log, which depends on the file and the configured columns
+        return self.eventlog.path, self.eventlog.case_id, self.eventlog.activity, self.eventlog.timestamp
+
+    def get_key(self) -> tuple:
         """
-        Calculates the hash for the current filter settings. i.e. the key of the current filter configuration in the
-        internal cache
+        Calculates the key of the current filter settings in the internal cache
         @return:
         """
         caseFilter = tuple(self.caseFilter if self.caseFilter else [])
         variantFilter = tuple(self.variantFilter if self.variantFilter else [])
-        segmentFilter = tuple(self.segmentFilter if self.segmentFilter else [])
-        return hash((self.eventlog.id, caseFilter, variantFilter, segmentFilter))
+        segmentFilter = (self.segmentFilter.start_activity, self.segmentFilter.end_activity) \
+            if self.segmentFilter else ()
+        return self.get_log_key(), caseFilter, variantFilter, segmentFilter
+
+    def carry_over_cache(self, log_key: tuple, previous: CompactLog, log: CompactLog, positions: np.ndarray,
+                         affected: np.ndarray) -> None:
+        """
+        Moves the cached segments of the log identified by log_key to the log of this builder, which extends it by
+        the events appended with CompactLog.append. Entries that the appended events change are dropped: entries
+        with an occurrence in an affected case and entries whose filter finds occurrences in the affected cases now.
+        The occurrences of all other entries are only moved to their new positions.
+        @param log_key: key of the log before the events were appended
+        @param previous: log before the events were appended
+        @param log: log with the appended events
+        @param positions: positions of the events of the previous log in the log
+        @param affected: codes of the cases with appended events in the log
+        """
+        affected_labels = set(log.case_labels(affected).tolist())
+        previous_affected = previous.encode_cases(list(affected_labels))
+        appended = log.restrict(affected)
+
+        for key in [key for key in list(self.cache) if key[0] == log_key]:
+            _, caseFilter, variantFilter, segmentFilter = key
+            segments = self.cache.pop(key)
+            if caseFilter:
+                # logs restricted to unaffected cases contain the same events as before, so do their segments
+                if affected_labels.isdisjoint(caseFilter):
+                    self.cache[(self.get_log_key(), *key[1:])] = segments
+                continue
+
+            if any(np.isin(previous.case_codes[start], previous_affected).any() for start, _ in segments):
+                continue
+            variant = list(variantFilter) if variantFilter else None
+            if any(len(start) for start, _ in self.find_segments(appended, variant, segmentFilter)):
+                continue
+            self.cache[(self.get_log_key(), *key[1:])] = [(positions[start], positions[end]) for start, end in segments]
 
     def cases(self, cases):
         """
@@ -109,33 +190,49 @@ class PerformanceSpectrumBuilder:
         Builds the performance spectrum collection based on the current filter settings.
         @return:
         """
-        log_data = self.eventlog.log_data()
+        log = filtered_log = self.eventlog.compact_log()
         if self.caseFilter:
-            log_data = log_data[log_data[self.eventlog.case_id].isin(self.caseFilter)].reset_index(drop=True)
+            filtered_log = log.restrict(log.encode_cases(self.caseFilter))
 
-        # Filter the original log df for the current filter settings
-        dfs = self.get_base_df(log_data)
-        # Convert the filtered log data into performance spectrum dataframes
-        pms_dfs = [self.miner.prepare_pms_data(df) for df in dfs]
+        # Filter the log for the current filter settings
+        segments = self.get_base_segments(filtered_log)
+        if filtered_log is not log:
+            # records refer to the events of the entire log
+            segments = [(filtered_log.positions_in(log, start), filtered_log.positions_in(log, end))
+                        for start, end in segments]
 
-        # Create a collection of performance spectra from the prepared dataframes
-        return PerformanceSpectrumCollection(
-            self.eventlog,
-            [PerformanceSpectrum(pms_df) for pms_df in pms_dfs]
-        )
+        # Records are only built by the collection, once all filters of the request are known
+        return PerformanceSpectrumCollection(self.eventlog, segments, log, self.get_source_steps(), self.get_key())
+
+    def get_source_steps(self) -> list[PlanStep]:
+        """
+        Describes the steps of the builder in the plan of the request.
+        @return:
+        """
+        steps = [PlanStep(RESTRICT, filters=['cases'])] if self.caseFilter else []
+        if self.variantFilter is not None:
+            return steps + [PlanStep(EXTRACT, filters=['variant'])]
+        if self.segmentFilter:
+            return steps + [PlanStep(EXTRACT, filters=['segment'])]
+        return steps + [PlanStep(EXTRACT, filters=['log'])]
 
 
 class PerformanceSpectrum:
 
-    def __init__(self, records):
-        self.records = records
+    def __init__(self, records, original_durations: np.ndarray = None, filter_wrapper=None):
+        # The records are never modified, filters only narrow down the selection of records, which is materialized
+        # when the records are read
+        self.original_records = records
+        # Durations of all occurrences of the segment for quartile filtering, the records may only contain the
+        # occurrences of a time range
+        self.original_durations = records['duration_seconds'].to_numpy() \
+            if original_durations is None else original_durations
+        self.selection = None
+        self.clusters = None
+        self.__records = records
         self.metadata = None
         self.statistics = None
-        self.empty = records.empty
-        # Create a filter wrapper for the performance spectrum
-        self.filter_wrapper = PerformanceSpectrumFilterWrapper(self)
-        # Store the original records for quartile filtering
-        self.original_records = records.copy()
+        self.filter_wrapper = filter_wrapper if filter_wrapper is not None else PerformanceSpectrumFilterWrapper()
 
     @staticmethod
     def using(eventlog: Eventlog):
@@ -146,13 +243,64 @@ class PerformanceSpectrum:
         """
         return PerformanceSpectrumBuilder(eventlog)
 
-    def set_records(self, records: DataFrame):
+    @property
+    def records(self) -> DataFrame:
         """
-        Sets the records of the performance spectrum to the given dataframe and recalculates the empty state.
-        @param records:
+        The selected records, with the cluster of every record if they were clustered.
+        @return:
+        """
+        if self.__records is None:
+            records = self.original_records.take(self.selection).reset_index(drop=True)
+            if self.clusters is not None:
+                records['cluster'] = self.clusters
+            self.__records = records
+        return self.__records
+
+    @property
+    def empty(self) -> bool:
+        return len(self) == 0
+
+    def __len__(self):
+        return len(self.original_records) if self.selection is None else len(self.selection)
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Values of a column of the selected records, without materializing the records.
+        @param name:
+        @return:
+        """
+        values = self.original_records[name].to_numpy()
+        return values if self.selection is None else values[self.selection]
+
+    def select(self, positions: np.ndarray, clusters: np.ndarray = None):
+        """
+        Narrows down the selected records.
+        @param positions: positions of the records to keep within the selected records, in their new order
+        @param clusters: clusters of the kept records, the clusters of previous selections are kept otherwise
+        """
+        self.selection = positions if self.selection is None else self.selection[positions]
+        if clusters is not None:
+            self.clusters = clusters
+        elif self.clusters is not None:
+            self.clusters = self.clusters[positions]
+        self.__records = None
+
+    def batch_selection(self, batches: BatchFilter, miner: psminer.SpectrumPatternsMiner) \
+            -> tuple[np.ndarray, np.ndarray]:
         """
-        self.records = records
-        self.empty = records.empty
+        Clusters the selected records into batches.
+        @param batches:
+        @param miner:
+        @return: positions of the clustered records within the selection and their clusters
+        """
+        return miner.cluster(
+            batches.epsilon,
+            batches.minSamples,
+            self.column('start_timestamp'),
+            self.column('end_timestamp'),
+            batches.batchType,
+            batches.fifoOnly
+        )
 
     def batches(self, batches: BatchFilter, miner: psminer.SpectrumPatternsMiner) -> Self:
         """
@@ -161,17 +309,27 @@ class PerformanceSpectrum:
         @param miner:
         @return:
         """
-        self.set_records(
-            miner.cluster_pms_data(
-                batches.epsilon,
-                batches.minSamples,
-                self.records,
-                batches.batchType,
-                batches.fifoOnly
-            )
-        )
+        self.select(*self.batch_selection(batches, miner))
         return self
 
+    def quartile_mask(self, quartile: float, miner: psminer.SpectrumPatternsMiner) -> np.ndarray:
+        """
+        Selects the records of the selection that lie in the given quartile.
+        @param quartile:
+        @param miner:
+        @return:
+        """
+        return miner.quartile_mask(self.column('duration_seconds'), self.original_durations, quartile)
+
+    def time_mask(self, time_range: tuple[float, float], miner: psminer.SpectrumPatternsMiner) -> np.ndarray:
+        """
+        Selects the records of the selection that start in the given time range.
+        @param time_range: start and end in seconds since the epoch
+        @param miner:
+        @return:
+        """
+        return miner.time_mask(self.column('start_timestamp'), *time_range)
+
     def quartile(self, quartile: float, miner: psminer.SpectrumPatternsMiner) -> Self:
         """
         Filters the performance spectrum records based on the given quartile.
@@ -179,37 +337,35 @@ class PerformanceSpectrum:
         @param miner:
         @return:
         """
-        self.set_records(miner.filter_quartiles(self.records, self.original_records, quartile))
+        self.select(np.flatnonzero(self.quartile_mask(quartile, miner)))
         return self
 
-    def time(self, start_time, end_time, miner: psminer.SpectrumPatternsMiner) -> Self:
+    def time(self, time_range: tuple[float, float], miner: psminer.SpectrumPatternsMiner) -> Self:
         """
         Filters the performance spectrum records based on the given time range.
-        @param start_time:
-        @param end_time:
+        @param time_range: start and end in seconds since the epoch
         @param miner:
         @return:
         """
-        self.set_records(miner.filter_time(self.records, start_time.timestamp(), end_time.timestamp()))
+        self.select(np.flatnonzero(self.time_mask(time_range, miner)))
         return self
 
     def cases(self, cases):
         """
         Filters the performance spectrum records based on the given cases.
-        @param cases:
+        @param cases: case codes
         @return:
         """
         if cases is not None:
-            self.set_records(self.records[self.records['case_ID'].isin(cases)].reset_index(drop=True))
+            self.select(np.flatnonzero(np.isin(self.column('case_code'), cases)))
 
         return self
 
 
 class PerformanceSpectrumFilterWrapper:
-    def __init__(self, spectrum):
+    def __init__(self):
         self.batchFilter = None
         self.quartileFilter = None
-        self.spectrum = spectrum
 
     def quartile(self, quartile: float) -> Self:
         """
@@ -227,39 +383,31 @@ class PerformanceSpectrumFilterWrapper:
         @param batches:
         @return:
         """
-        if (
-                batches is not None and
-                batches.batchType is not None
-                and batches.epsilon is not None and batches.epsilon >= 0
-                and batches.minSamples is not None and batches.minSamples > 0
-        ):
+        if batches is not None and batches.active():
             self.batchFilter = batches
         return self
 
-    def prepare(self, miner):
-        """
-        Applies all filters to the performance spectrum using the given miner.
-        @param miner:
-        @return:
-        """
-        if self.batchFilter:
-            self.spectrum.batches(self.batchFilter, miner)
-        if self.quartileFilter:
-            self.spectrum.quartile(self.quartileFilter, miner)
-
-    def build(self, statistics_miner):
-        """
-        Builds the performance spectrum by obtaining metadata required for frontend display.
-        @param statistics_miner:
-        """
-        self.spectrum.metadata = statistics_miner.metadata(self.spectrum)
-
 
 class PerformanceSpectrumCollection:
-    def __init__(self, eventlog: Eventlog, spectra: list[PerformanceSpectrum]):
-        self.spectra = spectra
+    # Results of the stages of the pipeline, keyed by the key of the builder and the filters of all previous stages,
+    # so requests that only differ in a later filter reuse the earlier stages
+    stage_cache = StageCache(env.SPECTRUM_CACHE_MAX_BYTES)
+    stage_cache_lock = threading.Lock()
+
+    def __init__(self, eventlog: Eventlog, segments: list[Segment], log: CompactLog, source: list[PlanStep] = None,
+                 key: tuple = None):
+        self.segments = segments
+        self.log = log
+        self.source = source if source is not None else []
+        # Key of the segments in the builder cache, stages are not cached without it
+        self.key = key
+        # Keys of the current stage of every spectrum
+        self.keys = None
         self.miner = psminer.SpectrumPatternsMiner(eventlog)
-        self.statisticsMiner = psminer.LogStatisticsMiner(eventlog)
+        self.statisticsMiner = psminer.LogStatisticsMiner(eventlog, log)
+        self.filters = [PerformanceSpectrumFilterWrapper() for _ in segments]
+        # The spectra are built by spectrum()
+        self.spectra = None
 
         self.timeFilter = None
         self.caseFilter = None
@@ -270,29 +418,104 @@ class PerformanceSpectrumCollection:
         if not self.range:
             raise ValueError("Range is not set. Please initialize spectrum first.")
 
-        # Calculate statistics for each spectrum
-        for spectrum in self.spectra:
-            spectrum.statistics = self.statisticsMiner.statistics(
-                spectrum,
-                self.get_spectrum_df(spectrum),
-                total_range=self.range,
-                miner=self.miner
+        # Calculate statistics for each spectrum, the batch statistics depend on the last clustering of the request
+        batch_data = self.miner.batch_data
+        for key, spectrum in zip(self.keys, self.spectra):
+            spectrum.statistics = self.cached(
+                (key, 'statistics', self.range, len(self.spectra), batch_data and batch_data['frequency']),
+                lambda: self.statisticsMiner.statistics(
+                    spectrum,
+                    self.get_spectrum_events(spectrum),
+                    total_range=self.range,
+                    miner=self.miner
+                )
             )
         return self
 
-    def spectrum(self) -> Self:
-        filtered_cases = self.spectra[0].records['case_ID'].unique() if not self.spectra[0].empty else []
-        for index, spectrum in enumerate(self.spectra):
-            spectrum.filter_wrapper.prepare(self.miner)
-            if self.timeFilter:
-                spectrum.time(self.timeFilter.time_start, self.timeFilter.time_end, miner=self.miner)
-            # Calculate the current spectrum records shared by all segments
-            filtered_cases = np.intersect1d(filtered_cases, spectrum.records['case_ID'].unique())
+    def cached(self, key: tuple | None, compute: Callable):
+        """
+        Looks up the result of a stage in the stage cache or computes and caches it.
+        @param key: key of the stage, None if the stage is not cached
+        @param compute:
+        @return:
+        """
+        if key is None or self.key is None:
+            return compute()
+        with self.stage_cache_lock:
+            if key in self.stage_cache:
+                return self.stage_cache[key]
+        res = compute()
+        with self.stage_cache_lock:
+            self.stage_cache[key] = res
+        return res
 
-        # Make sure all segments have the same cases, i.e. the intersection of all spectra
-        for index, spectrum in enumerate(self.spectra):
-            spectrum.cases(filtered_cases)
-            spectrum.filter_wrapper.build(self.statisticsMiner)
+    def plan(self) -> QueryPlan:
+        """
+        Optimized plan of the request, see QueryPlan.
+        @return:
+        """
+        return self.logical_plan().optimize()
+
+    def logical_plan(self) -> QueryPlan:
+        return QueryPlan.logical(
+            self.source,
+            [(wrapper.batchFilter is not None, wrapper.quartileFilter is not None) for wrapper in self.filters],
+            self.timeFilter is not None
+        )
+
+    def explain(self) -> list[str]:
+        """
+        Describes the plan the spectra are built with.
+        @return:
+        """
+        return self.plan().explain()
+
+    def spectrum(self, plan: QueryPlan = None) -> Self:
+        """
+        Builds the spectra by evaluating the plan of the request.
+        @param plan: plan to evaluate, the optimized plan by default
+        @return:
+        """
+        plan = plan if plan is not None else self.plan()
+        self.spectra = [None] * len(self.segments)
+        # The key of a stage extends the key of the previous stage of the spectrum by its filters
+        keys = [None] * len(self.segments)
+        time_range = self.timeFilter.range() if self.timeFilter else None
+
+        for step in plan.steps:
+            index = step.spectrum
+            # the builder already restricted the log and extracted the segments
+            if step.operator == RECORDS:
+                pushed_range = time_range if TIME in step.filters else None
+                keys[index] = self.records_key(index, pushed_range)
+                records, original_durations = self.spectrum_records(index, pushed_range)
+                self.spectra[index] = PerformanceSpectrum(records, original_durations, self.filters[index])
+            elif step.operator == CLUSTER:
+                spectrum = self.spectra[index]
+                batches = self.filters[index].batchFilter
+                keys[index] = (keys[index], CLUSTER, batches.batchType, batches.epsilon, batches.minSamples,
+                               batches.fifoOnly)
+                positions, clusters, batch_data = self.cached(
+                    keys[index], lambda: (*spectrum.batch_selection(batches, self.miner), self.miner.batch_data))
+                self.miner.batch_data = batch_data
+                spectrum.select(positions, clusters)
+            elif step.operator == SELECT:
+                spectrum = self.spectra[index]
+                quartile = self.filters[index].quartileFilter if QUARTILE in step.filters else None
+                selected_range = time_range if TIME in step.filters else None
+                keys[index] = (keys[index], SELECT, quartile, selected_range)
+                spectrum.select(self.cached(
+                    keys[index], lambda: self.selection(spectrum, quartile, selected_range)))
+            elif step.operator == INTERSECT:
+                intersect_key = (tuple(keys), INTERSECT)
+                selections = self.cached(intersect_key, self.intersect_cases)
+                keys = [(intersect_key, index) for index in range(len(keys))]
+                for spectrum, selection in zip(self.spectra, selections):
+                    spectrum.select(selection)
+            elif step.operator == METADATA:
+                for key, spectrum in zip(keys, self.spectra):
+                    spectrum.metadata = self.cached((key, METADATA), lambda: self.statisticsMiner.metadata(spectrum))
+        self.keys = keys
 
         # Calculate the entire range for all spectra of e.g. a trace
         self.range = (
@@ -301,6 +524,121 @@ class PerformanceSpectrumCollection:
         )
         return self
 
+    def records_key(self, index: int, time_range: tuple[float, float] | None) -> tuple:
+        return (self.key, index, time_range), RECORDS
+
+    def spectrum_records(self, index: int, time_range: tuple[float, float] | None) -> tuple[DataFrame, np.ndarray]:
+        """
+        Records of a spectrum from the stage cache, see build_records.
+        @param index:
+        @param time_range:
+        @return:
+        """
+        return self.cached(self.records_key(index, time_range), lambda: self.build_records(index, time_range))
+
+    def epsilon_sweep(self, index: int, epsilons: list[float], min_samples: list[int], batch_type: str,
+                      fifo_only: bool) -> list[EpsilonSweepPoint]:
+        """
+        Batch statistics of a spectrum for every combination of epsilon and min_samples. Batches are clustered on all
+        records of the spectrum, like a batch filter that is applied before the other filters of the request.
+        @param index:
+        @param epsilons:
+        @param min_samples:
+        @param batch_type: 'start' or 'end'
+        @param fifo_only:
+        @return:
+        """
+        records, _ = self.spectrum_records(index, None)
+        return self.miner.epsilon_sweep(epsilons, min_samples, records['start_timestamp'].to_numpy(),
+                                        records['end_timestamp'].to_numpy(), batch_type, fifo_only)
+
+    def fifo_analysis(self, index: int, windows: int) -> FifoAnalysis:
+        """
+        Overtaking of the records of a spectrum that start in the time range of the request.
+        @param index:
+        @param windows: number of time windows
+        @return:
+        """
+        records, _ = self.spectrum_records(index, self.timeFilter.range() if self.timeFilter else None)
+        return self.miner.fifo_analysis(records['start_timestamp'].to_numpy(), records['end_timestamp'].to_numpy(),
+                                        windows)
+
+    def start_order(self, index: int) -> np.ndarray:
+        """
+        Start order of the occurrences of a spectrum, cached like a stage, so streams of the spectrum share it.
+        @param index:
+        @return:
+        """
+        return self.cached(((self.key, index), 'start_order'),
+                           lambda: psminer.SpectrumMiner.start_order(self.log, self.segments[index]))
+
+    def count_windows(self, index: int, window: float) -> int:
+        """
+        Number of time windows stream_patterns summarizes.
+        @param index:
+        @param window: length of a window in seconds
+        @return:
+        """
+        return psminer.SpectrumMiner.count_windows(self.log, self.segments[index], self.start_order(index), window,
+                                                   self.timeFilter.range() if self.timeFilter else None)
+
+    def stream_patterns(self, index: int, window: float, batches: BatchFilter = None) -> list[PatternWindow]:
+        """
+        Pattern summaries of consecutive time windows of a spectrum, computed window by window from the occurrences
+        of its segment instead of from its records.
+        @param index:
+        @param window: length of a window in seconds
+        @param batches: optional batch filter
+        @return:
+        """
+        # a miner of its own, the batch data of the miner belongs to the spectra of the request
+        miner = psminer.SpectrumPatternsMiner(self.miner.eventlog)
+        occurrences = psminer.SpectrumMiner.stream_occurrences(
+            self.log, self.segments[index], self.start_order(index), window,
+            self.timeFilter.range() if self.timeFilter else None)
+        return list(miner.stream(occurrences, batches))
+
+    def build_records(self, index: int, time_range: tuple[float, float] | None) -> tuple[DataFrame, np.ndarray]:
+        """
+        Builds the records of a spectrum from the occurrences of its segment.
+        @param index:
+        @param time_range: optional range the occurrences have to start in
+        @return: records and the durations of all occurrences, None if the records contain all occurrences
+        """
+        segment = self.segments[index]
+        records = psminer.SpectrumMiner.prepare_pms_data(self.log, segment, time_range)
+        original_durations = psminer.SpectrumMiner.segment_durations(self.log, segment) \
+            if time_range is not None else None
+        return records, original_durations
+
+    def selection(self, spectrum: PerformanceSpectrum, quartile: float | None,
+                  time_range: tuple[float, float] | None) -> np.ndarray:
+        """
+        Selects the records of a spectrum that pass the quartile and the time filter.
+        @param spectrum:
+        @param quartile:
+        @param time_range:
+        @return: positions of the selected records within the selection of the spectrum
+        """
+        mask = np.ones(len(spectrum), dtype=bool)
+        if quartile is not None:
+            mask &= spectrum.quartile_mask(quartile, self.miner)
+        if time_range is not None:
+            mask &= spectrum.time_mask(time_range, self.miner)
+        return np.flatnonzero(mask)
+
+    def intersect_cases(self) -> list[np.ndarray]:
+        """
+        Makes sure all segments have the same cases, i.e. the intersection of the cases of all spectra.
+        @return: positions of the records of the shared cases within the selection of every spectrum
+        """
+        filtered_cases = pd.unique(self.spectra[0].column('case_code')) if not self.spectra[0].empty else []
+        for spectrum in self.spectra:
+            # Calculate the current spectrum records shared by all segments
+            filtered_cases = np.intersect1d(filtered_cases, pd.unique(spectrum.column('case_code')))
+
+        return [np.flatnonzero(np.isin(spectrum.column('case_code'), filtered_cases)) for spectrum in self.spectra]
+
     def time(self, time_filter: TimeFilter) -> Self:
         """
         Queries the time filter to the collection. This is required because it is applied last and must therefore be
@@ -308,47 +646,34 @@ class PerformanceSpectrumCollection:
         @param time_filter:
         @return:
         """
-        if time_filter is not None and (time_filter.time_start is not None or time_filter.time_end is not None):
+        if time_filter is not None and time_filter.range() is not None:
             self.timeFilter = time_filter
 
         return self
 
-    def get_spectrum_df_with_collisions(self, spectrum: PerformanceSpectrum) -> DataFrame:
+    def get_spectrum_start_events(self, spectrum: PerformanceSpectrum) -> np.ndarray:
         """
-        Filters the original event log with respect to a performance spectrum records dataframe.
+        Filters the events of the log with respect to a performance spectrum records dataframe, i.e. returns the start
+        events of the records.
         @param spectrum:
-        @return:
+        @return: positions of the events in the compact log, in log order
         """
-        event_log = self.miner.eventlog
-        log_data = event_log.log_data()
-        filter_set = set(
-            zip(spectrum.records['case_ID'], spectrum.records['start_timestamp'], spectrum.records['activity']))
-        log_pairs = list(
-            zip(
-                log_data[event_log.case_id],
-                log_data[event_log.timestamp].apply(lambda x: x.timestamp()),
-                log_data[event_log.activity]
-            ),
-        )
-        mask = pd.Series(log_pairs, index=log_data.index).isin(filter_set)
-        res = log_data[mask]
-        return res
+        positions = spectrum.column('start_position')
+        return positions[np.argsort(self.log.rows[positions], kind="stable")]
 
-    def filter_df_for_cases(self, spectrum) -> DataFrame:
+    def filter_events_for_cases(self, spectrum) -> np.ndarray:
         """
-        Filters the original event log with respect to a set of cases.
+        Filters the events of the log with respect to a set of cases.
         @param spectrum:
-        @return:
+        @return: positions of the events in the compact log, in log order
         """
-        log_data = self.miner.eventlog.log_data()
-        res = log_data[log_data[self.miner.eventlog.case_id].isin(spectrum.records['case_ID'])].reset_index(drop=True)
-        return res
+        return self.log.events_of_cases(spectrum.column('case_code'))
 
-    def get_spectrum_df(self, spectrum: PerformanceSpectrum) -> DataFrame:
+    def get_spectrum_events(self, spectrum: PerformanceSpectrum) -> np.ndarray:
         collisions_possible = len(self.spectra) == 1
         if collisions_possible:
-            return self.get_spectrum_df_with_collisions(spectrum)
-        return self.filter_df_for_cases(spectrum)
+            return self.get_spectrum_start_events(spectrum)
+        return self.filter_events_for_cases(spectrum)
 
     def on(self, spectrum):
         """
@@ -356,7 +681,24 @@ class PerformanceSpectrumCollection:
         @param spectrum:
         @return:
         """
-        return self.spectra[spectrum].filter_wrapper
+        return self.filters[spectrum]
+
+    def response_records(self, records: DataFrame) -> list[dict]:
+        """
+        Converts numeric records to the records of the response, i.e. looks up the labels of the cases and activities.
+        @param records:
+        @return:
+        """
+        res = pd.DataFrame({
+            'case_ID': self.log.case_labels(records['case_code'].to_numpy()),
+            'activity': self.log.activity_labels(records['activity_code'].to_numpy()),
+            'start_timestamp': records['start_timestamp'].to_numpy(),
+            'duration': records['duration'].to_numpy(),
+            'end_timestamp': records['end_timestamp'].to_numpy(),
+        })
+        if 'cluster' in records:
+            res['cluster'] = records['cluster'].to_numpy()
+        return res.to_dict(orient='records')
 
     def to_response(self):
         """
@@ -366,7 +708,7 @@ class PerformanceSpectrumCollection:
         return {
             'spectra': [
                 {
-                    'records': spectrum.records.to_dict(orient='records'),
+                    'records': self.response_records(spectrum.records),
                     'empty': spectrum.empty,
                     'statistics': spectrum.statistics,
                     'metadata': spectrum.metadata,
@@ -385,7 +727,8 @@ class PerformanceSpectrumCollection:
             raise ValueError("Not initialized spectrum yet. Please initialize spectrum first.")
 
         eventlog = self.miner.eventlog
-        filtered_df = self.filter_df_for_cases(self.spectra[0])
+        rows = self.log.rows[self.filter_events_for_cases(self.spectra[0])]
+        filtered_df = eventlog.log_data().iloc[rows].reset_index(drop=True)
         parameters = {
             eventlog.case_id: "case:concept:name",
             eventlog.activity: "concept:name",
@@ -0,0 +1,97 @@
+from dataclasses import dataclass, field
+from typing import Self
+
+# Steps evaluated by the builder before the spectra are built
+RESTRICT = 'restrict'
+EXTRACT = 'extract'
+# Steps of every spectrum
+RECORDS = 'records'
+CLUSTER = 'cluster'
+SELECT = 'select'
+# Steps of all spectra
+INTERSECT = 'intersect'
+METADATA = 'metadata'
+
+TIME = 'time'
+QUARTILE = 'quartile'
+
+
+@dataclass
+class PlanStep:
+    operator: str
+    spectrum: int | None = None
+    filters: list[str] = field(default_factory=list)
+
+    def __str__(self):
+        target = f"spectrum {self.spectrum}" if self.spectrum is not None else "all"
+        filters = f" [{', '.join(self.filters)}]" if self.filters else ""
+        return f"{self.operator} {target}{filters}"
+
+
+class QueryPlan:
+    """
+    Plan of a performance spectrum request. The logical plan applies the filters in the order of the request: the
+    records of every spectrum are built from the occurrences of its segment, clustered into batches, filtered by
+    quartile and by time, and finally restricted to the cases shared by all spectra. optimize() rewrites the plan
+    into an equivalent plan that evaluates selective filters as early as possible.
+    """
+
+    def __init__(self, steps: list[PlanStep]):
+        self.steps = steps
+
+    @staticmethod
+    def logical(source: list[PlanStep], spectra: list[tuple[bool, bool]], time: bool) -> "QueryPlan":
+        """
+        Builds the logical plan of a request.
+        @param source: steps of the builder, e.g. the restriction to the filtered cases and the extraction of segments
+        @param spectra: (has batch filter, has quartile filter) of every spectrum
+        @param time: whether the request has a time filter
+        @return:
+        """
+        steps = list(source)
+        for index, (batches, quartile) in enumerate(spectra):
+            steps.append(PlanStep(RECORDS, index))
+            if batches:
+                steps.append(PlanStep(CLUSTER, index))
+            if quartile:
+                steps.append(PlanStep(SELECT, index, [QUARTILE]))
+            if time:
+                steps.append(PlanStep(SELECT, index, [TIME]))
+        steps.append(PlanStep(INTERSECT))
+        steps.append(PlanStep(METADATA))
+        return QueryPlan(steps)
+
+    def optimize(self) -> Self:
+        """
+        Rewrites the plan:
+        - The time filter of a spectrum without batches is pushed into building its records, so records are only
+          built for occurrences in the time range. Clustering depends on all records of a spectrum, so time filters
+          are never moved before it.
+        - Selections of the same spectrum that follow each other are fused into one selection. Quartile bounds are
+          computed from all records of a spectrum, so quartile and time filters can be evaluated together.
+        @return:
+        """
+        clustered = {step.spectrum for step in self.steps if step.operator == CLUSTER}
+        steps = []
+        for step in self.steps:
+            step = PlanStep(step.operator, step.spectrum, list(step.filters))
+            if step.operator == SELECT and step.spectrum not in clustered and TIME in step.filters:
+                records = next(s for s in steps if s.operator == RECORDS and s.spectrum == step.spectrum)
+                records.filters.append(TIME)
+                step.filters.remove(TIME)
+                if not step.filters:
+                    continue
+            previous = steps[-1] if steps else None
+            if step.operator == SELECT and previous is not None and previous.operator == SELECT \
+                    and previous.spectrum == step.spectrum:
+                previous.filters.extend(step.filters)
+                continue
+            steps.append(step)
+        return QueryPlan(steps)
+
+    def explain(self) -> list[str]:
+        """
+        Describes the steps of the plan in the order they are evaluated.
+        @return:
+        """
+        return [str(step) for step in self.steps]
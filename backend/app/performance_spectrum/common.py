@@ -18,12 +18,68 @@ class FrontendBarChart:
     counts: list[int]
 
 
+@dataclass
+class FrontendWorkloadChart:
+    bins: list[float]
+    workload: list[float]
+
+
 @dataclass
 class PerformanceSpectrumStatistics:
     histogram: dict
     frequency_diagram: FrontendBarChart
     frequency_end_diagram: FrontendBarChart
+    workload_diagram: FrontendWorkloadChart
     case_count: int
     activities: list[str]
     traces: list[dict]
     trace_count: int
+
+
+@dataclass
+class SegmentSummary:
+    start_activity: str
+    end_activity: str
+    count: int
+    quartiles: dict[float, float]
+    mean: float
+    min_timestamp: float
+    max_timestamp: float
+    batch_frequency: float | None
+
+
+@dataclass
+class EpsilonSweepPoint:
+    epsilon: float
+    minSamples: int
+    num_batches: int
+    batch_frequency: float
+    avg_size: float
+
+
+@dataclass
+class FifoWindow:
+    start: float
+    end: float
+    records: int
+    fifo_ratio: float
+    overtakings: int
+
+
+@dataclass
+class FifoAnalysis:
+    fifo_ratio: float
+    fifo_sequence_length: int
+    overtakings: int
+    windows: list[FifoWindow]
+
+
+@dataclass
+class PatternWindow:
+    start: float
+    end: float
+    records: int
+    num_batches: int | None
+    batch_frequency: float | None
+    fifo_ratio: float
+    workload: float
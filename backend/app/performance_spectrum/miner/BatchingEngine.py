@@ -0,0 +1,236 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.cluster import DBSCAN
+
+from compact_log import ranges
+
+# Inputs smaller than this are clustered by sklearn, fitting its neighbour search is cheap for them
+SMALL_INPUT = 1000
+# Maximum number of candidate pairs compared at once by the sorted-window search
+PAIR_CHUNK = 1 << 22
+
+
+def _within(a: np.ndarray, b: np.ndarray, eps_squared: float) -> np.ndarray:
+    # same comparison of squared distances as the neighbour search of sklearn
+    d = a - b
+    return d * d <= eps_squared
+
+
+def _window(values: np.ndarray, eps: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    For every value of a sorted array, the first and the last position of the values within eps of it.
+    @param values: sorted values
+    @param eps:
+    @return:
+    """
+    eps_squared = eps * eps
+    n = len(values)
+    lo = np.searchsorted(values, values - eps, side='left')
+    hi = np.searchsorted(values, values + eps, side='right') - 1
+    # the bounds of the search are rounded, move them until they agree with the comparison of squared distances
+    while True:
+        move = (lo > 0) & _within(values[np.maximum(lo - 1, 0)], values, eps_squared)
+        move |= ~_within(values[lo], values, eps_squared)
+        if not move.any():
+            break
+        lo = np.where(_within(values[lo], values, eps_squared), lo - move, lo + 1)
+    while True:
+        move = (hi < n - 1) & _within(values[np.minimum(hi + 1, n - 1)], values, eps_squared)
+        move |= ~_within(values[hi], values, eps_squared)
+        if not move.any():
+            break
+        hi = np.where(_within(values[hi], values, eps_squared), hi + move, hi - 1)
+    return lo, hi
+
+
+def _rank(component_of_core: np.ndarray, core_positions: np.ndarray, components: int) -> np.ndarray:
+    """
+    Labels of the components of the core points, numbered in the order DBSCAN finds them, i.e. by their first core
+    point.
+    @param component_of_core: component of every core point
+    @param core_positions: positions of the core points in the input
+    @param components:
+    @return: label of every component
+    """
+    first = np.full(components, np.iinfo(np.int64).max)
+    np.minimum.at(first, component_of_core, core_positions)
+    rank = np.empty(components, dtype=np.int64)
+    rank[np.argsort(first, kind='stable')] = np.arange(components)
+    return rank
+
+
+class BatchingEngine:
+    """
+    DBSCAN clustering of records by their start and/or end timestamps. The labels equal the labels of sklearn's
+    DBSCAN: clusters are numbered in the order of their first core point and border points belong to the first
+    cluster that reaches them.
+    """
+
+    @staticmethod
+    def labels(values: np.ndarray, eps: float, min_samples: int) -> np.ndarray:
+        """
+        Clusters the rows of values, picking the algorithm from the number of columns and rows.
+        @param values: one column of timestamps, or two columns of start and end timestamps
+        @param eps: maximum distance of neighbours, must be positive
+        @param min_samples: minimum number of neighbours of a core point, including the point itself
+        @return: cluster of every row, -1 for noise
+        """
+        if len(values) < SMALL_INPUT:
+            return BatchingEngine.dbscan(values, eps, min_samples)
+        if values.shape[1] == 1:
+            return BatchingEngine.sweep(values[:, 0], eps, min_samples)
+        return BatchingEngine.sorted_window(values, eps, min_samples)
+
+    @staticmethod
+    def dbscan(values: np.ndarray, eps: float, min_samples: int) -> np.ndarray:
+        return DBSCAN(eps=eps, min_samples=min_samples).fit(values).labels_
+
+    @staticmethod
+    def sweep(values: np.ndarray, eps: float, min_samples: int) -> np.ndarray:
+        """
+        One-dimensional DBSCAN: the neighbours of a value are a window of the sorted values, and core points form a
+        cluster as long as the gap to the next core point is at most eps.
+        @param values:
+        @param eps:
+        @param min_samples:
+        @return: cluster of every value, -1 for noise
+        """
+        labels = np.full(len(values), -1, dtype=np.int64)
+        if len(values) == 0:
+            return labels
+
+        order = np.argsort(values, kind='stable')
+        sorted_values = values[order]
+        lo, hi = _window(sorted_values, eps)
+        core = hi - lo + 1 >= min_samples
+        core_positions = np.flatnonzero(core)
+        if len(core_positions) == 0:
+            return labels
+
+        # a gap of more than eps between two core points in sorted order separates clusters
+        core_values = sorted_values[core_positions]
+        gaps = ~_within(core_values[1:], core_values[:-1], eps * eps)
+        component_of_core = np.concatenate([[0], np.cumsum(gaps)])
+        rank = _rank(component_of_core, order[core_positions], component_of_core[-1] + 1)
+
+        sorted_labels = np.full(len(values), -1, dtype=np.int64)
+        sorted_labels[core_positions] = rank[component_of_core]
+
+        # border points join the nearest core point on either side within eps, the cluster found first wins
+        border = np.flatnonzero(~core)
+        previous_core = np.searchsorted(core_positions, border) - 1
+        next_core = previous_core + 1
+        candidates = np.full((2, len(border)), np.iinfo(np.int64).max)
+        has_previous = previous_core >= 0
+        has_previous[has_previous] = core_positions[previous_core[has_previous]] >= lo[border[has_previous]]
+        candidates[0, has_previous] = rank[component_of_core[previous_core[has_previous]]]
+        has_next = next_core < len(core_positions)
+        has_next[has_next] = core_positions[next_core[has_next]] <= hi[border[has_next]]
+        candidates[1, has_next] = rank[component_of_core[next_core[has_next]]]
+        border_labels = candidates.min(axis=0)
+        reached = border_labels != np.iinfo(np.int64).max
+        sorted_labels[border[reached]] = border_labels[reached]
+
+        labels[order] = sorted_labels
+        return labels
+
+    @staticmethod
+    def sweep_statistics(values: np.ndarray, epsilons: list[float], min_samples: list[int]) \
+            -> tuple[np.ndarray, np.ndarray]:
+        """
+        Number of clusters and of clustered values of one-dimensional DBSCAN for every combination of epsilon and
+        min_samples. The values are sorted once; neither number depends on which cluster a border point joins, so
+        clusters are only counted by the gaps between core points and a value is clustered if a core point lies in
+        its window.
+        @param values:
+        @param epsilons: maximum distances of neighbours, 0 only groups equal values
+        @param min_samples:
+        @return: number of clusters and number of clustered values, indexed by epsilon and min_samples
+        """
+        clusters = np.zeros((len(epsilons), len(min_samples)), dtype=np.int64)
+        clustered = np.zeros((len(epsilons), len(min_samples)), dtype=np.int64)
+        if len(values) == 0:
+            return clusters, clustered
+
+        sorted_values = np.sort(values)
+        for i, eps in enumerate(epsilons):
+            lo, hi = _window(sorted_values, eps)
+            counts = hi - lo + 1
+            for j, samples in enumerate(min_samples):
+                core = counts >= samples
+                core_values = sorted_values[core]
+                if len(core_values) == 0:
+                    continue
+                clusters[i, j] = 1 + np.count_nonzero(~_within(core_values[1:], core_values[:-1], eps * eps))
+                cores_before = np.concatenate([[0], np.cumsum(core)])
+                clustered[i, j] = np.count_nonzero(cores_before[hi + 1] > cores_before[lo])
+        return clusters, clustered
+
+    @staticmethod
+    def sorted_window(values: np.ndarray, eps: float, min_samples: int) -> np.ndarray:
+        """
+        DBSCAN on several columns: candidate neighbours are the rows within eps in the first column, found on the
+        rows sorted by the first column, of which the rows within eps in all columns are neighbours.
+        @param values:
+        @param eps:
+        @param min_samples:
+        @return: cluster of every row, -1 for noise
+        """
+        n = len(values)
+        labels = np.full(n, -1, dtype=np.int64)
+        if n == 0:
+            return labels
+
+        order = np.argsort(values[:, 0], kind='stable')
+        sorted_values = values[order]
+        lo, hi = _window(sorted_values[:, 0], eps)
+        eps_squared = eps * eps
+
+        # neighbour pairs of the sorted rows, compared in chunks of rows to bound the memory of the candidate pairs
+        sources, targets = [], []
+        sizes = hi - lo + 1
+        ends = np.cumsum(sizes)
+        start = 0
+        while start < n:
+            stop = max(int(np.searchsorted(ends, (ends[start - 1] if start else 0) + PAIR_CHUNK, side='right')),
+                       start + 1)
+            rows = np.arange(start, stop)
+            source = np.repeat(rows, sizes[rows])
+            target = ranges(lo[rows], hi[rows] + 1)
+            distance = np.zeros(len(source))
+            for column in range(values.shape[1]):
+                d = sorted_values[source, column] - sorted_values[target, column]
+                distance += d * d
+            neighbours = distance <= eps_squared
+            sources.append(source[neighbours])
+            targets.append(target[neighbours])
+            start = stop
+        source, target = np.concatenate(sources), np.concatenate(targets)
+
+        core = np.bincount(source, minlength=n) >= min_samples
+        core_positions = np.flatnonzero(core)
+        if len(core_positions) == 0:
+            return labels
+
+        core_edges = core[source] & core[target]
+        graph = coo_matrix((np.ones(core_edges.sum(), dtype=np.int8), (source[core_edges], target[core_edges])),
+                           shape=(n, n))
+        _, component = connected_components(graph, directed=False)
+        component_of_core = np.unique(component[core_positions], return_inverse=True)[1].reshape(-1)
+        rank = _rank(component_of_core, order[core_positions], component_of_core.max() + 1)
+
+        sorted_labels = np.full(n, -1, dtype=np.int64)
+        sorted_labels[core_positions] = rank[component_of_core]
+
+        # border points join the cluster found first among the clusters of their core neighbours
+        core_label = np.full(n, np.iinfo(np.int64).max)
+        core_label[core_positions] = rank[component_of_core]
+        border_edges = ~core[source] & core[target]
+        border_labels = np.full(n, np.iinfo(np.int64).max)
+        np.minimum.at(border_labels, source[border_edges], core_label[target[border_edges]])
+        reached = ~core & (border_labels != np.iinfo(np.int64).max)
+        sorted_labels[reached] = border_labels[reached]
+
+        labels[order] = sorted_labels
+        return labels
@@ -1,13 +1,12 @@
-from collections import Counter
 from dataclasses import dataclass
 
 import numpy as np
 import pandas as pd
 from pandas import DataFrame
 
-from event_log_cache import get_log_data
+from compact_log import CompactLog
 from models import Eventlog
-from performance_spectrum.common import PerformanceSpectrumMetadata, FrontendBarChart
+from performance_spectrum.common import PerformanceSpectrumMetadata, FrontendBarChart, FrontendWorkloadChart
 from performance_spectrum.miner import SpectrumPatternsMiner
 
 
@@ -21,17 +20,16 @@ class BatchStatistics:
 
 
 class LogStatisticsMiner:
-    def __init__(self, event_log: Eventlog):
+    def __init__(self, event_log: Eventlog, log: CompactLog):
         self.event_log = event_log
-        # Retrieve original, unfiltered log data for variant extraction
-        self.original_df = get_log_data(event_log)
+        # Original, unfiltered log for variant extraction
+        self.log = log
 
     @staticmethod
     def extractHistogram(df):
         # Create histogram
         num_bins = 50
-        duration_col = df['duration'].astype('timedelta64[s]').astype(int)
-        counts, bin_edges = np.histogram(duration_col, bins=num_bins)
+        counts, bin_edges = np.histogram(df['duration_seconds'].to_numpy(), bins=num_bins)
 
         # Prepare data for JSON
         return {
@@ -39,54 +37,39 @@ class LogStatisticsMiner:
             'counts': counts.tolist()  # Convert to list for JSON serialization
         }
 
-    def filterCases(self, log_df, cases_to_keep: list):
+    def get_cases(self, events: np.ndarray) -> np.ndarray:
         """
-        Filter the original dataframe to only include cases that are in the provided list.
-        @param log_df:
-        @param cases_to_keep:
-        @return:
+        Get the codes of the cases the given events belong to.
+        @param events:
         """
-        return log_df[log_df[self.event_log.case_id].isin(cases_to_keep)] if cases_to_keep is not None else log_df
+        return np.unique(self.log.case_codes[events])
 
-    def get_counts(self, log_df):
+    def get_counts(self, events: np.ndarray):
         """
         Get the number of cases and activities in the log.
-        @param log_df:
+        @param events:
         """
-        return log_df[self.event_log.case_id].nunique()
-
-    from collections import Counter
+        return len(self.get_cases(events))
 
-    def extractVariants(self, log_df):
+    def extractVariants(self, events: np.ndarray):
         """
         Extract the most common variants from the event log as an array with items of form {trace, count}.
         """
-
-        # Filter original log in-place
-        case_ids = log_df[self.event_log.case_id].unique()
-        filtered_log = self.original_df[self.original_df[self.event_log.case_id].isin(case_ids)]
-
-        # Sort efficiently
-        filtered_log = filtered_log.sort_values([self.event_log.case_id, self.event_log.timestamp])
-
-        # Group activities into traces
-        traces_series = (
-            filtered_log
-            .groupby(self.event_log.case_id, sort=False)[self.event_log.activity]
-            .agg(list)  # faster than apply(list)
-        )
-
-        # Convert to tuples and count variants
-        trace_counter = Counter(map(tuple, traces_series.values))
+        variants, counts = self.log.variants.most_common(self.get_cases(events))
 
         # Prepare the top 5 variants
-        traces = [{'trace': trace, 'count': count} for trace, count in trace_counter.most_common(5)]
+        traces = [
+            {'trace': tuple(self.log.activity_labels(np.array(self.log.variants.sequences[variant], dtype=np.int32))),
+             'count': int(count)}
+            for variant, count in zip(variants[:5].tolist(), counts[:5].tolist())
+        ]
 
-        return trace_counter, traces
+        return variants, traces
 
-    def extractActivities(self, log_df):
-        filtered_log = self.filterCases(self.original_df, log_df[self.event_log.case_id].unique())
-        return filtered_log[self.event_log.activity].unique().tolist()
+    def extractActivities(self, events: np.ndarray):
+        # activities of the affected cases in order of their first occurrence in the log
+        activities = self.log.activity_codes[self.log.events_of_cases(self.get_cases(events))]
+        return self.log.activity_labels(pd.unique(activities)).tolist()
 
     @staticmethod
     def create_bar_chart(bins: int, records: DataFrame, ran: tuple[float, float]):
@@ -96,6 +79,36 @@ class LogStatisticsMiner:
             counts=counts.tolist()
         )
 
+    @staticmethod
+    def create_workload_chart(bins: int, start_timestamps: np.ndarray, end_timestamps: np.ndarray,
+                              ran: tuple[float, float]) -> FrontendWorkloadChart:
+        """
+        Workload over time, i.e. the mean number of records in progress during every bin of the same bins as
+        create_bar_chart. A sweep line over the sorted starts and ends gives the number of records in progress between
+        two events, whose cumulative area is interpolated at the edges of the bins.
+        @param bins:
+        @param start_timestamps:
+        @param end_timestamps:
+        @param ran:
+        @return:
+        """
+        edges = np.histogram_bin_edges(start_timestamps, bins=bins, range=ran)
+        times = np.concatenate([start_timestamps, end_timestamps])
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        # records in progress after every event and the area below them up to every event
+        in_progress = np.cumsum(np.where(order < len(start_timestamps), 1, -1))
+        area = np.concatenate([[0], np.cumsum(in_progress[:-1] * np.diff(times))])
+
+        event = np.searchsorted(times, edges, side='right') - 1
+        before = event < 0
+        event = np.maximum(event, 0)
+        area_at_edges = np.where(before, 0, area[event] + in_progress[event] * (edges - times[event]))
+        return FrontendWorkloadChart(
+            bins=edges.tolist(),
+            workload=(np.diff(area_at_edges) / np.diff(edges)).tolist()
+        )
+
     @staticmethod
     def metadata(spectrum) -> PerformanceSpectrumMetadata:
 
@@ -107,8 +120,8 @@ class LogStatisticsMiner:
                 mean=0,
                 variance=0
             )
-        nanos = spectrum.records['duration'].astype('timedelta64[s]').astype(int)
-        nanos_original = spectrum.original_records['duration'].astype('timedelta64[s]').astype(int)
+        nanos = spectrum.records['duration_seconds']
+        nanos_original = pd.Series(spectrum.original_durations)
         return PerformanceSpectrumMetadata(
             min_timestamp=spectrum.records['start_timestamp'].min(),
             max_timestamp=spectrum.records['end_timestamp'].max(),
@@ -129,7 +142,8 @@ class LogStatisticsMiner:
             dep=('start_timestamp', 'min')
         ).sort_values(by='dep')
 
-        avg_duration = grouped_batches.apply(lambda x: (x['end_timestamp'] - x['start_timestamp'])).mean().mean()
+        # mean duration of all clustered records
+        avg_duration = spectrum.records['duration'].mean()
 
         sorted_batch_times['interval'] = sorted_batch_times['dep'] - sorted_batch_times['dep'].shift()
 
@@ -144,20 +158,20 @@ class LogStatisticsMiner:
             batch_frequency=miner.batch_data['frequency']
         )
 
-    def statistics(self, spectrum, log_df, total_range: tuple, miner: SpectrumPatternsMiner) -> dict:
+    def statistics(self, spectrum, events: np.ndarray, total_range: tuple, miner: SpectrumPatternsMiner) -> dict:
 
         if not spectrum.metadata:
             raise ValueError("Spectrum metadata is not set.")
 
-        case_count = self.get_counts(log_df)
-        trace_counter, traces = self.extractVariants(log_df)
+        case_count = self.get_counts(events)
+        variants, traces = self.extractVariants(events)
 
         histogram = {}
         frequency_diagram = {}
         frequency_end_diagram = {}
+        workload_diagram = {}
         if not spectrum.empty:
-            df = pd.DataFrame(spectrum.records)
-            histogram = self.extractHistogram(df)
+            histogram = self.extractHistogram(spectrum.records)
             frequency_diagram = self.create_bar_chart(
                 200,
                 spectrum.records['start_timestamp'],
@@ -170,7 +184,14 @@ class LogStatisticsMiner:
                 ran=total_range
             )
 
-        activities = self.extractActivities(log_df)
+            workload_diagram = self.create_workload_chart(
+                200,
+                spectrum.column('start_timestamp'),
+                spectrum.column('end_timestamp'),
+                ran=total_range
+            )
+
+        activities = self.extractActivities(events)
 
         batch_statistics = self.batchStatistics(spectrum, miner)
 
@@ -178,9 +199,10 @@ class LogStatisticsMiner:
             'histogram': histogram,
             'frequency_diagram': frequency_diagram,
             'frequency_end_diagram': frequency_end_diagram,
+            'workload_diagram': workload_diagram,
             'case_count': case_count,
             'activities': activities,
             'traces': traces,
-            'traces_count': len(trace_counter),
+            'traces_count': len(variants),
             'batches': batch_statistics
         }
@@ -0,0 +1,158 @@
+from bisect import bisect_right
+
+import numpy as np
+
+
+def _inversions(ranks: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    For every position, the number of earlier positions with a greater rank and of later positions with a smaller
+    rank. The ranks are split bit by bit from the highest bit like in a wavelet tree: within a group of positions with
+    equal higher bits, a position with the bit unset counts the earlier positions with the bit set and vice versa, and
+    the group is stably partitioned by the bit for the next lower bit.
+    @param ranks: non-negative integer ranks
+    @return:
+    """
+    n = len(ranks)
+    if n < 2:
+        return np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    index = np.arange(n)
+    # positions ordered by their higher bits and in their original order within a group, with their ranks and counts
+    order, arranged = index.copy(), ranks.astype(np.int64)
+    greater_before, smaller_after = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    for bit in range(int(ranks.max()).bit_length() - 1, -1, -1):
+        group = arranged >> (bit + 1)
+        ones = ((arranged >> bit) & 1).astype(bool)
+        first = np.empty(n, dtype=bool)
+        first[0] = True
+        first[1:] = group[1:] != group[:-1]
+        starts = np.flatnonzero(first)
+        sizes = np.diff(np.append(starts, n))
+        group_start = np.repeat(starts, sizes)
+
+        ones_before = np.cumsum(ones) - ones
+        ones_before -= np.repeat(ones_before[starts], sizes)
+        zeros_before = index - group_start - ones_before
+        zeros = np.repeat(np.add.reduceat(~ones, starts, dtype=np.int64), sizes)
+        greater_before += np.where(ones, 0, ones_before)
+        smaller_after += np.where(ones, zeros - zeros_before, 0)
+
+        arrangement = group_start + np.where(ones, zeros + ones_before, zeros_before)
+        for values in (order, arranged, greater_before, smaller_after):
+            values[arrangement] = values.copy()
+    result = np.empty((2, n), dtype=np.int64)
+    result[:, order] = greater_before, smaller_after
+    return result[0], result[1]
+
+
+def _dense_ranks(values: np.ndarray) -> np.ndarray:
+    return np.unique(values, return_inverse=True)[1].reshape(-1)
+
+
+class OvertakingEngine:
+    """
+    Overtaking of records on a segment: a record overtakes another record if it starts later but ends earlier.
+    Records with the same start or end timestamp do not overtake each other.
+    """
+
+    @staticmethod
+    def fifo_positions(start_timestamps: np.ndarray, end_timestamps: np.ndarray) -> np.ndarray:
+        """
+        Longest sequence of records that do not overtake each other, i.e. whose end timestamps do not decrease when
+        the records are sorted by their start timestamps. Of several longest sequences, the one patience sorting
+        finds is returned.
+        @param start_timestamps:
+        @param end_timestamps: must not contain NaN
+        @return: positions of the records in the order of their start timestamps
+        """
+        order = np.argsort(start_timestamps, kind='quicksort')
+        ends = end_timestamps[order]
+        n = len(ends)
+        if n == 0:
+            return order
+
+        # A record ending no earlier than all records before it extends the longest sequence. Runs of such records
+        # are appended at once, only records ending before an earlier record need a binary search in the tails.
+        extends = np.empty(n, dtype=bool)
+        extends[0] = True
+        extends[1:] = ends[1:] >= np.maximum.accumulate(ends)[:-1]
+
+        # tails[k] is the smallest end of a sequence of length k + 1, which ends at the record piles[k]
+        tails, piles = [], []
+        previous = np.full(n, -1, dtype=np.int64)
+        values = ends.tolist()
+        overtaken = np.flatnonzero(~extends).tolist()
+        links = []
+        start = 0
+        for i in overtaken + [n]:
+            if i > start:
+                previous[start] = piles[-1] if piles else -1
+                previous[start + 1:i] = np.arange(start, i - 1)
+                tails.extend(values[start:i])
+                piles.extend(range(start, i))
+            if i == n:
+                break
+            x = values[i]
+            j = bisect_right(tails, x)
+            if j == len(tails):
+                tails.append(x)
+                piles.append(i)
+            else:
+                tails[j] = x
+                piles[j] = i
+            links.append(piles[j - 1] if j > 0 else -1)
+            start = i + 1
+        previous[overtaken] = links
+
+        # Walks the links back from the end of the longest sequence by doubling the jumps, the k-th record of the
+        # sequence is reached from its end by len(piles) - 1 - k jumps
+        links = np.append(previous, n)
+        links[links == -1] = n
+        distances = np.arange(len(piles) - 1, -1, -1)
+        sequence = np.full(len(piles), piles[-1], dtype=np.int64)
+        bit = 1
+        while bit <= distances[0]:
+            jump = (distances & bit) != 0
+            sequence[jump] = links[sequence[jump]]
+            links = links[links]
+            bit *= 2
+        return order[sequence]
+
+    @staticmethod
+    def overtaking_counts(start_timestamps: np.ndarray, end_timestamps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Number of records every record overtakes and is overtaken by, in O(n log n).
+        @param start_timestamps:
+        @param end_timestamps:
+        @return: number of earlier started records every record ends before, and number of later started records
+        every record ends after
+        """
+        n = len(start_timestamps)
+        overtakes = np.zeros(n, dtype=np.int64)
+        overtaken = np.zeros(n, dtype=np.int64)
+        if n == 0:
+            return overtakes, overtaken
+
+        # sorted by start and end, records with the same start never count each other
+        order = np.lexsort((end_timestamps, start_timestamps))
+        ranks = _dense_ranks(end_timestamps[order])
+        overtakes[order], overtaken[order] = _inversions(ranks)
+        return overtakes, overtaken
+
+    @staticmethod
+    def fifo_windows(start_timestamps: np.ndarray, end_timestamps: np.ndarray, bins: int,
+                     time_range: tuple[float, float] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Records, FIFO records and overtakings per time window. A record belongs to the window it starts in and is
+        FIFO if it neither overtakes nor is overtaken by another record.
+        @param start_timestamps:
+        @param end_timestamps:
+        @param bins: number of windows of equal length
+        @param time_range: range of the windows, the range of the start timestamps by default
+        @return: edges of the windows, number of records, number of FIFO records and number of overtakings of every
+        window
+        """
+        overtakes, overtaken = OvertakingEngine.overtaking_counts(start_timestamps, end_timestamps)
+        records, edges = np.histogram(start_timestamps, bins=bins, range=time_range)
+        fifo, _ = np.histogram(start_timestamps[(overtakes == 0) & (overtaken == 0)], bins=edges)
+        overtakings, _ = np.histogram(start_timestamps, bins=edges, weights=overtakes)
+        return edges, records, fifo, overtakings.astype(np.int64)
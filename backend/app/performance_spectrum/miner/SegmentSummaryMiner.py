@@ -0,0 +1,134 @@
+import numpy as np
+
+from compact_log import CompactLog, to_seconds
+from models import Eventlog
+from performance_spectrum.common import SegmentSummary
+from performance_spectrum.miner.SpectrumPatternsMiner import SpectrumPatternsMiner
+from pydantic_models.spectrum_filter_schema import BatchFilter
+
+QUARTILES = (0.25, 0.5, 0.75)
+
+
+def grouped_quantile(values: np.ndarray, group_starts: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """
+    Quantile of every group of values with the linear interpolation of numpy.quantile (and pandas), computed for all
+    groups at once.
+    @param values: values sorted within their groups, groups are stored one after another
+    @param group_starts: index of the first value of every group
+    @param counts: number of values of every group, must be positive
+    @param q:
+    @return:
+    """
+    # same arithmetic as numpy, so the results are identical
+    virtual = counts * q + (1 - q) - 1
+    previous = np.floor(virtual).astype(np.int64)
+    gamma = virtual - previous
+    next = np.minimum(previous + 1, counts - 1)
+    a, b = values[group_starts + previous], values[group_starts + next]
+    diff = b - a
+    return np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+
+
+class SegmentSummaryMiner:
+    """
+    Summaries of all segments of a log, i.e. of all pairs of directly following activities. The summaries are
+    computed from the directly-follows index for all segments at once, instead of one performance spectrum per
+    segment.
+    """
+
+    def __init__(self, eventlog: Eventlog):
+        self.eventlog = eventlog
+        self.patterns_miner = SpectrumPatternsMiner(eventlog)
+
+    def summaries(self, log: CompactLog, time_range: tuple[float, float] = None,
+                  batches: BatchFilter = None) -> list[SegmentSummary]:
+        """
+        Summarizes the occurrences of every segment of the log.
+        @param log:
+        @param time_range: optional range (in seconds since the epoch) the occurrences have to start in
+        @param batches: optional batch filter, its batch frequency is computed for every segment on all of its
+        occurrences, also the ones outside of the time range
+        @return: summaries of all segments with occurrences, ordered by start and end activity
+        """
+        index = log.directly_follows
+        starts = index.starts
+        groups = np.repeat(np.arange(len(index.keys)), np.diff(index.bounds))
+        start_timestamps = log.timestamps[starts]
+        end_timestamps = log.timestamps[starts + 1]
+
+        # like the batch filter of a spectrum, batches are found on all occurrences before the time filter applies
+        batch_frequencies = [None] * len(index.keys)
+        if batches is not None and batches.active():
+            batch_frequencies = self.batch_frequencies(batches, to_seconds(start_timestamps),
+                                                       to_seconds(end_timestamps), index.bounds[:-1],
+                                                       np.diff(index.bounds))
+
+        if time_range is not None:
+            start_seconds = to_seconds(start_timestamps)
+            in_range = (start_seconds >= time_range[0]) & (start_seconds <= time_range[1])
+            starts, groups = starts[in_range], groups[in_range]
+            start_timestamps, end_timestamps = start_timestamps[in_range], end_timestamps[in_range]
+
+        durations = (end_timestamps - start_timestamps) // 10 ** 9
+        counts = np.bincount(groups, minlength=len(index.keys))
+        present = np.flatnonzero(counts)
+        counts = counts[present]
+        # occurrences are grouped already, so the first occurrence of a group follows the ones of the previous group
+        group_starts = np.cumsum(counts) - counts
+
+        sorted_durations = durations[np.lexsort((durations, groups))]
+        quartiles = [grouped_quantile(sorted_durations, group_starts, counts, q) for q in QUARTILES]
+        means = np.add.reduceat(durations, group_starts) / counts if len(counts) else np.empty(0)
+        min_timestamps = to_seconds(np.minimum.reduceat(start_timestamps, group_starts)) if len(counts) else []
+        max_timestamps = to_seconds(np.maximum.reduceat(end_timestamps, group_starts)) if len(counts) else []
+
+        # keys are (start code + 1) * activity count + end code + 1, see DirectlyFollowsIndex
+        start_codes, end_codes = np.divmod(index.keys[present], index.activity_count)
+        start_activities = log.activity_labels(start_codes - 1)
+        end_activities = log.activity_labels(end_codes - 1)
+        return [
+            SegmentSummary(
+                start_activity=start_activities[i],
+                end_activity=end_activities[i],
+                count=int(counts[i]),
+                quartiles={q: float(quartile[i]) for q, quartile in zip(QUARTILES, quartiles)},
+                mean=float(means[i]),
+                min_timestamp=float(min_timestamps[i]),
+                max_timestamp=float(max_timestamps[i]),
+                batch_frequency=batch_frequencies[present[i]],
+            )
+            for i in range(len(present))
+        ]
+
+    def batch_frequencies(self, batches: BatchFilter, start_timestamps: np.ndarray, end_timestamps: np.ndarray,
+                          group_starts: np.ndarray, counts: np.ndarray) -> list[float]:
+        """
+        Share of the occurrences of every segment that belong to a batch, like the batch frequency of a spectrum.
+        @param batches:
+        @param start_timestamps: start of the occurrences in seconds, grouped by segment
+        @param end_timestamps: end of the occurrences in seconds, grouped by segment
+        @param group_starts: index of the first occurrence of every segment
+        @param counts: number of occurrences of every segment
+        @return:
+        """
+        if batches.epsilon == 0 and not batches.fifoOnly:
+            # exact matches: a batch is a run of at least minSamples equal values within a segment
+            columns = [start_timestamps] if batches.batchType == 'start' else [end_timestamps] \
+                if batches.batchType == 'end' else [start_timestamps, end_timestamps]
+            groups = np.repeat(np.arange(len(counts)), counts)
+            order = np.lexsort((*reversed(columns), groups))
+            keys = [groups[order], *(column[order] for column in columns)]
+            is_first = np.ones(len(order), dtype=bool)
+            is_first[1:] = np.any([key[1:] != key[:-1] for key in keys], axis=0)
+            run_starts = np.flatnonzero(is_first)
+            run_sizes = np.diff(np.append(run_starts, len(order)))
+            batched = run_sizes >= batches.minSamples
+            clustered = np.bincount(keys[0][run_starts[batched]], weights=run_sizes[batched], minlength=len(counts))
+            return (clustered / counts).tolist()
+
+        res = []
+        for start, count in zip(group_starts.tolist(), counts.tolist()):
+            self.patterns_miner.cluster(batches.epsilon, batches.minSamples, start_timestamps[start:start + count],
+                                        end_timestamps[start:start + count], batches.batchType, batches.fifoOnly)
+            res.append(self.patterns_miner.batch_data['frequency'])
+        return res
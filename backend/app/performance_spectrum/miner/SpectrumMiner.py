@@ -1,8 +1,18 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterator
+
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
 
+from compact_log import CompactLog, to_seconds
 from models import Eventlog
 
+# Occurrences of a segment, i.e. the positions of the start events and of the end events in the compact log
+Segment = tuple[np.ndarray, np.ndarray]
+# Start and end of a time window with the start and end timestamps (in seconds) of the occurrences starting in it
+Window = tuple[float, float, np.ndarray, np.ndarray]
+
 
 # class of Performance Spectrum that is used to store the performance spectrum in a format to be displayed in the
 # frontend
@@ -10,110 +20,165 @@ class SpectrumMiner:
     def __init__(self, eventlog: Eventlog):
         self.eventlog = eventlog
 
-    def prepare_pms_data(self, filtered_log) -> DataFrame:
-        # prepare pms data before extraction
-
-        pms_df = pd.DataFrame(data={
-            "case_ID": filtered_log.iloc[::2][self.eventlog.case_id].array,
-            "activity": filtered_log.iloc[::2][self.eventlog.activity].array,
-            "start_timestamp": filtered_log.iloc[::2][self.eventlog.timestamp].array,
-            "duration": filtered_log[self.eventlog.timestamp].diff().iloc[1::2].array,
-            "end_timestamp": filtered_log.iloc[1::2][self.eventlog.timestamp].array,
+    @staticmethod
+    def prepare_pms_data(log: CompactLog, segment: Segment, time_range: tuple[float, float] = None) -> DataFrame:
+        """
+        Builds the records of a segment. Records only consist of numeric columns: the case and activity codes of the
+        start event, start and end in seconds since the epoch, the duration in seconds and the duration in whole
+        seconds, which all duration statistics and filters work on, and the positions of the start and end event in
+        the log, which map records back to their events. Labels are only looked up for the response.
+        @param log:
+        @param segment:
+        @param time_range: optional range (in seconds since the epoch) the occurrences have to start in
+        @return:
+        """
+        start, end = segment
+        if time_range is not None:
+            start_seconds = to_seconds(log.timestamps[start])
+            in_range = np.flatnonzero((start_seconds >= time_range[0]) & (start_seconds <= time_range[1]))
+            start, end = start[in_range], end[in_range]
+        start_timestamps = log.timestamps[start]
+        end_timestamps = log.timestamps[end]
+
+        # sort by end and start timestamp, lexsort is stable like sort_values on several columns
+        order = np.lexsort((start_timestamps, end_timestamps))
+        start, end = start[order], end[order]
+        start_timestamps, end_timestamps = start_timestamps[order], end_timestamps[order]
+        durations = end_timestamps - start_timestamps
+
+        return pd.DataFrame(data={
+            "case_code": log.case_codes[start],
+            "activity_code": log.activity_codes[start],
+            "start_timestamp": to_seconds(start_timestamps),
+            "duration": durations / 1e9,
+            "end_timestamp": to_seconds(end_timestamps),
+            # segments never end before they start, so floor division truncates like a cast to whole seconds
+            "duration_seconds": durations // 10 ** 9,
+            "start_position": start,
+            "end_position": end,
         })
 
-        pms_df.sort_values(by=['end_timestamp', 'start_timestamp'], inplace=True)
-        pms_df.reset_index(drop=True, inplace=True)
-
-        pms_df["start_timestamp"] = pms_df["start_timestamp"].apply(lambda x: x.timestamp())
-        pms_df["end_timestamp"] = pms_df["end_timestamp"].apply(lambda x: x.timestamp())
-
-        return pms_df
+    @staticmethod
+    def start_order(log: CompactLog, segment: Segment) -> np.ndarray:
+        """
+        Positions of the occurrences of a segment in the order of their start, the order stream_occurrences walks
+        them in. It only depends on the segment, so it can be kept and shared by all streams of the segment.
+        @param log:
+        @param segment:
+        @return:
+        """
+        return np.argsort(to_seconds(log.timestamps[segment[0]]), kind='stable')
+
+    @staticmethod
+    def __bisect(log: CompactLog, segment: Segment, order: np.ndarray, seconds: float, lo: int, hi: int,
+                 right: bool = False) -> int:
+        # binary search for a start in the start order, only the starts of the probed occurrences are looked up
+        start = segment[0]
+        search = bisect_right if right else bisect_left
+        return search(order, seconds, lo, hi, key=lambda position: to_seconds(log.timestamps[start[position]]))
+
+    @staticmethod
+    def __in_range(log: CompactLog, segment: Segment, order: np.ndarray,
+                   time_range: tuple[float, float] | None) -> tuple[int, int]:
+        # bounds in the start order of the occurrences starting in the time range
+        if time_range is None:
+            return 0, len(order)
+        lo = SpectrumMiner.__bisect(log, segment, order, time_range[0], 0, len(order))
+        return lo, SpectrumMiner.__bisect(log, segment, order, time_range[1], lo, len(order), right=True)
+
+    @staticmethod
+    def __window_edges(log: CompactLog, segment: Segment, order: np.ndarray, lo: int, hi: int,
+                       window: float) -> np.ndarray:
+        # windows of the given length from the first start on, like a histogram the last window includes its end
+        first, last = to_seconds(log.timestamps[segment[0][order[[lo, hi - 1]]]])
+        count = max(int(np.ceil((last - first) / window)), 1)
+        return first + np.arange(count + 1) * window
+
+    @staticmethod
+    def count_windows(log: CompactLog, segment: Segment, order: np.ndarray, window: float,
+                      time_range: tuple[float, float] = None) -> int:
+        """
+        Number of windows stream_occurrences walks through.
+        @param log:
+        @param segment:
+        @param order: start order of the segment, see start_order
+        @param window: length of a window in seconds
+        @param time_range:
+        @return:
+        """
+        lo, hi = SpectrumMiner.__in_range(log, segment, order, time_range)
+        if lo == hi:
+            return 0
+        return len(SpectrumMiner.__window_edges(log, segment, order, lo, hi, window)) - 1
+
+    @staticmethod
+    def stream_occurrences(log: CompactLog, segment: Segment, order: np.ndarray, window: float,
+                           time_range: tuple[float, float] = None) -> Iterator[Window]:
+        """
+        Walks the occurrences of a segment in the order of their start, one time window of the given length after the
+        other, starting at the first occurrence. The bounds of every window are found by a binary search in the start
+        order, so only the timestamps of the occurrences of the current window are looked up and no records are built.
+        @param log:
+        @param segment:
+        @param order: start order of the segment, see start_order
+        @param window: length of a window in seconds
+        @param time_range: optional range (in seconds since the epoch) the occurrences have to start in
+        @return:
+        """
+        start, end = segment
+        lo, hi = SpectrumMiner.__in_range(log, segment, order, time_range)
+        if lo == hi:
+            return
+
+        edges = SpectrumMiner.__window_edges(log, segment, order, lo, hi, window)
+        for i in range(len(edges) - 1):
+            window_end = hi if i == len(edges) - 2 else SpectrumMiner.__bisect(log, segment, order, edges[i + 1], lo, hi)
+            occurrences = order[lo:window_end]
+            yield edges[i], edges[i + 1], to_seconds(log.timestamps[start[occurrences]]), \
+                to_seconds(log.timestamps[end[occurrences]])
+            lo = window_end
+
+    @staticmethod
+    def segment_durations(log: CompactLog, segment: Segment) -> np.ndarray:
+        """
+        Durations in whole seconds of all occurrences of a segment, like the duration_seconds of its records.
+        @param log:
+        @param segment:
+        @return:
+        """
+        start, end = segment
+        return (log.timestamps[end] - log.timestamps[start]) // 10 ** 9
 
-    def prepare_log_spectrum(self, log_data) -> DataFrame:
+    @staticmethod
+    def prepare_log_spectrum(log: CompactLog) -> Segment:
         """
         Get the Performance Spectrum for the entire log, i.e.
         for every case, start with the start event and end with the end event and take the difference as the duration.
         @return:
         """
-        # Sort the dataframe by case and time
-        df = log_data.sort_values(by=[self.eventlog.case_id, self.eventlog.timestamp])
-
-        # Group by case_id and get start and end activities
-        start_activities = df.groupby(self.eventlog.case_id).first().reset_index()
-        end_activities = df.groupby(self.eventlog.case_id).last().reset_index()
+        return log.trace_bounds()
 
-        # Create two separate dataframes
-        start_df = start_activities[[self.eventlog.case_id, self.eventlog.timestamp, self.eventlog.activity]].copy()
-        end_df = end_activities[[self.eventlog.case_id, self.eventlog.timestamp, self.eventlog.activity]].copy()
-
-        # Add a helper column to distinguish start and end
-        start_df['order'] = 0
-        end_df['order'] = 1
-
-        # Concatenate start and end
-        final_df = pd.concat([start_df, end_df], axis=0)
-
-        # Sort so that for each case_id, start comes before end
-        final_df = final_df.sort_values(by=[self.eventlog.case_id, 'order']).drop(columns='order').reset_index(
-            drop=True)
-
-        return final_df
-
-    def filter_variant(self, log_data, variant: list[str], activity_index: int, force_real_variant=True):
-        # Start with a mask of all True
-        mask = pd.Series(True, index=log_data.index)
-
-        # Check if each shifted activity matches the corresponding one in the variant
-        for i, act in enumerate(reversed(variant[:activity_index])):
-            shifted = log_data[self.eventlog.activity].shift(i)
-            mask &= shifted == act
-
-        for i, act in enumerate(variant[activity_index:]):
-            shifted = log_data[self.eventlog.activity].shift(-(i + 1))
-            mask &= shifted == act
-
-        # Ensure all activities are in the same case
-        for i in range(1, activity_index):
-            same_case = log_data[self.eventlog.case_id] == log_data[self.eventlog.case_id].shift(i)
-            mask &= same_case
-
-        if force_real_variant:
-            # Ensure the last activity is the same as the one in the variant
-            mask &= log_data[self.eventlog.case_id] != log_data[self.eventlog.case_id].shift(len(variant))
-
-        end_indices = log_data.index[mask]
-        # Just get rows for the last two activities of the matched sequence
-        # last activity is at end_indices, second last is one above (shift by 1)
-        last_two_indices = []
-        for end_idx in end_indices:
-            last_two_indices.extend([end_idx - 1, end_idx])
-
-        filtered_df = log_data.loc[last_two_indices].sort_values(
-            by=[self.eventlog.case_id, self.eventlog.timestamp]).reset_index(drop=True)
-        return filtered_df
-
-    def filter_entire_variant(self, log_data, variant: list[str]):
-        return [
-            self.filter_variant(log_data, variant, i)
-            for i in range(2, len(variant) + 1)
-        ]
-
-    def filter_segment(self, log_data, start_activity, end_activity):
-        df = log_data.sort_values(by=[self.eventlog.case_id, self.eventlog.timestamp]).reset_index(drop=True)
-        activity_col = self.eventlog.activity
-        case_col = self.eventlog.case_id
-
-        # Boolean mask for valid (start → end) transitions
-        is_start = df[activity_col] == start_activity
-        is_end_next = df[activity_col].shift(-1) == end_activity
-        same_case = df[case_col] == df[case_col].shift(-1)
-
-        mask = is_start & is_end_next & same_case
-        start_indices = df.index[mask]
-        end_indices = start_indices + 1
-
-        # Combine rows into a single DataFrame
-        all_indices = start_indices.tolist() + end_indices.tolist()
-        filtered_df = df.loc[all_indices].sort_values(by=[case_col, self.eventlog.timestamp]).reset_index(drop=True)
+    def filter_entire_variant(self, log: CompactLog, variant: list[str]) -> list[Segment]:
+        """
+        Finds the occurrences of all segments of the variant, i.e. the segments between the activities i - 1 and i of
+        the cases whose trace starts with the variant. The trace does not have to equal the variant, traces that
+        continue past it are kept like before, so the variant [A, B] also selects the cases of the trace A, B, C.
+        @param log:
+        @param variant:
+        @return: one segment per pair of consecutive activities of the variant
+        """
+        starts = log.offsets[log.variants.cases_starting_with(log.encode_activities(variant))]
+        return [(starts + i - 1, starts + i) for i in range(1, len(variant))]
 
-        return filtered_df
+    @staticmethod
+    def filter_segment(log: CompactLog, start_activity, end_activity) -> Segment:
+        """
+        Finds the occurrences of the segment, i.e. of the start activity directly followed by the end activity within a
+        case.
+        @param log:
+        @param start_activity:
+        @param end_activity:
+        @return:
+        """
+        start_code, end_code = log.encode_activities([start_activity, end_activity])
+        return log.directly_follows.occurrences(start_code, end_code)
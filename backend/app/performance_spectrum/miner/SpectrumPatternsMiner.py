@@ -1,10 +1,14 @@
+from typing import Iterable, Iterator
+
 import numpy as np
 import pandas as pd
-from pandas import DataFrame
-from sklearn.cluster import DBSCAN
 
-from helper import lnds_on_column
 from models import Eventlog
+from performance_spectrum.common import EpsilonSweepPoint, FifoAnalysis, FifoWindow, PatternWindow
+from performance_spectrum.miner.BatchingEngine import BatchingEngine
+from performance_spectrum.miner.OvertakingEngine import OvertakingEngine
+from performance_spectrum.miner.SpectrumMiner import Window
+from pydantic_models.spectrum_filter_schema import BatchFilter
 
 
 class SpectrumPatternsMiner:
@@ -13,72 +17,175 @@ class SpectrumPatternsMiner:
         self.eventlog = eventlog
         self.batch_data = None
 
-    def cluster_pms_data(self, epsilon, min_samples, pms_df, batch_type='end', fifo_only=False) -> DataFrame:
-
-        cols = [f"{batch_type}_timestamp"] if batch_type in ['start', 'end'] else ['start_timestamp', 'end_timestamp']
-
-        if fifo_only:
-            # sort start timestamps
-            pms_df.sort_values(by="start_timestamp", ascending=True, inplace=True)
-            idx = lnds_on_column(pms_df, 'end_timestamp')
-            pms_df = pms_df.loc[idx]
+    def cluster(self, epsilon, min_samples, start_timestamps: np.ndarray, end_timestamps: np.ndarray,
+                batch_type='end', fifo_only=False) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Clusters records into batches by their start and/or end timestamps.
+        @param epsilon:
+        @param min_samples:
+        @param start_timestamps: start of the records
+        @param end_timestamps: end of the records
+        @param batch_type: 'start', 'end' or clustering on both timestamps otherwise
+        @param fifo_only: only cluster the longest sequence of records that do not overtake each other
+        @return: positions of the clustered records, in the order they were clustered in, and their cluster labels
+        """
+        positions = self.fifo_positions(start_timestamps, end_timestamps) if fifo_only \
+            else np.arange(len(start_timestamps))
+
+        columns = [start_timestamps] if batch_type == 'start' else [end_timestamps] if batch_type == 'end' \
+            else [start_timestamps, end_timestamps]
+        values = np.column_stack([column[positions] for column in columns])
 
         if epsilon == 0:
             # Exact-match clustering:
-            # rows are neighbors only if all values in `cols` are exactly equal.
+            # rows are neighbors only if all values are exactly equal.
             # groups with size < min_samples are noise (-1).
-
-            pms_df = pms_df.copy()
-
-            # groupby(...).ngroup() assigns a group id to every exact duplicate group
-            group_ids = pms_df.groupby(cols, sort=False, dropna=False).ngroup()
-
-            # group sizes for each row's group
-            group_sizes = group_ids.map(group_ids.value_counts())
-
-            # Assign outlier to every point
-            pms_df["cluster"] = -1
-
-            # keep only groups large enough to be clusters
-            mask = group_sizes >= min_samples
-
-            # remap valid group ids to consecutive cluster labels 0..k-1
-            valid_groups = pd.unique(group_ids[mask])
-            remap = {g: i for i, g in enumerate(valid_groups)}
-
-            pms_df.loc[mask, "cluster"] = group_ids[mask].map(remap).to_numpy()
+            _, first, group_ids, group_sizes = np.unique(
+                values, axis=0, return_index=True, return_inverse=True, return_counts=True)
+            group_ids = group_ids.reshape(-1)
+
+            # remap groups large enough to be clusters to consecutive labels 0..k-1 in order of appearance
+            valid_groups = np.flatnonzero(group_sizes >= min_samples)
+            valid_groups = valid_groups[np.argsort(first[valid_groups], kind='stable')]
+            remap = np.full(len(group_sizes), -1)
+            remap[valid_groups] = np.arange(len(valid_groups))
+            labels = remap[group_ids]
         else:
-            db = DBSCAN(eps=epsilon, min_samples=min_samples).fit(pms_df[cols])
-            pms_df["cluster"] = db.labels_
+            labels = BatchingEngine.labels(values, epsilon, min_samples)
 
-        before = pms_df.copy()
-        pms_df = pms_df[pms_df.cluster != -1].reset_index(drop=True)
+        clustered = labels != -1
         self.batch_data = {
-            'frequency': len(pms_df) / len(before)
+            'frequency': int(clustered.sum()) / len(labels)
         }
 
-        return pms_df
+        return positions[clustered], labels[clustered]
 
     @staticmethod
-    def filter_quartiles(pms_df, original_pms_df, filtered_quartile: float) -> DataFrame:
+    def fifo_positions(start_timestamps: np.ndarray, end_timestamps: np.ndarray) -> np.ndarray:
+        """
+        Longest sequence of records that do not overtake each other, see OvertakingEngine.fifo_positions.
+        @param start_timestamps:
+        @param end_timestamps:
+        @return: positions of the records in the order of their start timestamps
+        """
+        return OvertakingEngine.fifo_positions(start_timestamps, end_timestamps)
+
+    @staticmethod
+    def fifo_analysis(start_timestamps: np.ndarray, end_timestamps: np.ndarray, windows: int) -> FifoAnalysis:
+        """
+        Overtaking of records over time: the share of records that neither overtake nor are overtaken by another
+        record, overall and per time window of their start timestamps.
+        @param start_timestamps: start of the records
+        @param end_timestamps: end of the records
+        @param windows: number of time windows of equal length
+        @return:
+        """
+        edges, records, fifo, overtakings = OvertakingEngine.fifo_windows(start_timestamps, end_timestamps, windows)
+        total = int(records.sum())
+        return FifoAnalysis(
+            fifo_ratio=float(fifo.sum() / total) if total else 0,
+            fifo_sequence_length=len(OvertakingEngine.fifo_positions(start_timestamps, end_timestamps)),
+            overtakings=int(overtakings.sum()),
+            windows=[
+                FifoWindow(
+                    start=float(edges[i]),
+                    end=float(edges[i + 1]),
+                    records=int(records[i]),
+                    fifo_ratio=float(fifo[i] / records[i]) if records[i] else 0,
+                    overtakings=int(overtakings[i]),
+                )
+                for i in range(len(records))
+            ]
+        )
+
+    def stream(self, windows: Iterable[Window], batches: BatchFilter = None) -> Iterator[PatternWindow]:
+        """
+        Summarizes the patterns of a spectrum window by window, e.g. of SpectrumMiner.stream_occurrences. Every window
+        is analysed on the records starting in it, so only one window and the records still in progress from earlier
+        windows are held at a time. Batches and overtaking across the border of two windows are not detected.
+        @param windows: consecutive time windows with the start and end timestamps of the records starting in them
+        @param batches: optional batch filter the batches of every window are clustered with
+        @return: summary of every window, the workload is the mean number of records in progress during the window
+        """
+        # ends of the records of earlier windows that are still in progress
+        in_progress = np.empty(0)
+        for window_start, window_end, start_timestamps, end_timestamps in windows:
+            busy = (np.minimum(in_progress, window_end) - window_start).sum()
+            busy += (np.minimum(end_timestamps, window_end) - start_timestamps).sum()
+            in_progress = np.concatenate([in_progress, end_timestamps])
+            in_progress = in_progress[in_progress > window_end]
+
+            records = len(start_timestamps)
+            num_batches = batch_frequency = None
+            if batches is not None and batches.active():
+                num_batches, batch_frequency = 0, 0
+                if records:
+                    _, labels = self.cluster(batches.epsilon, batches.minSamples, start_timestamps, end_timestamps,
+                                             batches.batchType, batches.fifoOnly)
+                    num_batches, batch_frequency = len(np.unique(labels)), self.batch_data['frequency']
+
+            overtakes, overtaken = OvertakingEngine.overtaking_counts(start_timestamps, end_timestamps)
+            yield PatternWindow(
+                start=float(window_start),
+                end=float(window_end),
+                records=records,
+                num_batches=num_batches,
+                batch_frequency=batch_frequency,
+                fifo_ratio=float(np.mean((overtakes == 0) & (overtaken == 0))) if records else 0,
+                workload=float(busy / (window_end - window_start)),
+            )
+
+    def epsilon_sweep(self, epsilons: list[float], min_samples: list[int], start_timestamps: np.ndarray,
+                      end_timestamps: np.ndarray, batch_type='end', fifo_only=False) -> list[EpsilonSweepPoint]:
+        """
+        Batch statistics of clustering records by their start or end timestamps for every combination of epsilon and
+        min_samples.
+        @param epsilons:
+        @param min_samples:
+        @param start_timestamps: start of the records
+        @param end_timestamps: end of the records
+        @param batch_type: 'start' or 'end'
+        @param fifo_only: only cluster the longest sequence of records that do not overtake each other
+        @return:
+        """
+        positions = self.fifo_positions(start_timestamps, end_timestamps) if fifo_only \
+            else np.arange(len(start_timestamps))
+        values = (start_timestamps if batch_type == 'start' else end_timestamps)[positions]
+        clusters, clustered = BatchingEngine.sweep_statistics(values, epsilons, min_samples)
+        return [
+            EpsilonSweepPoint(
+                epsilon=epsilon,
+                minSamples=samples,
+                num_batches=int(clusters[i, j]),
+                batch_frequency=float(clustered[i, j] / len(values)) if len(values) else 0,
+                avg_size=float(clustered[i, j] / clusters[i, j]) if clusters[i, j] else 0,
+            )
+            for i, epsilon in enumerate(epsilons)
+            for j, samples in enumerate(min_samples)
+        ]
+
+    @staticmethod
+    def quartile_mask(durations: np.ndarray, original_durations: np.ndarray, filtered_quartile: float) -> np.ndarray:
+        """
+        Selects the records whose duration lies in the given quartile of the durations of all records.
+        @param durations: durations of the records to filter
+        @param original_durations: durations of all records of the spectrum
+        @param filtered_quartile: upper bound of the quartile, e.g. 0.5 for the second quartile
+        @return: mask of the selected records
+        """
         # Calculate the quantiles for the entire dataset
-        duration_series = original_pms_df['duration'].astype('timedelta64[s]').astype(int)
+        duration_series = pd.Series(original_durations)
         quantiles_for_filtering_lower = duration_series.quantile(filtered_quartile - 0.25)
         quantiles_for_filtering_upper = duration_series.quantile(filtered_quartile)
-        pms_df = pms_df[
-            (pms_df['duration'].astype('timedelta64[s]').astype(int) > quantiles_for_filtering_lower) &
-            (pms_df['duration'].astype('timedelta64[s]').astype(int) <= quantiles_for_filtering_upper)
-            ]
-
-        return pms_df
+        return (durations > quantiles_for_filtering_lower) & (durations <= quantiles_for_filtering_upper)
 
     @staticmethod
-    def filter_time(pms_df, start_time, end_time) -> DataFrame:
-        if not len(pms_df) > 0:
-            return pms_df
-        # Filter the DataFrame based on the time range
-
-        mask = (pms_df['start_timestamp'] >= start_time) & (pms_df['start_timestamp'] <= end_time)
-        filtered_df = pms_df.loc[mask].reset_index(drop=True)
-
-        return filtered_df
+    def time_mask(start_timestamps: np.ndarray, start_time, end_time) -> np.ndarray:
+        """
+        Selects the records that start in the given time range.
+        @param start_timestamps:
+        @param start_time:
+        @param end_time:
+        @return: mask of the selected records
+        """
+        return (start_timestamps >= start_time) & (start_timestamps <= end_time)
@@ -1,6 +1,10 @@
 from .SpectrumMiner import SpectrumMiner
 from .SpectrumPatternsMiner import SpectrumPatternsMiner
 from .LogStatisticsMiner import LogStatisticsMiner
+from .SegmentSummaryMiner import SegmentSummaryMiner
+from .BatchingEngine import BatchingEngine
+from .OvertakingEngine import OvertakingEngine
 
 
-__all__ = ['SpectrumMiner', 'SpectrumPatternsMiner', 'LogStatisticsMiner']
\ No newline at end of file
+__all__ = ['SpectrumMiner', 'SpectrumPatternsMiner', 'LogStatisticsMiner', 'SegmentSummaryMiner', 'BatchingEngine',
+           'OvertakingEngine']
\ No newline at end of file
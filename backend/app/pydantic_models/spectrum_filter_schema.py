@@ -1,13 +1,22 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Literal, Annotated
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class TimeFilter(BaseModel):
     time_start: Optional[datetime] = None
     time_end: Optional[datetime] = None
 
+    def range(self) -> tuple[float, float] | None:
+        # range in seconds since the epoch, a missing bound does not restrict the range
+        if self.time_start is None and self.time_end is None:
+            return None
+        return (
+            self.time_start.timestamp() if self.time_start is not None else -float('inf'),
+            self.time_end.timestamp() if self.time_end is not None else float('inf'),
+        )
+
 
 class ActivityFilter(BaseModel):
     start_activity: str = None
@@ -20,6 +29,14 @@ class BatchFilter(BaseModel):
     minSamples: int = None
     fifoOnly: bool = False
 
+    def active(self) -> bool:
+        # incomplete batch filters are ignored
+        return (
+                self.batchType is not None
+                and self.epsilon is not None and self.epsilon >= 0
+                and self.minSamples is not None and self.minSamples > 0
+        )
+
 
 CaseFilter = List[str]
 VariantFilter = List[str]
@@ -42,3 +59,33 @@ class GlobalFilter(BaseModel):
 class SpectrumFilterRequest(BaseModel):
     spectra: List[SpectrumFilter] = []
     global_filters: GlobalFilter = None
+
+
+class SegmentSummaryRequest(BaseModel):
+    cases: Optional[CaseFilter] = None
+    time: Optional[TimeFilter] = None
+    batches: Optional[BatchFilter] = None
+
+
+class EpsilonSweepRequest(BaseModel):
+    # the time filter is applied after batching, so it does not change the batches
+    global_filters: GlobalFilter = None
+    on: int = 0
+    batchType: Literal['start', 'end'] = 'end'
+    epsilons: List[Annotated[float, Field(ge=0)]] = Field(min_length=1, max_length=1000)
+    minSamples: List[Annotated[int, Field(gt=0)]] = Field(default=[2], min_length=1, max_length=100)
+    fifoOnly: bool = False
+
+
+class FifoAnalysisRequest(BaseModel):
+    global_filters: GlobalFilter = None
+    on: int = 0
+    windows: int = Field(default=50, gt=0, le=1000)
+
+
+class PatternStreamRequest(BaseModel):
+    global_filters: GlobalFilter = None
+    on: int = 0
+    # length of a window in seconds
+    window: float = Field(gt=0)
+    batches: Optional[BatchFilter] = None
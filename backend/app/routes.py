@@ -2,13 +2,16 @@ import os
 
 from fastapi import APIRouter, UploadFile, File, Depends, Form, HTTPException
 
+import event_log_cache
 from fastapi.responses import FileResponse
 from models import Eventlog
 from pydantic_models.event_log_schema import EventLogColumnRequest
-from pydantic_models.spectrum_filter_schema import SpectrumFilterRequest
+from pydantic_models.spectrum_filter_schema import SpectrumFilterRequest, SegmentSummaryRequest, EpsilonSweepRequest, \
+    FifoAnalysisRequest, PatternStreamRequest
 from services.eventlog_service import upload_event_log, get_event_log, get_event_log_field_choosing_data, \
     update_event_log_column_data, get_mined_event_log_data, get_event_log_simple, remove_event_log_data, \
-    get_event_log_as_file
+    get_event_log_as_file, get_ingested_event_log, get_ingestion_status, append_event_log, \
+    get_segment_summaries, get_epsilon_sweep, get_fifo_analysis, get_pattern_stream
 from database import get_db
 
 router = APIRouter()
@@ -20,6 +23,11 @@ def get_event_logs(db=Depends(get_db)):
     return db.query(Eventlog).all()
 
 
+@router.get('/event-log-cache/stats')
+def get_event_log_cache_stats():
+    return event_log_cache.cache.stats()
+
+
 @router.get("/download/{filename}")
 def download_file(filename: str):
     file_path = f"exports/{filename}"
@@ -37,6 +45,11 @@ def get_event_log_basic_data(event_log: Eventlog = Depends(get_event_log_simple)
     return get_event_log_field_choosing_data(event_log, db=db)
 
 
+@router.get("/event-log/{event_log_id}/ingestion")
+def get_event_log_ingestion_status(event_log: Eventlog = Depends(get_event_log_simple)):
+    return get_ingestion_status(event_log)
+
+
 @router.get("/event-log/{event_log_id}/data")
 def get_event_log_data(event_log: Eventlog = Depends(get_event_log)):
     return event_log
@@ -44,15 +57,35 @@ def get_event_log_data(event_log: Eventlog = Depends(get_event_log)):
 
 # Post routes
 @router.post("/event-log/{event_log_id}/mined-data")
-def get_mined_data(filters: SpectrumFilterRequest, event_log: Eventlog = Depends(get_event_log)):
+def get_mined_data(filters: SpectrumFilterRequest, event_log: Eventlog = Depends(get_ingested_event_log)):
     return get_mined_event_log_data(event_log, filters)
 
 
 @router.post("/event-log/{event_log_id}/mined-data/export")
-def export_mined_data(filters: SpectrumFilterRequest, event_log: Eventlog = Depends(get_event_log)):
+def export_mined_data(filters: SpectrumFilterRequest, event_log: Eventlog = Depends(get_ingested_event_log)):
     return get_event_log_as_file(event_log, filters)
 
 
+@router.post("/event-log/{event_log_id}/mined-data/epsilon-sweep")
+def sweep_epsilon(request: EpsilonSweepRequest, event_log: Eventlog = Depends(get_ingested_event_log)):
+    return get_epsilon_sweep(event_log, request)
+
+
+@router.post("/event-log/{event_log_id}/mined-data/fifo")
+def analyze_fifo(request: FifoAnalysisRequest, event_log: Eventlog = Depends(get_ingested_event_log)):
+    return get_fifo_analysis(event_log, request)
+
+
+@router.post("/event-log/{event_log_id}/mined-data/patterns")
+def stream_patterns(request: PatternStreamRequest, event_log: Eventlog = Depends(get_ingested_event_log)):
+    return get_pattern_stream(event_log, request)
+
+
+@router.post("/event-log/{event_log_id}/segments")
+def get_segments(filters: SegmentSummaryRequest, event_log: Eventlog = Depends(get_ingested_event_log)):
+    return get_segment_summaries(event_log, filters)
+
+
 @router.post("/commit-event-log/{event_log_id}")
 def commit_event_log(
         request: EventLogColumnRequest,
@@ -69,6 +102,13 @@ def upload_event_log_data(name: str = Form(...), file: UploadFile = File(...), d
     return upload_event_log(name, file, db)
 
 
+@router.post("/event-log/{event_log_id}/append")
+def append_event_log_data(file: UploadFile = File(...), event_log: Eventlog = Depends(get_event_log_simple)):
+    if not file.filename.endswith(".xes"):
+        raise HTTPException(status_code=422, detail="Only .xes files are allowed")
+    return append_event_log(event_log, file)
+
+
 # Delete routes
 @router.delete("/delete-event-log/{event_log_id}")
 def delete_event_log(event_log: Eventlog = Depends(get_event_log_simple), db=Depends(get_db)):
@@ -1,3 +1,6 @@
+import os
+import threading
+
 import pm4py
 from fastapi import UploadFile, Path, Depends, HTTPException
 from sqlalchemy.orm import Session
@@ -5,11 +8,20 @@ from pm4py.objects.conversion.log import converter as log_converter
 
 import constants
 import helper
+import ingestion
+import mining_pool
 from database import SessionLocal, get_db
-from event_log_cache import get_log_data, remove_from_cache
+from event_log_cache import get_log_data, get_compact_log, remove_from_cache, parse_log, store_log_data, \
+    store_compact_log
+from ingestion import IngestionJob
 from models import Eventlog
-from pydantic_models.spectrum_filter_schema import SpectrumFilterRequest
+from pydantic_models.spectrum_filter_schema import SpectrumFilterRequest, SegmentSummaryRequest, GlobalFilter, \
+    EpsilonSweepRequest, FifoAnalysisRequest, PatternStreamRequest
 from performance_spectrum.PerformanceSpectrum import PerformanceSpectrum, PerformanceSpectrumCollection
+from performance_spectrum.miner import SegmentSummaryMiner
+
+# Maximum number of time windows of a pattern stream
+MAX_PATTERN_WINDOWS = 10000
 
 STANDARD_EVENT_LOG_COLUMNS = {
     "case_id": "case:concept:name",
@@ -42,13 +54,9 @@ def set_standard_columns(event_log: Eventlog, available_columns):
     return True
 
 
-# Get the event log for the choose data page in the frontend. Has side effect of updating trace and case count
-def get_event_log_field_choosing_data(event_log: Eventlog, db=SessionLocal):
-    # Retrieve event log data
-    log_data = get_log_data(event_log)
-
+# Update the trace and case count of the event log and configure the standard columns if available.
+def update_event_log_metadata(event_log: Eventlog, log_data):
     event_log.entry_count = len(log_data)
-    df = helper.clean_event_log(log_converter.apply(log_data, variant=log_converter.Variants.TO_DATA_FRAME)[:20])
     event_log.column_count = log_data.shape[1]
 
     # Check if the event log has at least 3 columns, otherwise no useful configuration is possible
@@ -57,6 +65,15 @@ def get_event_log_field_choosing_data(event_log: Eventlog, db=SessionLocal):
 
     # set the columns if standard column names are available
     set_standard_columns(event_log, log_data.columns)
+
+
+# Get the event log for the choose data page in the frontend. Has side effect of updating trace and case count
+def get_event_log_field_choosing_data(event_log: Eventlog, db=SessionLocal):
+    # Retrieve event log data
+    log_data = get_log_data(event_log)
+
+    df = helper.clean_event_log(log_converter.apply(log_data, variant=log_converter.Variants.TO_DATA_FRAME)[:20])
+    update_event_log_metadata(event_log, log_data)
     db.commit()
     db.refresh(event_log)
     return {"event_log": event_log, "df": df.to_dict(orient="records")}
@@ -72,6 +89,19 @@ def get_event_log(event_log_id: int = Path(...), db: Session = Depends(get_db)):
     return event_log
 
 
+# Error for requests on an event log that is ingested in the background
+def ingesting_error(job: IngestionJob) -> HTTPException:
+    return HTTPException(409, {'err': constants.INGESTING_ERROR, 'id': job.event_log_id, 'progress': job.progress})
+
+
+# Helper function to get an event log that is ready to be mined, i.e. not ingested in the background anymore
+def get_ingested_event_log(event_log: Eventlog = Depends(get_event_log)):
+    job = ingestion.get_job(event_log.id)
+    if job is not None and not job.finished:
+        raise ingesting_error(job)
+    return event_log
+
+
 # Helper function to get the event log from the database
 def get_event_log_simple(event_log_id: int = Path(...), db: Session = Depends(get_db)):
     event_log = db.query(Eventlog).filter(Eventlog.id == event_log_id).first()
@@ -82,27 +112,151 @@ def get_event_log_simple(event_log_id: int = Path(...), db: Session = Depends(ge
 
 # Basic upload function for the event log with name and file
 def upload_event_log(name: str, file: UploadFile, db: SessionLocal):
-    filename = helper.upload_file(file)
+    tmp_location, filename = helper.receive_upload(file)
 
-    event_log = Eventlog(name=name, path=filename, case_id=None, timestamp=None, activity=None)
-    db.add(event_log)
-    db.commit()
-    db.refresh(event_log)
+    # Event logs with the same content share the stored file, the file must not be removed before the log is added
+    with helper.upload_lock:
+        helper.store_upload(tmp_location, filename)
+        event_log = Eventlog(name=name, path=filename, case_id=None, timestamp=None, activity=None)
+        db.add(event_log)
+        db.commit()
+        db.refresh(event_log)
+
+    # Parse the log right away instead of during the first request that needs it
+    event_log_id = event_log.id
+    ingestion.submit(event_log_id, lambda job: ingest_event_log(event_log_id, job))
 
     return event_log
 
 
-def get_mined_event_log_spectrum_collection(event_log: Eventlog, filters: SpectrumFilterRequest):
+# Background job that parses an uploaded log, writes its snapshot and precomputes its metadata
+def ingest_event_log(event_log_id: int, job: IngestionJob):
+    db = SessionLocal()
+    try:
+        event_log = get_event_log_simple(event_log_id, db)
+        # Parsing dominates the ingestion, the remaining share is reserved for the metadata
+        log_data = get_log_data(event_log, progress=lambda fraction: job.report("parsing", 0.9 * fraction))
+
+        job.report("metadata", 0.9)
+        update_event_log_metadata(event_log, log_data)
+        db.commit()
+
+        # With the standard columns configured, the log can be prepared for mining right away
+        if event_log.case_id and event_log.activity and event_log.timestamp:
+            job.report("indexing", 0.95)
+            get_compact_log(event_log)
+    finally:
+        db.close()
+
+
+# Appends are applied one after another, every append builds on the upload the previous one produced
+append_lock = threading.Lock()
+
+
+# Appends the events of another XES file to an event log, the events are merged in the background
+def append_event_log(event_log: Eventlog, file: UploadFile):
+    # Checked before the file is received, submitting the job checks again for appends received at the same time
+    if ingestion.is_ingesting(event_log.id):
+        raise ingesting_error(ingestion.get_job(event_log.id))
+
+    tmp_location, _ = helper.receive_upload(file)
+    event_log_id = event_log.id
+    try:
+        ingestion.submit(event_log_id, lambda job: ingest_appended_events(event_log_id, tmp_location, job))
+    except ingestion.IngestionInProgress as e:
+        os.remove(tmp_location)
+        raise ingesting_error(e.job)
+    return event_log
+
+
+# Background job that merges appended events into the log. The merged log gets a new content addressed upload, while
+# other event logs of the previous upload keep using it. The merged upload is parsed as a whole, so its snapshot is the
+# frame a later parse of the upload yields, only the compact log and the cached spectra are extended incrementally.
+def ingest_appended_events(event_log_id: int, tmp_location: str, job: IngestionJob):
+    db = SessionLocal()
+    try:
+        with append_lock:
+            event_log = get_event_log_simple(event_log_id, db)
+            try:
+                merged_location, path = helper.append_upload(event_log.path, tmp_location)
+            except Exception:
+                raise HTTPException(400, {'err': constants.INVALID_EVENT_LOG_ERROR, 'id': event_log_id})
+            try:
+                merged = parse_log(os.path.basename(merged_location),
+                                   progress=lambda fraction: job.report("parsing", 0.8 * fraction))
+            except Exception:
+                os.remove(merged_location)
+                raise HTTPException(400, {'err': constants.INVALID_EVENT_LOG_ERROR, 'id': event_log_id})
+
+            job.report("merging", 0.8)
+            # the events of the stored upload come first, the appended events are the remaining rows
+            previous_rows = len(get_log_data(event_log))
+            appended = merged.iloc[previous_rows:]
+            columns = [event_log.case_id, event_log.activity, event_log.timestamp]
+            configured = all(columns)
+            if configured and not all(column in appended.columns and appended[column].notna().all()
+                                      for column in columns):
+                os.remove(merged_location)
+                raise HTTPException(400, {'err': constants.INVALID_EVENT_LOG_ERROR, 'id': event_log_id})
+            if configured:
+                previous_key = PerformanceSpectrum.using(event_log).get_log_key()
+                previous = get_compact_log(event_log)
+
+            with helper.upload_lock:
+                previous_path = event_log.path
+                helper.store_upload(merged_location, path)
+                try:
+                    event_log.path = path
+                    update_event_log_metadata(event_log, merged)
+                    store_log_data(event_log, merged)
+
+                    if configured:
+                        job.report("indexing", 0.9)
+                        log, positions, affected = previous.append(
+                            previous_rows, *(appended[column] for column in columns))
+                        store_compact_log(event_log, log)
+                        PerformanceSpectrum.using(event_log).carry_over_cache(previous_key, previous, log, positions,
+                                                                              affected)
+                    db.commit()
+                except BaseException:
+                    db.rollback()
+                    if not db.query(Eventlog).filter(Eventlog.path == path).count():
+                        remove_from_cache(path)
+                        helper.remove_upload(path)
+                    raise
+
+                # Like on deletion, the previous upload is only removed if no other event log uses it
+                if not db.query(Eventlog).filter(Eventlog.path == previous_path).count():
+                    remove_from_cache(previous_path)
+                    helper.remove_upload(previous_path)
+    finally:
+        db.close()
+        if os.path.exists(tmp_location):
+            os.remove(tmp_location)
+
+
+def get_ingestion_status(event_log: Eventlog):
+    job = ingestion.get_job(event_log.id)
+    if job is None:
+        # No ingestion was scheduled (e.g. logs uploaded before a restart), such logs are loaded on first access
+        return IngestionJob(event_log_id=event_log.id, state=ingestion.IDLE).to_response()
+    return job.to_response()
+
+
+def query_spectrum_collection(event_log: Eventlog, global_filters: GlobalFilter) -> PerformanceSpectrumCollection:
     query = PerformanceSpectrum.using(event_log)
 
-    global_filters = filters.global_filters
     if global_filters.variant:
         query = query.variant(global_filters.variant)
     elif global_filters.activities:
         query = query.segment(global_filters.activities)
 
     collection: PerformanceSpectrumCollection = query.cases(global_filters.cases).get()
-    collection.time(global_filters.time)
+    return collection.time(global_filters.time)
+
+
+def get_mined_event_log_spectrum_collection(event_log: Eventlog, filters: SpectrumFilterRequest):
+    collection = query_spectrum_collection(event_log, filters.global_filters)
 
     for spectrumfilter in filters.spectra:
         collection.on(spectrumfilter.on).batches(spectrumfilter.batches).quartile(spectrumfilter.quartile)
@@ -110,16 +264,95 @@ def get_mined_event_log_spectrum_collection(event_log: Eventlog, filters: Spectr
     return collection.spectrum()
 
 
-def get_event_log_as_file(event_log: Eventlog, filters: SpectrumFilterRequest):
+def export_event_log(event_log: Eventlog, filters: SpectrumFilterRequest):
     return get_mined_event_log_spectrum_collection(event_log, filters).to_xes()
 
 
+def mine_event_log_data(event_log: Eventlog, filters: SpectrumFilterRequest):
+    response = get_mined_event_log_spectrum_collection(event_log, filters).withStatistics().to_response()
+    # The event log is attached by the caller, it belongs to the session of the request
+    del response['event_log']
+    return response
+
+
+def get_event_log_as_file(event_log: Eventlog, filters: SpectrumFilterRequest):
+    return mining_pool.run(export_event_log, event_log, filters)
+
+
 # Get the performance spectrum basic data to display it in the frontend.
 def get_mined_event_log_data(event_log: Eventlog, filters: SpectrumFilterRequest):
-    return get_mined_event_log_spectrum_collection(event_log, filters).withStatistics().to_response()
+    return {**mining_pool.run(mine_event_log_data, event_log, filters), 'event_log': event_log}
+
+
+def summarize_event_log_segments(event_log: Eventlog, filters: SegmentSummaryRequest):
+    log = get_compact_log(event_log)
+    if filters.cases:
+        log = log.restrict(log.encode_cases(filters.cases))
+
+    time_range = filters.time.range() if filters.time is not None else None
+    return SegmentSummaryMiner(event_log).summaries(log, time_range, filters.batches)
+
+
+# Get the summaries of all segments of the event log for an overview of the whole process.
+def get_segment_summaries(event_log: Eventlog, filters: SegmentSummaryRequest):
+    return {'segments': mining_pool.run(summarize_event_log_segments, event_log, filters), 'event_log': event_log}
+
+
+# Queries the collection of a request on a single spectrum, the spectrum has to exist.
+def query_spectrum_on(event_log: Eventlog, global_filters: GlobalFilter, on: int) -> PerformanceSpectrumCollection:
+    collection = query_spectrum_collection(event_log, global_filters or GlobalFilter())
+    if not 0 <= on < len(collection.segments):
+        # raised with positional arguments, so the exception can be pickled by worker processes
+        raise HTTPException(422, "Spectrum not found")
+    return collection
+
+
+def sweep_event_log_epsilon(event_log: Eventlog, request: EpsilonSweepRequest):
+    collection = query_spectrum_on(event_log, request.global_filters, request.on)
+    return collection.epsilon_sweep(request.on, request.epsilons, request.minSamples, request.batchType,
+                                    request.fifoOnly)
+
+
+# Get the batch statistics of a spectrum for a range of batch parameters to tune the batch filter.
+def get_epsilon_sweep(event_log: Eventlog, request: EpsilonSweepRequest):
+    return {'sweep': mining_pool.run(sweep_event_log_epsilon, event_log, request), 'event_log': event_log}
+
+
+def analyze_event_log_fifo(event_log: Eventlog, request: FifoAnalysisRequest):
+    collection = query_spectrum_on(event_log, request.global_filters, request.on)
+    return collection.fifo_analysis(request.on, request.windows)
+
+
+# Get how often the records of a spectrum overtake each other, overall and over time.
+def get_fifo_analysis(event_log: Eventlog, request: FifoAnalysisRequest):
+    return {'fifo': mining_pool.run(analyze_event_log_fifo, event_log, request), 'event_log': event_log}
+
+
+def stream_event_log_patterns(event_log: Eventlog, request: PatternStreamRequest):
+    collection = query_spectrum_on(event_log, request.global_filters, request.on)
+    if collection.count_windows(request.on, request.window) > MAX_PATTERN_WINDOWS:
+        raise HTTPException(422, f"The spectrum spans more than {MAX_PATTERN_WINDOWS} windows")
+    return collection.stream_patterns(request.on, request.window, request.batches)
+
+
+# Get the batching, FIFO and workload patterns of a spectrum over time, one time window after the other.
+def get_pattern_stream(event_log: Eventlog, request: PatternStreamRequest):
+    return {'windows': mining_pool.run(stream_event_log_patterns, event_log, request), 'event_log': event_log}
 
 
 def remove_event_log_data(event_log: Eventlog, db: SessionLocal):
-    db.delete(event_log)
-    db.commit()
-    remove_from_cache(event_log)
+    # A running ingestion or append job would fail on the removed files or recreate the snapshot of a removed upload
+    if ingestion.is_ingesting(event_log.id):
+        raise ingesting_error(ingestion.get_job(event_log.id))
+
+    event_log_id, path = event_log.id, event_log.path
+    with helper.upload_lock:
+        db.delete(event_log)
+        db.commit()
+
+        # The stored file, its snapshot and its cache entries are shared by all event logs with the same content and
+        # are only removed together with the last of them
+        if not db.query(Eventlog).filter(Eventlog.path == path).count():
+            remove_from_cache(path)
+            helper.remove_upload(path)
+    ingestion.forget(event_log_id)
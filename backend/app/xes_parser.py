@@ -0,0 +1,353 @@
+import math
+import os
+from array import array
+from datetime import datetime, timezone
+from typing import Callable
+from xml.etree.ElementTree import iterparse
+from xml.parsers import expat
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+CASE_PREFIX = "case:"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NAT = np.iinfo(np.int64).min
+_MAX_DATE_CACHE = 100_000
+
+# Kinds of the typed XES attributes. "id" attributes are strings as far as the dataframe is concerned.
+_ATTRIBUTE_KINDS = {
+    "string": "str",
+    "id": "str",
+    "date": "date",
+    "int": "int",
+    "float": "float",
+    "boolean": "bool",
+}
+_NESTED_TAGS = {"list", "container", "values"}
+_LOG_LEVEL_TAGS = {"extension", "global", "classifier"}
+
+
+class UnsupportedXesError(Exception):
+    """
+    Raised for XES features the streaming parser does not build columns for (nested and list attributes). Callers
+    fall back to the pm4py importer in that case.
+    """
+    pass
+
+
+class _ColumnBuffer:
+    """
+    Append-only, typed buffer for a single column. Missing values are padded lazily, so a column is only touched by
+    the rows that actually carry the attribute. Strings are dictionary encoded while parsing, i.e. every distinct
+    value is stored exactly once.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.length = 0
+        self.missing = 0
+        # ints have no sentinel for missing values, their presence is tracked separately
+        self.present = array("b") if kind == "int" else None
+        if kind == "str":
+            self.values = array("i")
+            self.lookup = {}
+            self.uniques = []
+        elif kind == "float":
+            self.values = array("d")
+        elif kind in ("int", "date"):
+            self.values = array("q")
+        elif kind == "bool":
+            self.values = array("b")
+        else:
+            self.values = []
+
+    def _missing_value(self):
+        if self.kind in ("str", "bool"):
+            return -1
+        if self.kind == "date":
+            return _NAT
+        if self.kind == "int":
+            return 0
+        return math.nan
+
+    def _pad(self, row: int) -> None:
+        gap = row - self.length
+        if gap > 0:
+            self.values.extend([self._missing_value()] * gap)
+            if self.present is not None:
+                self.present.extend([0] * gap)
+            self.missing += gap
+            self.length = row
+
+    def append(self, row: int, kind: str, value) -> None:
+        if kind != self.kind:
+            self._promote(kind)
+            value = float(value) if self.kind == "float" else _to_object(kind, value)
+
+        self._pad(row)
+        if self.kind == "str":
+            code = self.lookup.get(value)
+            if code is None:
+                code = self.lookup[value] = len(self.uniques)
+                self.uniques.append(value)
+            self.values.append(code)
+        else:
+            self.values.append(value)
+            if self.present is not None:
+                self.present.append(1)
+        self.length = row + 1
+
+    def _promote(self, kind: str) -> None:
+        # Follow the type inference of pandas for a column with mixed values: ints and floats become floats,
+        # every other mix becomes an object column.
+        if {self.kind, kind} == {"int", "float"}:
+            if self.kind == "int":
+                self.values = array("d", self.to_numpy(self.length).astype(np.float64))
+                self.present = None
+                self.kind = "float"
+            return
+
+        column = self.to_numpy(self.length)
+        if isinstance(column, pd.DatetimeIndex):
+            column = column.astype(object)
+        self.values = list(np.asarray(column, dtype=object))
+        self.present = None
+        self.kind = "object"
+
+    def to_numpy(self, length: int):
+        """
+        Converts the buffer into the final column of the given length. Numeric buffers are wrapped without copying.
+        @param length: number of rows of the log
+        @return:
+        """
+        self._pad(length)
+        if self.kind == "object":
+            return np.asarray(self.values, dtype=object)
+
+        values = np.frombuffer(self.values, dtype=self.values.typecode) if len(self.values) else \
+            np.empty(0, dtype=self.values.typecode)
+        if self.kind == "str":
+            uniques = np.empty(len(self.uniques) + 1, dtype=object)
+            uniques[:-1] = self.uniques
+            uniques[-1] = math.nan
+            # missing values have code -1 and therefore take the trailing nan
+            return uniques.take(values)
+        if self.kind == "float":
+            return values
+        if self.kind == "date":
+            return pd.DatetimeIndex(values.astype(np.int64, copy=False).view("datetime64[ns]")).tz_localize("UTC")
+        if self.kind == "int":
+            values = values.astype(np.int64, copy=False)
+            if not self.missing:
+                return values
+            res = values.astype(np.float64)
+            res[np.frombuffer(self.present, dtype=np.int8) == 0] = math.nan
+            return res
+
+        # bool
+        if not self.missing:
+            return values == 1
+        res = (values == 1).astype(object)
+        res[values == -1] = math.nan
+        return res
+
+
+def _to_object(kind: str, value):
+    if kind == "date":
+        return pd.Timestamp(value, unit="ns", tz="UTC")
+    return value
+
+
+def _parse_date(value: str) -> int:
+    # Same semantics as the pm4py importer: a trailing Z means UTC and naive dates are interpreted as UTC
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    dt = datetime.fromisoformat(value)
+    dt = dt.astimezone(timezone.utc) if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+    delta = dt - _EPOCH
+    ns = (delta.days * 86_400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1_000
+    if not _NAT < ns <= np.iinfo(np.int64).max:
+        raise UnsupportedXesError(f"date out of range: {value}")
+    return ns
+
+
+def _parse_value(kind: str, value: str, date_cache: dict):
+    if kind == "str":
+        return value
+    if kind == "date":
+        ns = date_cache.get(value)
+        if ns is None:
+            if len(date_cache) >= _MAX_DATE_CACHE:
+                date_cache.clear()
+            ns = date_cache[value] = _parse_date(value)
+        return ns
+    if kind == "int":
+        res = int(value)
+        if not -2 ** 63 <= res < 2 ** 63:
+            raise UnsupportedXesError(f"int out of range: {value}")
+        return res
+    if kind == "float":
+        return float(value)
+    return str(value).lower() == "true"
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+class XesColumnBuilder:
+    """
+    Builds the typed columns of an event log row by row. Rows follow the layout of pm4py's dataframe conversion:
+    event attributes first, followed by the trace attributes prefixed with "case:", columns in order of appearance.
+    """
+
+    def __init__(self):
+        self.columns: dict[str, _ColumnBuffer] = {}
+        self.rows = 0
+
+    def add_trace(self, trace_attributes: dict, events: list[dict]) -> None:
+        case_attributes = {CASE_PREFIX + key: value for key, value in trace_attributes.items()}
+        for event in events:
+            row = event | case_attributes
+            for key, (kind, value) in row.items():
+                column = self.columns.get(key)
+                if column is None:
+                    column = self.columns[key] = _ColumnBuffer(kind)
+                column.append(self.rows, kind, value)
+            self.rows += 1
+
+    def build(self) -> DataFrame:
+        data = {}
+        for key in list(self.columns):
+            data[key] = self.columns.pop(key).to_numpy(self.rows)
+        # copy=False keeps the buffers as they are instead of consolidating them into fresh blocks
+        return DataFrame(data, index=pd.RangeIndex(self.rows), copy=False)
+
+
+def trace_range(path: str) -> tuple[int, int]:
+    """
+    Byte range of the traces of an XES file, from the start tag of the first trace of the log up to its end tag. The
+    file is streamed through expat, the parser iterparse builds on, which reports the byte offset of every tag, so tags
+    in comments, CDATA or attribute values are not mistaken for traces.
+    @param path: path of the XES file
+    @return: offset of the first <trace> and offset of </log>, both -1 if the file has no traces
+    """
+    parser = expat.ParserCreate()
+    depth = 0
+    bounds = [-1, -1]
+
+    def start_element(name, attributes):
+        nonlocal depth
+        depth += 1
+        if depth == 2 and bounds[0] == -1 and name.rsplit(":", 1)[-1] == "trace":
+            bounds[0] = parser.CurrentByteIndex
+
+    def end_element(name):
+        nonlocal depth
+        depth -= 1
+        if depth == 0 and name.rsplit(":", 1)[-1] == "log":
+            bounds[1] = parser.CurrentByteIndex
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    with open(path, "rb") as f:
+        parser.ParseFile(f)
+    if bounds[0] == -1 or bounds[1] == -1:
+        return -1, -1
+    return bounds[0], bounds[1]
+
+
+def parse_xes(path: str, progress: Callable[[float], None] = None) -> DataFrame:
+    """
+    Streams the XES file with an incremental XML parser and appends every event straight into typed column buffers.
+    Only the attributes of the trace that is currently parsed are kept as Python objects, so the peak memory stays
+    close to the size of the resulting dataframe. The result equals the dataframe of pm4py's XES importer.
+    @param path: path of the XES file
+    @param progress: optional callback that receives the fraction of the file that has been parsed so far
+    @return:
+    """
+    with open(path, "rb") as f:
+        return _parse_xes(f, os.fstat(f.fileno()).st_size, progress)
+
+
+def _parse_xes(f, file_size: int, progress: Callable[[float], None] = None) -> DataFrame:
+    builder = XesColumnBuilder()
+    date_cache = {}
+
+    log_elem = None
+    trace_attributes = None
+    trace_events = None
+    event_attributes = None
+    # The element whose attributes are currently read (log, trace, event or an ignored element)
+    scopes = []
+
+    for tree_event, elem in iterparse(f, events=("start", "end")):
+        tag = _local_name(elem.tag)
+
+        if tree_event == "start":
+            if tag in _ATTRIBUTE_KINDS:
+                if scopes and scopes[-1] in _ATTRIBUTE_KINDS:
+                    raise UnsupportedXesError(f"nested attribute {elem.get('key')}")
+                scopes.append(tag)
+
+                if event_attributes is not None:
+                    target = event_attributes
+                elif trace_attributes is not None and len(scopes) >= 2 and scopes[-2] == "trace":
+                    target = trace_attributes
+                else:
+                    continue
+
+                key = elem.get("key")
+                kind = _ATTRIBUTE_KINDS[tag]
+                try:
+                    target[key] = (kind, _parse_value(kind, elem.get("value"), date_cache))
+                except (TypeError, ValueError):
+                    # pm4py skips attributes whose values cannot be parsed
+                    pass
+                continue
+
+            if tag in _NESTED_TAGS:
+                raise UnsupportedXesError(f"{tag} attributes are not supported")
+
+            scopes.append(tag)
+            if tag == "event":
+                if event_attributes is not None:
+                    raise SyntaxError("file contains <event> in another <event> tag")
+                event_attributes = {}
+            elif tag == "trace":
+                if log_elem is None:
+                    raise SyntaxError("trace found outside of <log> tag")
+                if trace_attributes is not None:
+                    raise SyntaxError("file contains <trace> in another <trace> tag")
+                trace_attributes = {}
+                trace_events = []
+            elif tag == "log":
+                if log_elem is not None:
+                    raise SyntaxError("file contains > 1 <log> tags")
+                log_elem = elem
+            elif tag in _LOG_LEVEL_TAGS and log_elem is None:
+                raise SyntaxError(f"{tag} found outside of <log> tag")
+            continue
+
+        # end of an element
+        scopes.pop()
+        if tag == "event":
+            # events outside of traces are dropped, like pm4py does
+            if trace_events is not None:
+                trace_events.append(event_attributes)
+            event_attributes = None
+        elif tag == "trace":
+            builder.add_trace(trace_attributes, trace_events)
+            trace_attributes = None
+            trace_events = None
+            # Release the parsed elements, otherwise the whole document would be kept as a tree
+            log_elem.clear()
+            if progress is not None and file_size:
+                progress(min(f.tell() / file_size, 1.0))
+
+    if log_elem is None:
+        raise SyntaxError("file does not contain a <log> tag")
+
+    return builder.build()
@@ -0,0 +1,331 @@
+import os
+import shutil
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pm4py
+from fastapi import HTTPException
+
+import test_setup  # noqa: F401 (sets up the import path of the app)
+import compact_log
+import env
+import event_log_cache
+import log_snapshot
+import xes_parser
+
+
+class TestEventLogSnapshot(unittest.TestCase):
+
+    def setUp(self) -> None:
+        event_log_cache.cache.clear()
+        os.makedirs(env.UPLOAD_DIR, exist_ok=True)
+        shutil.copy("resources/advanced-log.xes", os.path.join(env.UPLOAD_DIR, "snapshot-log.xes"))
+        log_snapshot.remove_snapshot(log_snapshot.snapshot_dir("snapshot-log.xes"))
+
+    def test_first_load_writes_snapshot(self):
+        parsed = event_log_cache.load_log("snapshot-log.xes")
+        directory = log_snapshot.snapshot_dir("snapshot-log.xes")
+        self.assertTrue(os.path.isfile(os.path.join(directory, log_snapshot.MANIFEST_FILE)))
+
+        restored = log_snapshot.read_snapshot(os.path.join(env.UPLOAD_DIR, "snapshot-log.xes"), directory)
+        pd.testing.assert_frame_equal(parsed, restored)
+
+    def test_snapshot_subset_of_columns(self):
+        event_log_cache.load_log("snapshot-log.xes")
+        restored = log_snapshot.read_snapshot(
+            os.path.join(env.UPLOAD_DIR, "snapshot-log.xes"),
+            log_snapshot.snapshot_dir("snapshot-log.xes"),
+            columns=["case:concept:name", "time:timestamp"]
+        )
+        self.assertEqual(list(restored.columns), ["time:timestamp", "case:concept:name"])
+        self.assertEqual(len(restored), 51)
+
+    def test_stale_snapshot_is_not_used(self):
+        event_log_cache.load_log("snapshot-log.xes")
+        source_path = os.path.join(env.UPLOAD_DIR, "snapshot-log.xes")
+
+        # Replace the upload with a different log, the old snapshot must not be served anymore
+        shutil.copy("resources/simple-log.xes", source_path)
+        self.assertIsNone(log_snapshot.read_snapshot(source_path, log_snapshot.snapshot_dir("snapshot-log.xes")))
+        self.assertEqual(len(event_log_cache.load_log("snapshot-log.xes")), 12)
+
+
+class TestStreamingXesParser(unittest.TestCase):
+
+    def test_same_frame_as_pm4py(self):
+        for file in ["simple-log.xes", "advanced-log.xes"]:
+            path = os.path.join("resources", file)
+            expected = pm4py.convert_to_dataframe(pm4py.read_xes(path))
+            pd.testing.assert_frame_equal(xes_parser.parse_xes(path), expected)
+
+    def test_rejects_invalid_logs(self):
+        with self.assertRaises(SyntaxError):
+            xes_parser.parse_xes("resources/too_few_columns.xes")
+        with self.assertRaises(Exception):
+            xes_parser.parse_xes("resources/invalid-log.txt")
+
+
+class TestCompactLog(unittest.TestCase):
+
+    def setUp(self) -> None:
+        event_log_cache.cache.clear()
+        os.makedirs(env.UPLOAD_DIR, exist_ok=True)
+        shutil.copy("resources/advanced-log.xes", os.path.join(env.UPLOAD_DIR, "compact-log.xes"))
+        log_snapshot.remove_snapshot(log_snapshot.snapshot_dir("compact-log.xes"))
+        self.event_log = SimpleNamespace(id=4712, path="compact-log.xes", case_id="case:concept:name",
+                                         activity="concept:name", timestamp="time:timestamp")
+        self.log_data = xes_parser.parse_xes("resources/advanced-log.xes")
+
+    def test_encodes_columns(self):
+        log = compact_log.CompactLog.from_columns(
+            self.log_data["case:concept:name"], self.log_data["concept:name"], self.log_data["time:timestamp"])
+
+        self.assertEqual(log.case_codes.dtype, np.int32)
+        self.assertEqual(log.timestamps.dtype, np.int64)
+        self.assertEqual(list(log.cases), sorted(self.log_data["case:concept:name"].unique()))
+        np.testing.assert_array_equal(log.case_labels(log.case_codes), self.log_data["case:concept:name"])
+        np.testing.assert_array_equal(log.activity_labels(log.activity_codes), self.log_data["concept:name"])
+        self.assertEqual(log.encode_activities(["Payment", "Unknown"])[1], compact_log.UNKNOWN)
+
+    def test_events_are_sorted_once(self):
+        log = compact_log.CompactLog.from_columns(
+            self.log_data["case:concept:name"], self.log_data["concept:name"], self.log_data["time:timestamp"])
+        expected = self.log_data.sort_values(["case:concept:name", "time:timestamp"]).index.to_numpy()
+        np.testing.assert_array_equal(log.rows, expected)
+
+        # the offsets delimit the trace of every case
+        case = log.encode_cases(["A33939"])[0]
+        trace = self.log_data[self.log_data["case:concept:name"] == "A33939"].sort_values("time:timestamp")
+        self.assertEqual(list(log.activity_labels(log.trace(case))), list(trace["concept:name"]))
+        first, last = log.trace_bounds()
+        self.assertEqual((len(first), first[case], last[case]), (10, log.offsets[case], log.offsets[case + 1] - 1))
+
+    def test_restrict_to_cases(self):
+        log = compact_log.CompactLog.from_columns(
+            self.log_data["case:concept:name"], self.log_data["concept:name"], self.log_data["time:timestamp"])
+        restricted = log.restrict(log.encode_cases(["S126661", "A33939", "unknown"]))
+
+        self.assertEqual(len(restricted), self.log_data["case:concept:name"].isin(["S126661", "A33939"]).sum())
+        self.assertEqual(len(restricted.trace_bounds()[0]), 2)
+        for case in log.encode_cases(["S126661", "A33939"]):
+            np.testing.assert_array_equal(restricted.trace(case), log.trace(case))
+
+    def test_variant_index(self):
+        log = compact_log.CompactLog.from_columns(
+            self.log_data["case:concept:name"], self.log_data["concept:name"], self.log_data["time:timestamp"])
+        traces = self.log_data.sort_values(["case:concept:name", "time:timestamp"], kind="stable") \
+            .groupby("case:concept:name")["concept:name"].agg(tuple)
+
+        variants, counts = log.variants.most_common(np.arange(len(log.cases)))
+        self.assertEqual(counts.tolist(), sorted(traces.value_counts().tolist(), reverse=True))
+        for case, trace in zip(log.encode_cases(traces.index), traces):
+            sequence = log.variants.sequences[log.variants.case_variants[case]]
+            self.assertEqual(tuple(log.activity_labels(np.array(sequence))), trace)
+
+        # the index of a restricted log only counts the remaining cases
+        cases = log.encode_cases(["S126661", "A33939"])
+        variants, counts = log.restrict(cases).variants.most_common(np.sort(cases))
+        self.assertEqual(counts.sum(), 2)
+
+    def test_directly_follows_index(self):
+        log = compact_log.CompactLog.from_columns(
+            self.log_data["case:concept:name"], self.log_data["concept:name"], self.log_data["time:timestamp"])
+
+        for start_code in range(len(log.activities)):
+            for end_code in range(len(log.activities)):
+                expected = [p for p in range(len(log) - 1) if log.case_codes[p] == log.case_codes[p + 1] and
+                            (log.activity_codes[p], log.activity_codes[p + 1]) == (start_code, end_code)]
+                starts, ends = log.directly_follows.occurrences(start_code, end_code)
+                self.assertEqual(starts.tolist(), expected)
+                np.testing.assert_array_equal(ends, starts + 1)
+        self.assertEqual(len(log.directly_follows.occurrences(compact_log.UNKNOWN, 0)[0]), 0)
+
+    def test_append_equals_building_the_whole_log(self):
+        columns = ["case:concept:name", "concept:name", "time:timestamp"]
+        log_data = self.log_data.sample(frac=1, random_state=0).reset_index(drop=True)
+        log_data.loc[[3, 30], "case:concept:name"] = "new case"
+        log_data.loc[[5, 40], "concept:name"] = "new activity"
+        head, tail = log_data.iloc[:25], log_data.iloc[25:].reset_index(drop=True)
+
+        log = compact_log.CompactLog.from_columns(*(head[column] for column in columns))
+        log.variants, log.directly_follows
+        appended, positions, affected = log.append(len(head), *(tail[column] for column in columns))
+        expected = compact_log.CompactLog.from_columns(*(log_data[column] for column in columns))
+
+        for name in ["rows", "case_codes", "cases", "activity_codes", "activities", "timestamps", "offsets"]:
+            np.testing.assert_array_equal(getattr(appended, name), getattr(expected, name))
+        np.testing.assert_array_equal(appended.rows[positions], log.rows)
+        np.testing.assert_array_equal(affected, np.unique(expected.encode_cases(tail["case:concept:name"])))
+
+        # the indexes were updated instead of being built again
+        self.assertIsNotNone(appended._CompactLog__variants)
+        self.assertIsNotNone(appended._CompactLog__directly_follows)
+        np.testing.assert_array_equal(appended.variants.case_variants, expected.variants.case_variants)
+        self.assertEqual(appended.variants.sequences, expected.variants.sequences)
+        for name in ["keys", "bounds", "starts"]:
+            np.testing.assert_array_equal(getattr(appended.directly_follows, name),
+                                          getattr(expected.directly_follows, name))
+
+    def test_snapshot_and_parsed_log_build_the_same_log(self):
+        parsed = event_log_cache.load_compact_log(self.event_log)
+        from_snapshot = event_log_cache.load_compact_log(self.event_log)
+
+        for name in ["rows", "case_codes", "cases", "activity_codes", "activities", "timestamps", "offsets"]:
+            np.testing.assert_array_equal(getattr(parsed, name), getattr(from_snapshot, name))
+
+    def test_compact_log_is_stored_and_mapped(self):
+        built = compact_log.CompactLog.from_columns(self.log_data["case:concept:name"], self.log_data["concept:name"],
+                                                    self.log_data["time:timestamp"])
+        mapped = event_log_cache.load_compact_log(self.event_log)
+
+        self.assertIsInstance(mapped.timestamps, np.memmap)
+        self.assertIsInstance(mapped.case_codes, np.memmap)
+        self.assertLess(mapped.nbytes, built.nbytes)
+        np.testing.assert_array_equal(built.timestamps, mapped.timestamps)
+
+    def test_stale_compact_log_is_not_mapped(self):
+        event_log_cache.load_compact_log(self.event_log)
+        columns = [self.event_log.case_id, self.event_log.activity, self.event_log.timestamp]
+        directory = log_snapshot.compact_dir(self.event_log.path, columns)
+
+        fingerprint = log_snapshot.source_fingerprint(os.path.join(env.UPLOAD_DIR, self.event_log.path))
+
+        self.assertIsNotNone(compact_log.CompactLog.load(directory, fingerprint))
+        self.assertIsNone(compact_log.CompactLog.load(directory, "other fingerprint"))
+
+    def test_cached_separately_from_parsed_log(self):
+        log = event_log_cache.get_compact_log(self.event_log)
+        self.assertIs(event_log_cache.get_compact_log(self.event_log), log)
+        self.assertNotIn(self.event_log.path, event_log_cache.cache)
+        self.assertLess(log.nbytes, event_log_cache.log_size(self.log_data))
+
+        event_log_cache.remove_from_cache(self.event_log.path)
+        self.assertEqual(len(event_log_cache.cache), 0)
+
+
+    def test_built_indexes_count_against_the_budget(self):
+        log = event_log_cache.get_compact_log(self.event_log)
+        key = event_log_cache.compact_log_key(self.event_log)
+        size = event_log_cache.cache[key]["size"]
+
+        log.directly_follows
+        self.assertEqual(event_log_cache.cache[key]["size"], size + log.directly_follows.nbytes)
+        log.variants
+        self.assertEqual(event_log_cache.cache[key]["size"], log.nbytes)
+        self.assertEqual(event_log_cache.cache.currsize, log.nbytes)
+
+class TestLogCache(unittest.TestCase):
+
+    @staticmethod
+    def entry(size, cost):
+        return {"log": None, "size": size, "cost": cost}
+
+    def test_evicts_by_memory_budget(self):
+        cache = event_log_cache.LogCache(max_bytes=100)
+        cache[1] = self.entry(60, 1)
+        cache[2] = self.entry(30, 1)
+        self.assertEqual(cache.currsize, 90)
+
+        cache[3] = self.entry(40, 1)
+        self.assertNotIn(1, cache)
+        self.assertEqual(cache.currsize, 70)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expensive_logs_outlive_cheap_ones(self):
+        cache = event_log_cache.LogCache(max_bytes=100)
+        cache[1] = self.entry(50, 100)
+        cache[2] = self.entry(50, 1)
+        cache[3] = self.entry(50, 1)
+        # the log that is expensive to reload is kept although it is the least recently used one
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+
+    def test_too_large_logs_are_not_cached(self):
+        cache = event_log_cache.LogCache(max_bytes=100)
+        cache[1] = self.entry(10, 1)
+        cache[2] = self.entry(200, 1)
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+
+    def test_stats(self):
+        cache = event_log_cache.LogCache(max_bytes=100)
+        self.assertIsNone(cache.get(1))
+        cache[1] = self.entry(10, 1)
+        self.assertIsNotNone(cache.get(1))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["resident_bytes"]), (1, 1, 10))
+
+    def test_log_size(self):
+        log_data = xes_parser.parse_xes("resources/advanced-log.xes")
+        self.assertGreater(event_log_cache.log_size(log_data), log_data.memory_usage(deep=False).sum())
+
+
+class TestSingleFlightLoader(unittest.TestCase):
+
+    def setUp(self) -> None:
+        event_log_cache.cache.clear()
+        self.event_log = SimpleNamespace(id=4711, path="single-flight-log.xes")
+        self.calls = 0
+
+    def slow_load(self, file, progress=None):
+        self.calls += 1
+        time.sleep(0.2)
+        return pd.DataFrame({"a": [1, 2, 3]})
+
+    def failing_load(self, file, progress=None):
+        self.calls += 1
+        time.sleep(0.2)
+        raise ValueError("broken log")
+
+    def load_concurrently(self, count=5, timeout=None):
+        results = [None] * count
+
+        def run(index):
+            try:
+                results[index] = event_log_cache.get_log_data(self.event_log, timeout=timeout)
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_requests_share_one_load(self):
+        with mock.patch.object(event_log_cache, "load_log", self.slow_load):
+            results = self.load_concurrently()
+
+        self.assertEqual(self.calls, 1)
+        for result in results:
+            self.assertIs(result, results[0])
+        self.assertNotIn(self.event_log.path, event_log_cache.loads)
+
+    def test_errors_are_passed_to_every_waiter(self):
+        with mock.patch.object(event_log_cache, "load_log", self.failing_load):
+            results = self.load_concurrently()
+
+            self.assertEqual(self.calls, 1)
+            for result in results:
+                self.assertIsInstance(result, HTTPException)
+                self.assertEqual(result.status_code, 400)
+
+            # The failed load is cleaned up, so the next request retries instead of hanging
+            self.assertNotIn(self.event_log.path, event_log_cache.loads)
+            with self.assertRaises(HTTPException):
+                event_log_cache.get_log_data(self.event_log)
+            self.assertEqual(self.calls, 2)
+
+    def test_waiters_time_out(self):
+        with mock.patch.object(event_log_cache, "load_log", self.slow_load):
+            results = self.load_concurrently(count=2, timeout=0.01)
+
+        errors = [result for result in results if isinstance(result, HTTPException)]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].status_code, 503)
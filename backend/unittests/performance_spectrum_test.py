@@ -1,9 +1,26 @@
+import os
 import unittest
 from datetime import datetime
 import shutil
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import DBSCAN
 
-from models import Eventlog
 from test_setup import TestingSessionLocal, client
+import env
+import mining_pool
+from compact_log import CompactLog
+from models import Eventlog
+from pydantic_models.spectrum_filter_schema import BatchFilter, TimeFilter
+from performance_spectrum.PerformanceSpectrum import PerformanceSpectrum, PerformanceSpectrumCollection, \
+    PerformanceSpectrumBuilder, StageCache, stage_size
+from performance_spectrum.miner.BatchingEngine import BatchingEngine
+from performance_spectrum.miner.OvertakingEngine import OvertakingEngine
+from performance_spectrum.miner.SpectrumMiner import SpectrumMiner
+from performance_spectrum.miner.SpectrumPatternsMiner import SpectrumPatternsMiner
+from performance_spectrum.miner.SegmentSummaryMiner import grouped_quantile, QUARTILES
 
 
 class TestMinedDataEndpoint(unittest.TestCase):
@@ -230,6 +247,12 @@ class TestMinedDataEndpoint(unittest.TestCase):
             self.assertEqual(data['statistics']['traces_count'], variants_count)
             self.assertEqual(len(response.json()['spectra']), len(variant) - 1)
 
+            # records are numeric internally, the response still uses labels and seconds
+            record = data['records'][0]
+            self.assertEqual(set(record), {'case_ID', 'activity', 'start_timestamp', 'duration', 'end_timestamp'})
+            self.assertEqual(record['activity'], variant[0])
+            self.assertAlmostEqual(record['duration'], record['end_timestamp'] - record['start_timestamp'])
+
         filter_variant(
             ['Create Fine', 'Send Fine', 'Insert Fine Notification', 'Add penalty', 'Payment'],
             8,
@@ -242,6 +265,290 @@ class TestMinedDataEndpoint(unittest.TestCase):
             variants_count=1
         )
 
+    def test_variant_segments_come_from_the_same_cases(self):
+        # Only c1 and c3 start with the variant, c2 contains it after its first event
+        log = CompactLog.from_columns(
+            ["c1", "c1", "c1", "c2", "c2", "c2", "c2", "c3", "c3", "c3", "c3"],
+            ["A", "B", "C", "A", "A", "B", "C", "A", "B", "C", "D"],
+            pd.date_range("2021-01-01", periods=11, freq="h"),
+        )
+
+        segments = SpectrumMiner(self.event_log).filter_entire_variant(log, ["A", "B", "C"])
+
+        self.assertEqual(len(segments), 2)
+        for start, end in segments:
+            self.assertEqual(log.case_labels(log.case_codes[start]).tolist(), ["c1", "c3"])
+            np.testing.assert_array_equal(end, start + 1)
+
+    def test_records_refer_to_their_events(self):
+        log = CompactLog.from_columns(
+            ["c1", "c1", "c2", "c2", "c2", "c3", "c3"],
+            ["A", "B", "A", "B", "B", "A", "B"],
+            pd.date_range("2021-01-01", periods=7, freq="h"),
+        )
+        restricted = log.restrict(log.encode_cases(["c2", "c3"]))
+        start, end = SpectrumMiner(self.event_log).filter_segment(restricted, "A", "B")
+        records = SpectrumMiner.prepare_pms_data(log, (restricted.positions_in(log, start),
+                                                       restricted.positions_in(log, end)))
+
+        self.assertEqual(log.case_labels(records['case_code'].to_numpy()).tolist(), ["c2", "c3"])
+        np.testing.assert_array_equal(log.case_codes[records['start_position']], records['case_code'])
+        np.testing.assert_array_equal(log.activity_codes[records['start_position']], records['activity_code'])
+        np.testing.assert_array_equal(log.timestamps[records['end_position']] // 10 ** 9, records['end_timestamp'])
+
+    def test_filters_select_records(self):
+        log = CompactLog.from_columns(
+            ["c1", "c1", "c2", "c2", "c3", "c3", "c4", "c4"],
+            ["A", "B", "A", "B", "A", "B", "A", "B"],
+            pd.to_datetime(["2021-01-01 00:00", "2021-01-01 01:00", "2021-01-01 00:00", "2021-01-01 02:00",
+                            "2021-01-01 00:00", "2021-01-01 04:00", "2021-01-02 00:00", "2021-01-02 08:00"]),
+        )
+        records = SpectrumMiner.prepare_pms_data(log, log.trace_bounds())
+        original = records.copy()
+        spectrum = PerformanceSpectrum(records)
+        miner = SpectrumPatternsMiner(self.event_log)
+
+        spectrum.batches(BatchFilter(batchType="start", epsilon=0, minSamples=2), miner)
+        spectrum.cases(log.encode_cases(["c2", "c3", "c4"]))
+
+        self.assertEqual(log.case_labels(spectrum.records['case_code'].to_numpy()).tolist(), ["c2", "c3"])
+        self.assertEqual(spectrum.records['cluster'].tolist(), [0, 0])
+        self.assertEqual(miner.batch_data['frequency'], 0.75)
+        # the records of the spectrum are only selected, never modified
+        pd.testing.assert_frame_equal(spectrum.original_records, original)
+
+    def test_query_plan(self):
+        def collection():
+            query = PerformanceSpectrum.using(self.event_log).variant(
+                ['Create Fine', 'Send Fine', 'Insert Fine Notification', 'Add penalty', 'Payment'])
+            res = query.get().time(TimeFilter(time_start=datetime(2008, 1, 1), time_end=datetime(2008, 12, 1)))
+            res.on(0).quartile(0.5)
+            res.on(1).batches(BatchFilter(batchType="start", epsilon=0, minSamples=2))
+            return res
+
+        self.assertEqual(collection().explain(), [
+            'extract all [variant]',
+            'records spectrum 0 [time]',
+            'select spectrum 0 [quartile]',
+            'records spectrum 1',
+            'cluster spectrum 1',
+            'select spectrum 1 [time]',
+            'records spectrum 2 [time]',
+            'records spectrum 3 [time]',
+            'intersect all',
+            'metadata all',
+        ])
+
+        # the optimized plan builds the same spectra as the filters in the order of the request
+        logical, optimized = collection(), collection()
+        logical = logical.spectrum(logical.logical_plan()).to_response()
+        optimized = optimized.spectrum().to_response()
+        for expected, actual in zip(logical['spectra'], optimized['spectra']):
+            self.assertEqual(actual['records'], expected['records'])
+            self.assertEqual(actual['metadata'], expected['metadata'])
+
+    def test_batching_engine_matches_dbscan(self):
+        rng = np.random.default_rng(0)
+        for n, eps, min_samples in [(50, 1, 2), (400, 3600, 3), (1500, 10, 4), (1500, 0.5, 1)]:
+            # timestamps on a coarse grid, so distances of exactly eps occur
+            start = 1.2e9 + rng.integers(0, n * 10, size=n) * (eps / 2)
+            end = start + rng.choice([0, eps, 3600], size=n)
+            for values in [start.reshape(-1, 1), np.column_stack([start, end])]:
+                expected = DBSCAN(eps=eps, min_samples=min_samples).fit(values).labels_
+                algorithm = BatchingEngine.sweep if values.shape[1] == 1 else BatchingEngine.sorted_window
+                np.testing.assert_array_equal(
+                    algorithm(values[:, 0] if values.shape[1] == 1 else values, eps, min_samples), expected)
+                np.testing.assert_array_equal(BatchingEngine.labels(values, eps, min_samples), expected)
+
+    def test_sweep_statistics_match_clustering(self):
+        rng = np.random.default_rng(1)
+        values = 1.2e9 + rng.integers(0, 2000, size=500) * 5.0
+        epsilons, min_samples = [0, 0.5, 5, 12.5, 60], [1, 2, 4]
+        clusters, clustered = BatchingEngine.sweep_statistics(values, epsilons, min_samples)
+        _, group_ids, group_sizes = np.unique(values, return_inverse=True, return_counts=True)
+        for i, eps in enumerate(epsilons):
+            for j, samples in enumerate(min_samples):
+                if eps == 0:
+                    # exact matches: every group of equal values with at least min_samples values is a batch
+                    self.assertEqual(clusters[i, j], np.count_nonzero(group_sizes >= samples))
+                    self.assertEqual(clustered[i, j], np.count_nonzero(group_sizes[group_ids] >= samples))
+                    continue
+                labels = BatchingEngine.sweep(values, eps, samples)
+                self.assertEqual(clusters[i, j], labels.max() + 1)
+                self.assertEqual(clustered[i, j], np.count_nonzero(labels != -1))
+
+    def test_epsilon_sweep(self):
+        variant = ['Create Fine', 'Send Fine', 'Insert Fine Notification', 'Add penalty', 'Payment']
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/epsilon-sweep", json={
+            "global_filters": {"variant": variant},
+            "on": 1,
+            "batchType": "start",
+            "epsilons": [0, 0.5, 100000],
+            "minSamples": [2, 3],
+        })
+        self.assertEqual(response.status_code, 200)
+        sweep = response.json()['sweep']
+        self.assertEqual(len(sweep), 6)
+
+        # every point of the sweep has the batch statistics of the same batch filter
+        for point in sweep:
+            filters = {
+                "global_filters": {"variant": variant},
+                "spectra": [{"on": 1, "batches": {"batchType": "start", "epsilon": point['epsilon'],
+                                                  "minSamples": point['minSamples']}}]
+            }
+            spectrum = client.post(f"/api/event-log/{self.event_log.id}/mined-data", json=filters).json()['spectra'][1]
+            batches = spectrum['statistics']['batches']
+            if batches is None:
+                self.assertEqual(point['num_batches'], 0)
+                continue
+            self.assertEqual(point['num_batches'], batches['num_batches'])
+            self.assertAlmostEqual(point['batch_frequency'], batches['batch_frequency'])
+            self.assertAlmostEqual(point['avg_size'], batches['avg_size'])
+
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/epsilon-sweep", json={
+            "global_filters": {"variant": variant}, "on": 4, "epsilons": [1]})
+        self.assertEqual(response.status_code, 422)
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/epsilon-sweep", json={
+            "batchType": "both", "epsilons": [1]})
+        self.assertEqual(response.status_code, 422)
+
+    def test_overtaking_engine(self):
+        rng = np.random.default_rng(2)
+        for n in [0, 1, 30, 300]:
+            # few distinct timestamps, so records with the same start or end occur
+            start = 1.2e9 + rng.integers(0, 20, size=n) * 60.0
+            end = start + rng.integers(0, 20, size=n) * 60.0
+
+            fifo = OvertakingEngine.fifo_positions(start, end)
+            self.assertTrue(np.all(np.diff(start[fifo]) >= 0))
+            self.assertTrue(np.all(np.diff(end[fifo]) >= 0))
+            # length of the longest such sequence by dynamic programming over the records sorted by start
+            order = np.argsort(start, kind='quicksort')
+            longest = np.ones(n, dtype=int)
+            for i in range(n):
+                for j in range(i):
+                    if end[order[j]] <= end[order[i]]:
+                        longest[i] = max(longest[i], longest[j] + 1)
+            self.assertEqual(len(fifo), longest.max() if n else 0)
+
+            overtakes, overtaken = OvertakingEngine.overtaking_counts(start, end)
+            np.testing.assert_array_equal(
+                overtakes, ((start[None, :] < start[:, None]) & (end[None, :] > end[:, None])).sum(axis=1))
+            np.testing.assert_array_equal(
+                overtaken, ((start[None, :] > start[:, None]) & (end[None, :] < end[:, None])).sum(axis=1))
+
+    def test_fifo_analysis(self):
+        variant = ['Create Fine', 'Send Fine', 'Insert Fine Notification', 'Add penalty', 'Payment']
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/fifo", json={
+            "global_filters": {"variant": variant}, "on": 3, "windows": 4})
+        self.assertEqual(response.status_code, 200)
+        fifo = response.json()['fifo']
+        self.assertEqual(len(fifo['windows']), 4)
+
+        records = client.post(f"/api/event-log/{self.event_log.id}/mined-data", json={
+            "global_filters": {"variant": variant}, "spectra": []}).json()['spectra'][3]['records']
+        start = np.array([record['start_timestamp'] for record in records])
+        end = np.array([record['end_timestamp'] for record in records])
+        overtakes, overtaken = OvertakingEngine.overtaking_counts(start, end)
+        self.assertEqual(sum(window['records'] for window in fifo['windows']), len(records))
+        self.assertEqual(fifo['overtakings'], overtakes.sum())
+        self.assertAlmostEqual(fifo['fifo_ratio'], np.mean((overtakes == 0) & (overtaken == 0)))
+        self.assertEqual(fifo['fifo_sequence_length'], len(OvertakingEngine.fifo_positions(start, end)))
+
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/fifo", json={
+            "global_filters": {"variant": variant}, "on": 4})
+        self.assertEqual(response.status_code, 422)
+
+    def test_pattern_stream(self):
+        variant = ['Create Fine', 'Send Fine', 'Insert Fine Notification', 'Add penalty', 'Payment']
+        batches = {"batchType": "end", "epsilon": 3600 * 24 * 30, "minSamples": 2}
+        records = client.post(f"/api/event-log/{self.event_log.id}/mined-data", json={
+            "global_filters": {"variant": variant}, "spectra": []}).json()['spectra'][3]['records']
+        start = np.array([record['start_timestamp'] for record in records])
+        end = np.array([record['end_timestamp'] for record in records])
+
+        duration = 3600 * 24 * 180
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/patterns", json={
+            "global_filters": {"variant": variant}, "on": 3, "window": duration, "batches": batches})
+        self.assertEqual(response.status_code, 200)
+        windows = response.json()['windows']
+        # windows of the given length from the first start on, the last one includes the last start
+        self.assertEqual(len(windows), int(np.ceil((start.max() - start.min()) / duration)))
+        self.assertAlmostEqual(windows[0]['start'], start.min())
+        for previous, following in zip(windows, windows[1:]):
+            self.assertAlmostEqual(previous['end'] - previous['start'], duration)
+            self.assertAlmostEqual(following['start'], previous['end'])
+        self.assertGreaterEqual(windows[-1]['end'], start.max())
+        self.assertEqual(sum(window['records'] for window in windows), len(records))
+        for i, window in enumerate(windows):
+            # every window is analysed on the records starting in it, like the same analysis of only these records
+            in_window = (start >= window['start']) & ((start < window['end']) | (i == len(windows) - 1))
+            self.assertEqual(window['records'], np.count_nonzero(in_window))
+            miner = SpectrumPatternsMiner(None)
+            if window['records']:
+                _, labels = miner.cluster(batches['epsilon'], batches['minSamples'], start[in_window], end[in_window])
+                self.assertEqual(window['num_batches'], len(np.unique(labels)))
+                self.assertAlmostEqual(window['batch_frequency'], miner.batch_data['frequency'])
+                overtakes, overtaken = OvertakingEngine.overtaking_counts(start[in_window], end[in_window])
+                self.assertAlmostEqual(window['fifo_ratio'], np.mean((overtakes == 0) & (overtaken == 0)))
+            # workload counts every record in progress during the window, also records of earlier windows
+            busy = np.clip(np.minimum(end, window['end']) - np.maximum(start, window['start']), 0, None).sum()
+            self.assertAlmostEqual(window['workload'], busy / (window['end'] - window['start']))
+
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/patterns", json={
+            "global_filters": {"variant": variant}, "on": 3, "window": duration})
+        self.assertIsNone(response.json()['windows'][0]['num_batches'])
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/patterns", json={
+            "global_filters": {"variant": variant}, "on": 4, "window": duration})
+        self.assertEqual(response.status_code, 422)
+        # too short windows are rejected instead of walking the spectrum in millions of windows
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/patterns", json={
+            "global_filters": {"variant": variant}, "on": 3, "window": 1})
+        self.assertEqual(response.status_code, 422)
+
+    def test_stream_occurrences_walks_the_start_order(self):
+        rng = np.random.default_rng(0)
+        cases = np.repeat([f"c{i}" for i in range(200)], 2)
+        activities = np.tile(["A", "B"], 200)
+        timestamps = pd.Timestamp("2021-01-01", tz="UTC") + pd.to_timedelta(
+            np.sort(rng.integers(0, 3600 * 24 * 10, size=(200, 2)), axis=1).reshape(-1), unit="s")
+        log = CompactLog.from_columns(cases, activities, timestamps)
+        segment = log.directly_follows.occurrences(*log.encode_activities(["A", "B"]))
+        start = np.round(log.timestamps[segment[0]] / 1e9, 6)
+        end = np.round(log.timestamps[segment[1]] / 1e9, 6)
+        order = SpectrumMiner.start_order(log, segment)
+
+        for time_range in [None, (start.min() + 3600 * 24, start.min() + 3600 * 24 * 5)]:
+            in_range = np.ones(len(start), dtype=bool) if time_range is None else \
+                (start >= time_range[0]) & (start <= time_range[1])
+            windows = list(SpectrumMiner.stream_occurrences(log, segment, order, 3600 * 12, time_range))
+            self.assertEqual(len(windows), SpectrumMiner.count_windows(log, segment, order, 3600 * 12, time_range))
+            self.assertEqual(windows[0][0], start[in_range].min())
+            self.assertEqual(sum(len(window[2]) for window in windows), np.count_nonzero(in_range))
+            for i, (window_start, window_end, starts, ends) in enumerate(windows):
+                in_window = in_range & (start >= window_start) & ((start < window_end) | (i == len(windows) - 1))
+                np.testing.assert_array_equal(np.sort(starts), np.sort(start[in_window]))
+                np.testing.assert_array_equal(np.sort(ends), np.sort(end[in_window]))
+
+    def test_workload_diagram(self):
+        variant = ['Create Fine', 'Send Fine', 'Insert Fine Notification', 'Add penalty', 'Payment']
+        response = client.post(f"/api/event-log/{self.event_log.id}/mined-data", json={
+            "global_filters": {"variant": variant}, "spectra": []}).json()
+        for spectrum in response['spectra']:
+            start = np.array([record['start_timestamp'] for record in spectrum['records']])
+            end = np.array([record['end_timestamp'] for record in spectrum['records']])
+            chart = spectrum['statistics']['workload_diagram']
+            self.assertEqual(chart['bins'], spectrum['statistics']['frequency_diagram']['bins'])
+            self.assertEqual(len(chart['workload']), 200)
+
+            # time every record is in progress during every bin, divided by the length of the bin
+            bins = np.array(chart['bins'])
+            overlap = np.minimum(end[:, None], bins[None, 1:]) - np.maximum(start[:, None], bins[None, :-1])
+            expected = np.clip(overlap, 0, None).sum(axis=0) / np.diff(bins)
+            np.testing.assert_allclose(chart['workload'], expected, atol=1e-6)
+        self.assertGreater(max(response['spectra'][3]['statistics']['workload_diagram']['workload']), 1)
+
     def test_segment_filter_advanced(self):
         def filter_segment(start_activity, end_activity, expected_length):
             filters = {
@@ -268,6 +575,84 @@ class TestMinedDataEndpoint(unittest.TestCase):
         filter_segment('Send Fine', 'Payment', 1)
         filter_segment('Add penalty', 'Payment', 8)
 
+    def test_segment_summaries(self):
+        def mine_segment(summary, batches):
+            filters = {
+                "global_filters": {
+                    "activities": {
+                        "start_activity": summary['start_activity'],
+                        "end_activity": summary['end_activity']
+                    }
+                },
+                "spectra": [{"on": 0, "batches": batches}]
+            }
+            return client.post(f"/api/event-log/{self.event_log.id}/mined-data", json=filters).json()['spectra'][0]
+
+        # exact matches are counted over all segments at once, other batches are clustered per segment
+        for batches in [{"batchType": "start", "epsilon": 0, "minSamples": 2},
+                        {"batchType": "both", "epsilon": 10, "minSamples": 2}]:
+            response = client.post(f"/api/event-log/{self.event_log.id}/segments", json={"batches": batches})
+            self.assertEqual(response.status_code, 200)
+
+            summaries = response.json()['segments']
+            self.assertEqual(len(summaries), 9)
+            for summary in summaries:
+                unfiltered = mine_segment(summary, None)
+                self.assertEqual(summary['count'], len(unfiltered['records']))
+                self.assertEqual(summary['quartiles'], unfiltered['metadata']['quartiles'])
+                self.assertEqual(summary['min_timestamp'], unfiltered['metadata']['min_timestamp'])
+                self.assertEqual(summary['max_timestamp'], unfiltered['metadata']['max_timestamp'])
+                # segments without batches have no batch statistics
+                batch_statistics = mine_segment(summary, batches)['statistics']['batches']
+                self.assertEqual(summary['batch_frequency'], batch_statistics['batch_frequency']
+                                 if batch_statistics is not None else 0)
+
+        summaries = client.post(f"/api/event-log/{self.event_log.id}/segments", json={}).json()['segments']
+        create_fine = next(summary for summary in summaries
+                           if summary['start_activity'] == 'Create Fine' and summary['end_activity'] == 'Send Fine')
+        self.assertEqual(create_fine['count'], 10)
+        self.assertIsNone(create_fine['batch_frequency'])
+
+    def test_segment_summaries_time_filter(self):
+        time_range = {"time_start": "2009-01-01T00:00:00", "time_end": "2009-02-01T00:00:00"}
+        response = client.post(f"/api/event-log/{self.event_log.id}/segments", json={"time": time_range})
+        self.assertEqual(response.status_code, 200)
+
+        start, end = (datetime.fromisoformat(time_range[key]).timestamp() for key in ["time_start", "time_end"])
+        for summary in response.json()['segments']:
+            self.assertGreaterEqual(summary['min_timestamp'], start)
+            self.assertLessEqual(summary['min_timestamp'], end)
+
+        # batches are found before the time filter applies, like the batch filter of mined-data does
+        batches = {"batchType": "end", "epsilon": 3600 * 24 * 30, "minSamples": 2}
+        response = client.post(f"/api/event-log/{self.event_log.id}/segments", json={"time": time_range,
+                                                                                     "batches": batches})
+        self.assertEqual(response.status_code, 200)
+        for summary in response.json()['segments']:
+            spectrum = client.post(f"/api/event-log/{self.event_log.id}/mined-data", json={
+                "global_filters": {
+                    "activities": {"start_activity": summary['start_activity'],
+                                   "end_activity": summary['end_activity']},
+                    "time": time_range
+                },
+                "spectra": [{"on": 0, "batches": batches}]
+            }).json()['spectra'][0]
+            batch_statistics = spectrum['statistics']['batches']
+            self.assertEqual(summary['batch_frequency'], batch_statistics['batch_frequency']
+                             if batch_statistics is not None else 0)
+
+    def test_grouped_quantile_matches_pandas(self):
+        rng = np.random.default_rng(0)
+        counts = rng.integers(1, 12, size=50)
+        groups = np.repeat(np.arange(len(counts)), counts)
+        values = rng.integers(0, 1000, size=len(groups)).astype(float)
+        values = values[np.lexsort((values, groups))]
+        group_starts = np.cumsum(counts) - counts
+
+        for q in QUARTILES:
+            expected = pd.Series(values).groupby(groups).quantile(q).to_numpy()
+            np.testing.assert_array_equal(grouped_quantile(values, group_starts, counts, q), expected)
+
     def test_basic_statistics(self):
         filters = {
             "global_filters": {},
@@ -336,4 +721,80 @@ class TestMinedDataEndpoint(unittest.TestCase):
             "variance": 2127588249600.0
         }
 
-        self.assertEqual(data['metadata'], expected_metadata)
\ No newline at end of file
+        self.assertEqual(data['metadata'], expected_metadata)
+
+    def test_stage_cache(self):
+        def mine(epsilon):
+            filters = {
+                "global_filters": {
+                    "variant": ['Create Fine', 'Send Fine', 'Insert Fine Notification', 'Add penalty', 'Payment']
+                },
+                "spectra": [{"on": 0, "quartile": 0.75},
+                            {"on": 1, "batches": {"batchType": "start", "epsilon": epsilon, "minSamples": 2}}]
+            }
+            return client.post(f"/api/event-log/{self.event_log.id}/mined-data", json=filters).json()
+
+        PerformanceSpectrumCollection.stage_cache.clear()
+        expected = [mine(epsilon) for epsilon in [0.5, 10]]
+
+        # a request that only changes the batch filter reuses the records, which are built once per spectrum
+        PerformanceSpectrumCollection.stage_cache.clear()
+        with mock.patch.object(SpectrumMiner, "prepare_pms_data", wraps=SpectrumMiner.prepare_pms_data) as prepare:
+            responses = [mine(epsilon) for epsilon in [0.5, 10, 0.5]]
+        self.assertEqual(prepare.call_count, 4)
+        self.assertEqual(responses, [*expected, expected[0]])
+
+    def test_results_larger_than_cache_budget(self):
+        filters = {
+            "global_filters": {
+                "variant": ['Create Fine', 'Send Fine', 'Insert Fine Notification', 'Add penalty', 'Payment']
+            },
+            "spectra": [{"on": 1, "batches": {"batchType": "start", "epsilon": 10, "minSamples": 2}}]
+        }
+        url = f"/api/event-log/{self.event_log.id}/mined-data"
+        expected = client.post(url, json=filters).json()
+
+        # results that do not fit into the budget are used without being cached
+        segments, stages = StageCache(256), StageCache(256)
+        with mock.patch.object(PerformanceSpectrumBuilder, "cache", segments), \
+                mock.patch.object(PerformanceSpectrumCollection, "stage_cache", stages):
+            response = client.post(url, json=filters)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(len(segments), 0)
+        self.assertTrue(all(stage_size(value) <= 256 for value in stages.values()))
+        self.assertLessEqual(stages.currsize, 256)
+
+    def test_missing_spectrum_in_process_pool(self):
+        # the error of a worker process reaches the client like the error of in-process mining
+        with mock.patch.object(env, "MINING_PROCESS_POOL", True), mock.patch.object(env, "MINING_WORKERS", 1):
+            try:
+                response = client.post(f"/api/event-log/{self.event_log.id}/mined-data/epsilon-sweep", json={
+                    "on": 1, "epsilons": [1]})
+            finally:
+                mining_pool.shutdown()
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()["detail"], "Spectrum not found")
+
+    def test_process_pool_matches_in_process_mining(self):
+        filters = {
+            "global_filters": {
+                "variant": ['Create Fine', 'Send Fine', 'Insert Fine Notification', 'Add penalty', 'Payment']
+            },
+            "spectra": [{"on": 1, "batches": {"batchType": "end", "epsilon": 0, "minSamples": 2}}]
+        }
+        url = f"/api/event-log/{self.event_log.id}/mined-data"
+        expected = client.post(url, json=filters).json()
+
+        with mock.patch.object(env, "MINING_PROCESS_POOL", True), mock.patch.object(env, "MINING_WORKERS", 1):
+            try:
+                response = client.post(url, json=filters)
+                export = client.post(url + "/export", json=filters)
+            finally:
+                mining_pool.shutdown()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(export.status_code, 200)
+        self.assertTrue(os.path.isfile(os.path.join("exports", export.json())))
+        os.remove(os.path.join("exports", export.json()))
@@ -1,15 +1,31 @@
+import time
 import unittest
-from test_setup import client
+from test_setup import client, TestingSessionLocal
 import os
 import env
 import constants
 
+import numpy as np
+import pandas as pd
+
+import compact_log
 import event_log_cache
+import ingestion
+import log_snapshot
+from models import Eventlog
+from performance_spectrum.PerformanceSpectrum import PerformanceSpectrumBuilder, PerformanceSpectrumCollection
 
 class TestEventLogUpload(unittest.TestCase):
 
     def setUp(self) -> None:
         event_log_cache.cache.clear()
+        PerformanceSpectrumBuilder.cache.clear()
+        PerformanceSpectrumCollection.stage_cache.clear()
+        # Uploads with the same content share their file, so no event logs of other tests must reference it
+        db = TestingSessionLocal()
+        db.query(Eventlog).delete()
+        db.commit()
+        db.close()
 
     @staticmethod
     def setup_uploaded_log(path, upload_name="simple-log.xes"):
@@ -80,3 +96,216 @@ class TestEventLogUpload(unittest.TestCase):
         response = client.get(f"/api/event-log/basic/{event_log_id}")
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json()["detail"]["err"], constants.INVALID_EVENT_LOG_ERROR)
+
+    @staticmethod
+    def wait_for_ingestion(event_log_id):
+        for _ in range(100):
+            status = client.get(f"/api/event-log/{event_log_id}/ingestion").json()
+            if status["state"] in (ingestion.DONE, ingestion.FAILED):
+                return status
+            time.sleep(0.05)
+        raise AssertionError("ingestion did not finish")
+
+    def test_upload_ingests_log_in_background(self):
+        event_log_id = self.setup_uploaded_log("simple-log.xes").json()["id"]
+        status = self.wait_for_ingestion(event_log_id)
+        self.assertEqual(status["state"], ingestion.DONE)
+        self.assertEqual(status["progress"], 1.0)
+
+        # metadata was precomputed by the job
+        data = client.get(f"/api/event-log/{event_log_id}/data").json()
+        self.assertEqual(data["entry_count"], 12)
+        self.assertEqual(data["column_count"], 18)
+
+    def test_failed_ingestion_is_reported(self):
+        event_log_id = self.setup_uploaded_log("too_few_columns.xes").json()["id"]
+        status = self.wait_for_ingestion(event_log_id)
+        self.assertEqual(status["state"], ingestion.FAILED)
+        self.assertEqual(status["error"]["err"], constants.INVALID_EVENT_LOG_ERROR)
+
+    def test_mining_is_rejected_while_ingesting(self):
+        event_log_id = self.setup_uploaded_log("simple-log.xes").json()["id"]
+        self.wait_for_ingestion(event_log_id)
+        with ingestion.lock:
+            ingestion.jobs[event_log_id] = ingestion.IngestionJob(event_log_id=event_log_id, state=ingestion.RUNNING)
+
+        response = client.post(f"/api/event-log/{event_log_id}/mined-data", json={"global_filters": {}, "spectra": []})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["detail"]["err"], constants.INGESTING_ERROR)
+        ingestion.forget(event_log_id)
+
+    def test_delete_and_append_are_rejected_while_ingesting(self):
+        event_log_id = self.setup_uploaded_log("advanced-log.xes").json()["id"]
+        self.wait_for_ingestion(event_log_id)
+        path = client.get(f"/api/event-log/{event_log_id}/data").json()["path"]
+        with ingestion.lock:
+            ingestion.jobs[event_log_id] = ingestion.IngestionJob(event_log_id=event_log_id, state=ingestion.RUNNING)
+
+        response = client.delete(f"/api/delete-event-log/{event_log_id}")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["detail"]["err"], constants.INGESTING_ERROR)
+        self.assertTrue(os.path.isfile(os.path.join(env.UPLOAD_DIR, path)))
+        with open(os.path.join("resources", "advanced-log-append.xes"), "rb") as f:
+            response = client.post(f"/api/event-log/{event_log_id}/append",
+                                   files={"file": ("advanced-log-append.xes", f, 'application/xes')})
+        self.assertEqual(response.status_code, 409)
+
+        # the running job is kept, a second job of the same log is not queued
+        with self.assertRaises(ingestion.IngestionInProgress):
+            ingestion.submit(event_log_id, lambda job: None)
+        self.assertEqual(ingestion.get_job(event_log_id).state, ingestion.RUNNING)
+
+        ingestion.forget(event_log_id)
+        self.assertEqual(client.delete(f"/api/delete-event-log/{event_log_id}").status_code, 200)
+
+    def test_same_content_is_stored_once(self):
+        first = self.setup_uploaded_log("advanced-log.xes").json()
+        second = self.setup_uploaded_log("advanced-log.xes", upload_name="copy.xes").json()
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertEqual(first["path"], second["path"])
+        self.assertNotEqual(first["path"], self.setup_uploaded_log("simple-log.xes").json()["path"])
+
+        for event_log_id in (first["id"], second["id"]):
+            self.assertEqual(self.wait_for_ingestion(event_log_id)["state"], ingestion.DONE)
+        self.assertIn(first["path"], event_log_cache.cache)
+
+    def test_shared_upload_is_removed_with_last_reference(self):
+        first = self.setup_uploaded_log("advanced-log.xes").json()
+        second = self.setup_uploaded_log("advanced-log.xes").json()
+        for event_log_id in (first["id"], second["id"]):
+            self.wait_for_ingestion(event_log_id)
+        file_location = os.path.join(env.UPLOAD_DIR, first["path"])
+        snapshot = log_snapshot.snapshot_dir(first["path"])
+
+        self.assertEqual(client.delete(f"/api/delete-event-log/{first['id']}").status_code, 200)
+        self.assertTrue(os.path.isfile(file_location))
+        self.assertTrue(os.path.isdir(snapshot))
+        self.assertEqual(client.get(f"/api/event-log/basic/{second['id']}").status_code, 200)
+
+        self.assertEqual(client.delete(f"/api/delete-event-log/{second['id']}").status_code, 200)
+        self.assertFalse(os.path.exists(file_location))
+        self.assertFalse(os.path.exists(snapshot))
+        self.assertNotIn(first["path"], event_log_cache.cache)
+
+    def append_events(self, event_log_id, path="advanced-log-append.xes"):
+        with open(os.path.join("resources", path), "rb") as f:
+            response = client.post(
+                f"/api/event-log/{event_log_id}/append",
+                files={"file": (path, f, 'application/xes')},
+            )
+        self.assertEqual(response.status_code, 200)
+        return self.wait_for_ingestion(event_log_id)
+
+    def test_append_events(self):
+        first = self.setup_uploaded_log("advanced-log.xes").json()
+        second = self.setup_uploaded_log("advanced-log.xes").json()
+        for event_log_id in (first["id"], second["id"]):
+            self.wait_for_ingestion(event_log_id)
+        mine = lambda filters: client.post(f"/api/event-log/{first['id']}/mined-data", json={
+            "global_filters": filters, "spectra": []}).json()["spectra"][0]
+        self.assertEqual(len(mine({"cases": ["A33939"]})["records"]), 1)
+
+        self.assertEqual(self.append_events(first["id"])["state"], ingestion.DONE)
+        data = client.get(f"/api/event-log/{first['id']}/data").json()
+        self.assertEqual(data["entry_count"], 55)
+        self.assertNotEqual(data["path"], first["path"])
+
+        # the other event log of the previous upload is unchanged
+        self.assertEqual(client.get(f"/api/event-log/{second['id']}/data").json()["path"], first["path"])
+        self.assertTrue(os.path.isfile(os.path.join(env.UPLOAD_DIR, first["path"])))
+
+        # the merged log is the same as the one parsed from the merged upload
+        self.served_equals_parsed_log(first["id"])
+        db = TestingSessionLocal()
+        event_log = db.query(Eventlog).filter(Eventlog.id == first["id"]).first()
+        log = event_log_cache.get_compact_log(event_log)
+        parsed = event_log_cache.parse_log(event_log.path)
+        db.close()
+        expected = compact_log.CompactLog.from_columns(
+            parsed["case:concept:name"], parsed["concept:name"], parsed["time:timestamp"])
+        for name in ["rows", "case_codes", "cases", "activity_codes", "activities", "timestamps", "offsets"]:
+            np.testing.assert_array_equal(getattr(log, name), getattr(expected, name))
+
+        record = mine({"cases": ["A33939"]})["records"][0]
+        self.assertEqual(record["end_timestamp"], 1231977600.0)
+        self.assertEqual(len(mine({"cases": ["A00001"]})["records"]), 1)
+        self.assertEqual(len(mine({"activities": {"start_activity": "Create Fine", "end_activity": "Send Fine"}})[
+                                 "records"]), 11)
+
+    def test_append_keeps_unaffected_cached_segments(self):
+        event_log_id = self.setup_uploaded_log("advanced-log.xes").json()["id"]
+        self.wait_for_ingestion(event_log_id)
+        filters = [
+            {"activities": {"start_activity": "Send Fine", "end_activity": "Payment"}},
+            {"activities": {"start_activity": "Create Fine", "end_activity": "Send Fine"}},
+            {"cases": ["S126661"]},
+            {"cases": ["A33939"]},
+        ]
+        for global_filters in filters:
+            client.post(f"/api/event-log/{event_log_id}/mined-data", json={"global_filters": global_filters,
+                                                                          "spectra": []})
+
+        self.append_events(event_log_id)
+        db = TestingSessionLocal()
+        event_log = db.query(Eventlog).filter(Eventlog.id == event_log_id).first()
+        builder = PerformanceSpectrumBuilder(event_log)
+        db.close()
+        cached = [key[1:] for key in builder.cache if key[0] == builder.get_log_key()]
+        self.assertEqual(sorted(cached), [((), (), ("Send Fine", "Payment")), (("S126661",), (), ())])
+
+        # carried over segments point to the same events as recomputed ones
+        for global_filters in filters:
+            response = client.post(f"/api/event-log/{event_log_id}/mined-data", json={"global_filters": global_filters,
+                                                                                     "spectra": []}).json()
+            builder.cache.clear()
+            PerformanceSpectrumCollection.stage_cache.clear()
+            expected = client.post(f"/api/event-log/{event_log_id}/mined-data", json={"global_filters": global_filters,
+                                                                                     "spectra": []}).json()
+            self.assertEqual(response["spectra"], expected["spectra"])
+
+    def served_equals_parsed_log(self, event_log_id):
+        # the cached frame and the snapshot are the frame a parse of the merged upload yields
+        db = TestingSessionLocal()
+        event_log = db.query(Eventlog).filter(Eventlog.id == event_log_id).first()
+        parsed = event_log_cache.parse_log(event_log.path)
+        pd.testing.assert_frame_equal(event_log_cache.get_log_data(event_log), parsed)
+        pd.testing.assert_frame_equal(log_snapshot.read_snapshot(os.path.join(env.UPLOAD_DIR, event_log.path),
+                                                                 log_snapshot.snapshot_dir(event_log.path)), parsed)
+        db.close()
+        return parsed
+
+    def test_append_skips_the_header_of_the_appended_file(self):
+        event_log_id = self.setup_uploaded_log("advanced-log.xes").json()["id"]
+        self.wait_for_ingestion(event_log_id)
+        with open(os.path.join("resources", "advanced-log-append.xes"), "rb") as f:
+            content = f.read()
+        # a trace tag in a comment of the header is not where the traces start
+        content = content.replace(b"<log ", b"<!-- <trace> --><log ", 1).replace(
+            b'<string key="origin"', b'<!-- <trace> --><string key="origin"', 1)
+        # a new attribute and an attribute of another type than in the stored upload
+        content = content.replace(b'<float key="amount" value="35.0" />',
+                                  b'<string key="amount" value="35 EUR" /><int key="priority" value="2" />', 1)
+        part = os.path.join(env.UPLOAD_DIR, "commented-append.xes")
+        with open(part, "wb") as f:
+            f.write(content)
+
+        with open(part, "rb") as f:
+            response = client.post(f"/api/event-log/{event_log_id}/append",
+                                   files={"file": ("commented-append.xes", f, 'application/xes')})
+        os.remove(part)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.wait_for_ingestion(event_log_id)["state"], ingestion.DONE)
+        self.assertEqual(client.get(f"/api/event-log/{event_log_id}/data").json()["entry_count"], 55)
+        parsed = self.served_equals_parsed_log(event_log_id)
+        self.assertEqual(parsed["priority"].count(), 1)
+        self.assertIn("35 EUR", parsed["amount"].tolist())
+
+    def test_append_invalid_file(self):
+        event_log_id = self.setup_uploaded_log("advanced-log.xes").json()["id"]
+        self.wait_for_ingestion(event_log_id)
+        path = client.get(f"/api/event-log/{event_log_id}/data").json()["path"]
+
+        status = self.append_events(event_log_id, "too_few_columns.xes")
+        self.assertEqual(status["state"], ingestion.FAILED)
+        self.assertEqual(status["error"]["err"], constants.INVALID_EVENT_LOG_ERROR)
+        self.assertEqual(client.get(f"/api/event-log/{event_log_id}/data").json()["path"], path)
@@ -1,7 +1,7 @@
 import axios from "axios";
 import {useErrorState} from "@/composables/useErrorState.js";
 import router from "@/routes.js";
-import {NOT_CONFIGURED_ERROR} from "@/constants.js";
+import {INGESTING_ERROR, NOT_CONFIGURED_ERROR} from "@/constants.js";
 
 const {showError} = useErrorState()
 const axiosInstance = axios.create({
@@ -21,6 +21,9 @@ axiosInstance.interceptors.response.use(
                 showError('Eventlog is not sufficiently configured')
                 router.replace({name: 'ChooseFields', params: {id: error.response.data.detail.id}})
                 return Promise.reject(error);
+            } else if (error.response.status === 409 && error.response.data.detail.err === INGESTING_ERROR) {
+                showError('The event log is still being processed, please try again in a moment')
+                return Promise.reject(error);
             } else if (error.response.status === 404) {
                 showError('The requested resource was not found')
                 router.replace({name: 'NotFound'})
@@ -1,5 +1,6 @@
 export const NOT_CONFIGURED_ERROR = "invalid_metadata"
 export const INVALID_EVENT_LOG_ERROR = "invalid_event_log"
+export const INGESTING_ERROR = "event_log_ingesting"
 
 export function formatHighestUnitTime(seconds) {
     // Time units: seconds, minutes, hours, days